@@ -124,7 +124,7 @@ DEFAULT_FROM_EMAIL = os.getenv('DEFAULT_FROM_EMAIL', EMAIL_HOST_USER)
 
 # REST Framework
 REST_FRAMEWORK = {
-    'DEFAULT_PAGINATION_CLASS': 'rest_framework.pagination.PageNumberPagination',
+    'DEFAULT_PAGINATION_CLASS': 'procurement.pagination.CountModePagination',
     'PAGE_SIZE': int(os.getenv('PAGE_SIZE', '40')),
     'DEFAULT_RENDERER_CLASSES': (
         'rest_framework.renderers.JSONRenderer',
@@ -148,6 +148,48 @@ REST_FRAMEWORK = {
     }
 }
 
+# Режим count в списках по умолчанию: exact, cached, estimated или none (procurement.pagination)
+PAGINATION_COUNT_MODE = os.getenv('PAGINATION_COUNT_MODE', 'exact')
+# Время жизни count в режиме cached (секунды)
+COUNT_CACHE_TIMEOUT = int(os.getenv('COUNT_CACHE_TIMEOUT', '60'))
+# Оценку планировщика меньше порога заменяет точный COUNT(*)
+COUNT_ESTIMATE_THRESHOLD = int(os.getenv('COUNT_ESTIMATE_THRESHOLD', '1000'))
+
+# Импорт прайс-листов: размер пачки для bulk_create
+IMPORT_BATCH_SIZE = int(os.getenv('IMPORT_BATCH_SIZE', '1000'))
+
+# Выгрузка каталога: строк в пачке чтения курсором и сериализации
+EXPORT_CHUNK_SIZE = int(os.getenv('EXPORT_CHUNK_SIZE', '2000'))
+
+# Кэш: Redis при заданном CACHE_REDIS_URL, иначе память процесса
+CACHE_REDIS_URL = os.getenv('CACHE_REDIS_URL', '')
+if CACHE_REDIS_URL:
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+            'LOCATION': CACHE_REDIS_URL,
+        }
+    }
+else:
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        }
+    }
+# Кэш общий для веб-процессов и Celery. Версии каталога в памяти процесса не видят
+# изменений из других процессов, поэтому без общего кэша страницы каталога не кэшируются
+CACHE_SHARED = bool(CACHE_REDIS_URL)
+
+# Кэш страниц каталога: время жизни и ожидание страницы, которую строит другой запрос (секунды)
+CATALOG_CACHE_TIMEOUT = int(os.getenv('CATALOG_CACHE_TIMEOUT', '300'))
+CATALOG_CACHE_LOCK_TIMEOUT = int(os.getenv('CATALOG_CACHE_LOCK_TIMEOUT', '10'))
+
+# Хранилище корзин: db - Order и OrderItem в БД, redis - хеши Redis с выгрузкой в БД
+BASKET_BACKEND = os.getenv('BASKET_BACKEND', 'db')
+BASKET_REDIS_URL = os.getenv('BASKET_REDIS_URL', CACHE_REDIS_URL)
+# Интервал выгрузки измененных корзин из Redis в БД, секунды
+BASKET_FLUSH_INTERVAL = int(os.getenv('BASKET_FLUSH_INTERVAL', '300'))
+
 # CORS settings
 CORS_ALLOW_ALL_ORIGINS = True  # Для разработки, в production нужно ограничить
 
@@ -161,6 +203,12 @@ CELERY_ACCEPT_CONTENT = ['json']
 CELERY_TASK_SERIALIZER = 'json'
 CELERY_RESULT_SERIALIZER = 'json'
 CELERY_TIMEZONE = TIME_ZONE
+CELERY_BEAT_SCHEDULE = {
+    'flush-baskets': {
+        'task': 'procurement.tasks.flush_baskets_async',
+        'schedule': BASKET_FLUSH_INTERVAL,
+    },
+}
 
 # Для разработки - синхронный режим (отладочный)
 CELERY_TASK_ALWAYS_EAGER = False  # Если DEBUG=True, задачи выполняются сразу
@@ -1,5 +1,8 @@
 from django.contrib import admin
-from .models import User, Shop, Category, Product, ProductInfo, Parameter, ProductParameter, Contact, Order, OrderItem
+from .catalog import refresh_catalog_ids
+from .pagination import EstimatedCountPaginator
+from .models import User, Shop, Category, Product, ProductInfo, Parameter, ProductParameter, Contact, Order, OrderItem, \
+    ImportJob
 
 @admin.register(User)
 class UserAdmin(admin.ModelAdmin):
@@ -30,6 +33,20 @@ class ProductInfoAdmin(admin.ModelAdmin):
     list_display = ['product', 'shop', 'price', 'price_rrc', 'quantity']
     list_filter = ['shop']
     search_fields = ['product__name', 'shop__name']
+    # Большие таблицы: число строк по оценке планировщика вместо COUNT(*) на каждой странице
+    paginator = EstimatedCountPaginator
+    show_full_result_count = False
+
+    # Удаление из админки убирает предложение и из плоского каталога
+    def delete_model(self, request, obj):
+        product_info_id = obj.id
+        super().delete_model(request, obj)
+        refresh_catalog_ids([product_info_id])
+
+    def delete_queryset(self, request, queryset):
+        product_info_ids = list(queryset.values_list('id', flat=True))
+        super().delete_queryset(request, queryset)
+        refresh_catalog_ids(product_info_ids)
 
 @admin.register(Parameter)
 class ParameterAdmin(admin.ModelAdmin):
@@ -41,6 +58,8 @@ class ProductParameterAdmin(admin.ModelAdmin):
     list_display = ['product_info', 'parameter', 'value']
     list_filter = ['parameter']
     search_fields = ['product_info__product__name', 'parameter__name']
+    paginator = EstimatedCountPaginator
+    show_full_result_count = False
 
 @admin.register(Contact)
 class ContactAdmin(admin.ModelAdmin):
@@ -53,9 +72,19 @@ class OrderAdmin(admin.ModelAdmin):
     list_display = ['id', 'user', 'status', 'created_at']
     list_filter = ['status', 'created_at']
     search_fields = ['user__email']
+    paginator = EstimatedCountPaginator
+    show_full_result_count = False
 
 @admin.register(OrderItem)
 class OrderItemAdmin(admin.ModelAdmin):
     list_display = ['order', 'product_info', 'quantity']
     list_filter = ['order__status']
-    search_fields = ['order__user__email', 'product_info__product__name']
\ No newline at end of file
+    search_fields = ['order__user__email', 'product_info__product__name']
+    paginator = EstimatedCountPaginator
+    show_full_result_count = False
+
+@admin.register(ImportJob)
+class ImportJobAdmin(admin.ModelAdmin):
+    list_display = ['id', 'user', 'mode', 'state', 'processed', 'total', 'created_at']
+    list_filter = ['state', 'mode']
+    search_fields = ['user__email']
@@ -0,0 +1,444 @@
+"""
+Хранилища корзины покупателя.
+
+db - корзина в БД: Order(status='basket') и OrderItem, как раньше.
+redis - корзина в хеше Redis basket:<id пользователя> {id предложения: количество}:
+изменения атомарны (HINCRBY, HDEL) и не трогают БД. Строки Order и OrderItem
+создаются только при подтверждении заказа (materialize) и периодической
+выгрузкой измененных корзин (задача flush_baskets).
+
+Хранилище выбирает настройка BASKET_BACKEND; без BASKET_REDIS_URL всегда
+используется БД.
+"""
+from django.conf import settings
+from django.db import IntegrityError, connection, transaction
+from django.db.models import Case, DecimalField, ExpressionWrapper, F, IntegerField, Sum, Value, When
+from django.utils import timezone
+
+from .models import Order, OrderItem, ProductInfo, User
+from .signals import order_items_bulk
+
+BASKET_KEY_PREFIX = 'basket'
+# Пользователи, чьи корзины изменились после последней выгрузки в БД
+DIRTY_KEY = f'{BASKET_KEY_PREFIX}:dirty'
+
+# Вычитает подтвержденные количества и удаляет исчерпанные позиции одной атомарной операцией:
+# товары, добавленные во время подтверждения заказа, остаются в корзине
+# KEYS: корзина, версия, DIRTY_KEY; ARGV: id пользователя, затем пары id предложения и количество
+SUBTRACT_SCRIPT = """
+for i = 2, #ARGV, 2 do
+    local left = redis.call('HINCRBY', KEYS[1], ARGV[i], -tonumber(ARGV[i + 1]))
+    if left <= 0 then
+        redis.call('HDEL', KEYS[1], ARGV[i])
+    end
+end
+redis.call('SADD', KEYS[3], ARGV[1])
+return redis.call('INCR', KEYS[2])
+"""
+
+# Стоимость позиции в SQL: количество x цена предложения
+TOTAL_PRICE_FIELD = DecimalField(max_digits=20, decimal_places=2)
+
+
+def line_total(quantity, price):
+    return ExpressionWrapper(quantity * F(price), output_field=TOTAL_PRICE_FIELD)
+
+
+_redis = None
+
+
+# Операции пакетного изменения корзины: прибавить количество, заменить его, удалить позицию
+BATCH_OPS = ('add', 'set', 'remove')
+BATCH_MAX_LINES = 500
+
+
+def parse_quantity(value):
+    """Количество из запроса (в данных формы - строка): целое больше нуля или None"""
+    if isinstance(value, bool):
+        return None
+    try:
+        quantity = int(value)
+    except (TypeError, ValueError):
+        return None
+    return quantity if quantity > 0 else None
+
+
+def parse_id(value):
+    """id из запроса: целое число или строка из цифр больше нуля, иначе None"""
+    if isinstance(value, int) and not isinstance(value, bool):
+        pk = value
+    elif isinstance(value, str) and value.strip().isdigit():
+        pk = int(value)
+    else:
+        return None
+    return pk if pk > 0 else None
+
+
+def parse_batch(lines):
+    """
+    Строки пакетного изменения [{product_info_id, quantity, op}] (op по умолчанию add)
+    сворачиваются по предложениям в порядке следования: {id предложения: (операция, количество)}.
+    Возвращает (изменения, текст ошибки или None)
+    """
+    if not isinstance(lines, list) or not lines:
+        return None, 'Ожидается непустой список items'
+    if len(lines) > BATCH_MAX_LINES:
+        return None, f'Не больше {BATCH_MAX_LINES} строк за запрос'
+
+    changes = {}
+    for number, line in enumerate(lines, 1):
+        if not isinstance(line, dict):
+            return None, f'Строка {number}: ожидается объект'
+        op = line.get('op', 'add')
+        if op not in BATCH_OPS:
+            return None, f'Строка {number}: неизвестная операция {op!r}. Допустимые: {list(BATCH_OPS)}'
+        product_info_id = parse_id(line.get('product_info_id'))
+        if product_info_id is None:
+            return None, f'Строка {number}: неверный product_info_id'
+        if op == 'remove':
+            changes[product_info_id] = ('remove', 0)
+            continue
+        quantity = parse_quantity(line.get('quantity', 1))
+        if quantity is None:
+            return None, f'Строка {number}: количество должно быть целым числом больше нуля'
+
+        previous, previous_quantity = changes.get(product_info_id, (None, 0))
+        if op == 'set' or previous == 'remove':
+            changes[product_info_id] = ('set', quantity)
+        else:
+            changes[product_info_id] = (previous or 'add', previous_quantity + quantity)
+    return changes, None
+
+
+def _split_changes(changes):
+    """{id: (операция, количество)} -> прибавляемые, заменяемые, удаляемые"""
+    added = {product_info_id: quantity for product_info_id, (op, quantity) in changes.items() if op == 'add'}
+    replaced = {product_info_id: quantity for product_info_id, (op, quantity) in changes.items() if op == 'set'}
+    removed = [product_info_id for product_info_id, (op, quantity) in changes.items() if op == 'remove']
+    return added, replaced, removed
+
+
+def upsert_items(order_id, quantities, increment=True):
+    """
+    Записывает позиции заказа {id предложения: количество} одним INSERT ... ON CONFLICT
+    по (order, product_info) на пачку: increment - количество прибавляется к имеющемуся,
+    иначе заменяет его. Одновременные добавления не теряют друг друга. Время изменения
+    заказа обновляется здесь: сигналы OrderItem при такой записи не вызываются
+    """
+    if not quantities:
+        return
+    _write_items(order_id, quantities, increment)
+    _touch_order(order_id)
+
+
+def _write_items(order_id, quantities, increment):
+    if not quantities:
+        return
+    if not connection.features.supports_update_conflicts_with_target:
+        _update_or_create_items(order_id, quantities, increment)
+    else:
+        table = OrderItem._meta.db_table
+        quantity = f'{table}.quantity + EXCLUDED.quantity' if increment else 'EXCLUDED.quantity'
+        fields = [OrderItem._meta.get_field(name) for name in ('order', 'product_info', 'quantity')]
+        rows = list(quantities.items())
+        batch_size = connection.ops.bulk_batch_size(fields, rows)
+        with connection.cursor() as cursor:
+            for start in range(0, len(rows), batch_size):
+                batch = rows[start:start + batch_size]
+                cursor.execute(
+                    f'INSERT INTO {table} (order_id, product_info_id, quantity) '
+                    f'VALUES {", ".join(["(%s, %s, %s)"] * len(batch))} '
+                    f'ON CONFLICT (order_id, product_info_id) DO UPDATE SET quantity = {quantity}',
+                    [value for product_info_id, count in batch for value in (order_id, product_info_id, count)]
+                )
+
+
+def _delete_items(order_id, product_info_ids):
+    """
+    Удаляет позиции заказа одним DELETE. Время изменения заказа
+    обновляет вызывающий код: post_delete на каждую позицию его не трогает
+    """
+    if product_info_ids:
+        with order_items_bulk():
+            OrderItem.objects.filter(order_id=order_id, product_info_id__in=product_info_ids).delete()
+
+
+def _touch_order(order_id):
+    """Время изменения заказа для ETag: при записи позиций мимо сигналов OrderItem"""
+    Order.objects.filter(id=order_id).update(updated_at=timezone.now())
+
+
+def _update_or_create_items(order_id, quantities, increment):
+    """СУБД без ON CONFLICT: UPDATE с F(), при отсутствии строки - INSERT, при гонке - UPDATE повторно"""
+    for product_info_id, quantity in quantities.items():
+        items = OrderItem.objects.filter(order_id=order_id, product_info_id=product_info_id)
+        value = F('quantity') + quantity if increment else quantity
+        if items.update(quantity=value):
+            continue
+        try:
+            with transaction.atomic():
+                OrderItem.objects.bulk_create([OrderItem(order_id=order_id, product_info_id=product_info_id,
+                                                         quantity=quantity)])
+        except IntegrityError:
+            items.update(quantity=value)
+
+
+def get_redis():
+    """Клиент Redis корзин (один на процесс)"""
+    global _redis
+    if _redis is None:
+        import redis
+        _redis = redis.Redis.from_url(settings.BASKET_REDIS_URL, decode_responses=True)
+    return _redis
+
+
+class DatabaseBasket:
+    """Корзина в БД"""
+
+    def __init__(self, user):
+        self.user = user
+
+    def queryset(self):
+        """Позиции корзины; заказ-корзина не создается"""
+        return OrderItem.objects.filter(order__user=self.user, order__status='basket')
+
+    def items(self):
+        """{id предложения: количество}"""
+        return dict(self.queryset().values_list('product_info_id', 'quantity'))
+
+    def order_items(self):
+        """Позиции корзины со стоимостью line_total, в порядке добавления"""
+        return self.queryset().annotate(line_total=line_total(F('quantity'), 'product_info__price')).order_by('id')
+
+    def totals(self):
+        """Число товаров и стоимость корзины одним агрегатным запросом"""
+        return self.queryset().aggregate(total_quantity=Sum('quantity'),
+                                         total_price=Sum(line_total(F('quantity'), 'product_info__price')))
+
+    def add(self, product_info, quantity):
+        order, created = Order.objects.get_or_create(user=self.user, status='basket')
+        upsert_items(order.id, {product_info.id: quantity})
+
+    def apply(self, changes):
+        """
+        Изменения parse_batch в одной транзакции: upsert пачками, один DELETE
+        и одно обновление времени изменения корзины
+        """
+        added, replaced, removed = _split_changes(changes)
+        with transaction.atomic():
+            order, created = Order.objects.get_or_create(user=self.user, status='basket')
+            _write_items(order.id, added, increment=True)
+            _write_items(order.id, replaced, increment=False)
+            _delete_items(order.id, removed)
+            _touch_order(order.id)
+
+    def remove(self, product_info_id):
+        """Удаляет позицию; False, если ее не было в корзине"""
+        deleted, _ = self.queryset().filter(product_info_id=product_info_id).delete()
+        return bool(deleted)
+
+    def shop_ids(self):
+        """Магазины товаров корзины"""
+        return self.queryset().values_list('product_info__shop_id', flat=True).distinct()
+
+    def marker(self):
+        """Маркер изменения корзины для ETag"""
+        return Order.objects.filter(user=self.user, status='basket').values_list('id', 'updated_at').first()
+
+    def materialize(self):
+        """
+        Заказ-корзина в БД для подтверждения или None, если корзины нет.
+        Строка заказа блокируется до конца транзакции вызывающего кода
+        """
+        return Order.objects.select_for_update().filter(user=self.user, status='basket').first()
+
+    def confirmed(self, order):
+        """Заказ из корзины подтвержден: позиции уже в заказе, очищать нечего"""
+
+
+class RedisBasket:
+    """Корзина в хеше Redis с выгрузкой в Order и OrderItem"""
+
+    def __init__(self, user):
+        self.user = user
+        self.redis = get_redis()
+        self.key = f'{BASKET_KEY_PREFIX}:{user.id}'
+        self.version_key = f'{self.key}:version'
+
+    def items(self):
+        return {int(product_info_id): int(quantity) for product_info_id, quantity in self.redis.hgetall(self.key).items()}
+
+    def add(self, product_info, quantity):
+        with self.redis.pipeline() as pipe:
+            pipe.hincrby(self.key, product_info.id, quantity)
+            self._changed(pipe)
+            pipe.execute()
+
+    def apply(self, changes):
+        """Изменения parse_batch одной транзакцией MULTI"""
+        added, replaced, removed = _split_changes(changes)
+        with self.redis.pipeline() as pipe:
+            for product_info_id, quantity in added.items():
+                pipe.hincrby(self.key, product_info_id, quantity)
+            if replaced:
+                pipe.hset(self.key, mapping=replaced)
+            if removed:
+                pipe.hdel(self.key, *removed)
+            self._changed(pipe)
+            pipe.execute()
+
+    def remove(self, product_info_id):
+        with self.redis.pipeline() as pipe:
+            pipe.hdel(self.key, product_info_id)
+            self._changed(pipe)
+            deleted = pipe.execute()[0]
+        return bool(deleted)
+
+    def shop_ids(self):
+        return ProductInfo.objects.filter(id__in=self.items()).values_list('shop_id', flat=True).distinct()
+
+    def marker(self):
+        return self.redis.get(self.version_key)
+
+    @staticmethod
+    def _quantity(items):
+        """Количество из хеша как выражение SQL над предложениями"""
+        return Case(*[When(id=product_info_id, then=Value(quantity)) for product_info_id, quantity in items.items()],
+                    default=Value(0), output_field=IntegerField())
+
+    def order_items(self, product_infos):
+        """
+        Несохраненные OrderItem корзины над предложениями из product_infos,
+        в порядке id предложения. Стоимость line_total считается в SQL
+        """
+        items = self.items()
+        product_infos = product_infos.annotate(
+            line_total=line_total(self._quantity(items), 'price')).in_bulk(items)
+        order_items = []
+        for product_info_id, quantity in sorted(items.items()):
+            if product_info_id in product_infos:
+                item = OrderItem(product_info=product_infos[product_info_id], quantity=quantity)
+                item.line_total = item.product_info.line_total
+                order_items.append(item)
+        return order_items
+
+    def totals(self):
+        items = self.items()
+        quantity = self._quantity(items)
+        return ProductInfo.objects.filter(id__in=items).aggregate(total_quantity=Sum(quantity),
+                                                                  total_price=Sum(line_total(quantity, 'price')))
+
+    def _changed(self, pipe):
+        pipe.incr(self.version_key)
+        pipe.sadd(DIRTY_KEY, self.user.id)
+
+    def materialize(self):
+        """
+        Записывает корзину в Order(status='basket') и OrderItem: позиции
+        приводятся к содержимому хеша. Возвращает заказ или None для пустой корзины.
+
+        Строка заказа блокируется до конца транзакции: подтверждение заказа
+        и выгрузка той же корзины идут по очереди. Заказ, подтвержденный
+        за время ожидания блокировки, уже не корзина и не меняется.
+        """
+        items = self.items()
+        # Предложения могли удалить после добавления в корзину
+        existing_ids = set(ProductInfo.objects.filter(id__in=items).values_list('id', flat=True))
+        items = {product_info_id: quantity for product_info_id, quantity in items.items()
+                 if quantity > 0 and product_info_id in existing_ids}
+
+        with transaction.atomic():
+            order_id = Order.objects.filter(user=self.user, status='basket').values_list('id', flat=True).first()
+            if order_id is None:
+                if not items:
+                    return None
+                order_id = Order.objects.get_or_create(user=self.user, status='basket')[0].id
+
+            order = Order.objects.select_for_update().filter(id=order_id, status='basket').first()
+            if order is None:
+                return None
+
+            existing = {item.product_info_id: item for item in OrderItem.objects.filter(order=order)}
+            with order_items_bulk():
+                OrderItem.objects.filter(order=order).exclude(product_info_id__in=items).delete()
+            changed = []
+            for product_info_id, quantity in items.items():
+                item = existing.get(product_info_id)
+                if item is not None and item.quantity != quantity:
+                    item.quantity = quantity
+                    changed.append(item)
+            OrderItem.objects.bulk_update(changed, ['quantity'])
+            OrderItem.objects.bulk_create([
+                OrderItem(order=order, product_info_id=product_info_id, quantity=quantity)
+                for product_info_id, quantity in items.items() if product_info_id not in existing
+            ])
+            Order.objects.filter(id=order.id).update(updated_at=timezone.now())
+
+        self.snapshot = items
+        return order if items else None
+
+    def confirmed(self, order):
+        """После фиксации подтверждения вычитает заказанные позиции из хеша"""
+        snapshot = getattr(self, 'snapshot', {})
+        args = [value for item in snapshot.items() for value in item]
+        if args:
+            transaction.on_commit(lambda: self.redis.eval(SUBTRACT_SCRIPT, 3, self.key, self.version_key, DIRTY_KEY,
+                                                          self.user.id, *args))
+
+
+BASKET_BACKENDS = {
+    'db': DatabaseBasket,
+    'redis': RedisBasket,
+}
+
+
+def basket_backend():
+    """Имя хранилища корзин: без адреса Redis - всегда БД"""
+    if settings.BASKET_BACKEND == 'redis' and not settings.BASKET_REDIS_URL:
+        return 'db'
+    return settings.BASKET_BACKEND
+
+
+def get_basket(user):
+    """Корзина пользователя в настроенном хранилище"""
+    return BASKET_BACKENDS[basket_backend()](user)
+
+
+def flush_baskets(batch_size=100):
+    """
+    Выгружает в БД корзины, измененные с прошлой выгрузки. Возвращает их число.
+
+    Корзины, выгрузка которых не удалась, возвращаются в DIRTY_KEY после
+    прохода и выгружаются следующим запуском; первая ошибка пробрасывается
+    """
+    if basket_backend() != 'redis':
+        return 0
+
+    redis = get_redis()
+    flushed = 0
+    # Снятые с DIRTY_KEY, но не выгруженные корзины
+    failed = set()
+    error = None
+    try:
+        while True:
+            user_ids = redis.spop(DIRTY_KEY, batch_size)
+            if not user_ids:
+                break
+            failed.update(user_ids)
+            users = list(User.objects.filter(id__in=user_ids))
+            # Корзины пользователей, удаленных после изменения корзины, выгружать некуда
+            failed -= set(user_ids) - {str(user.id) for user in users}
+            for user in users:
+                try:
+                    RedisBasket(user).materialize()
+                except Exception as e:
+                    error = error or e
+                else:
+                    flushed += 1
+                    failed.discard(str(user.id))
+    finally:
+        if failed:
+            redis.sadd(DIRTY_KEY, *failed)
+    if error is not None:
+        raise error
+    return flushed
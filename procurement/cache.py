@@ -0,0 +1,137 @@
+"""
+Кэш ответов каталога с версиями по магазинам и категориям.
+
+Ключ страницы включает версии данных, от которых она зависит: общую версию
+каталога для списка без фильтров, версию магазина при фильтре shop_id и
+версию категории при фильтре category_id. Изменение данных увеличивает
+версии, и старые страницы просто перестают запрашиваться, удалять их не нужно.
+
+Версии увеличивают и веб-процессы, и импорт в Celery, поэтому кэш страниц
+работает только с кэшем, общим для всех процессов (настройка CACHE_SHARED).
+"""
+import hashlib
+import time
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+
+from .models import Category, Product
+
+VERSION_PREFIX = 'catalog:v'
+PAGE_PREFIX = 'catalog:page'
+
+
+def _version_key(scope, object_id=None):
+    return f'{VERSION_PREFIX}:{scope}' if object_id is None else f'{VERSION_PREFIX}:{scope}:{object_id}'
+
+
+def _initial_version():
+    # Версия, вытесненная из кэша, не должна начаться заново с единицы и вернуть старые страницы
+    return time.time_ns()
+
+
+def versions_shared():
+    """Версии хранятся в общем для всех процессов кэше, и их изменения видны каждому процессу"""
+    return settings.CACHE_SHARED
+
+
+def get_versions(keys):
+    """Текущие версии по ключам; отсутствующие версии создаются"""
+    versions = cache.get_many(keys)
+    for key in keys:
+        if key not in versions:
+            cache.add(key, _initial_version(), timeout=None)
+            versions[key] = cache.get(key)
+    return [versions[key] for key in keys]
+
+
+def bump_catalog_version(shop_ids=(), category_ids=()):
+    """Увеличивает общую версию каталога и версии указанных магазинов и категорий"""
+    keys = [_version_key('all')]
+    keys += [_version_key('shop', shop_id) for shop_id in set(shop_ids)]
+    keys += [_version_key('category', category_id) for category_id in set(category_ids)]
+    for key in keys:
+        try:
+            cache.incr(key)
+        except ValueError:
+            cache.add(key, _initial_version(), timeout=None)
+
+
+def invalidate_shops(shop_ids):
+    """
+    Сбрасывает закэшированные страницы магазинов вместе со всеми их категориями.
+
+    Категории определяются сразу (до удаления магазина они еще видны),
+    а версии увеличиваются после фиксации транзакции, чтобы новая версия
+    не закэшировала еще не записанные данные.
+    """
+    shop_ids = set(shop_ids)
+    if not shop_ids:
+        return
+
+    category_ids = set(Category.objects.filter(shops__id__in=shop_ids).values_list('id', flat=True))
+    category_ids.update(Product.objects.filter(shop_items__shop_id__in=shop_ids)
+                        .values_list('category_id', flat=True).distinct())
+    transaction.on_commit(lambda: bump_catalog_version(shop_ids, category_ids))
+
+
+def shop_versions(shop_ids):
+    """Версии магазинов: маркер данных предложений, например в ETag корзины"""
+    shop_ids = sorted(set(shop_ids))
+    return dict(zip(shop_ids, get_versions([_version_key('shop', shop_id) for shop_id in shop_ids])))
+
+
+def catalog_page_key(request):
+    """Ключ страницы каталога: адрес, параметры запроса и версии данных"""
+    params = request.query_params
+    version_keys = []
+    if params.get('shop_id'):
+        version_keys.append(_version_key('shop', params['shop_id']))
+    if params.get('category_id'):
+        version_keys.append(_version_key('category', params['category_id']))
+    if not version_keys:
+        version_keys.append(_version_key('all'))
+
+    query = sorted((name, value) for name, values in params.lists() for value in values)
+    address = f'{request.get_host()}{request.path}?{query}'
+    versions = '.'.join(str(version) for version in get_versions(version_keys))
+    return f'{PAGE_PREFIX}:{hashlib.md5(address.encode("utf-8")).hexdigest()}:{versions}'
+
+
+def get_or_build(key, build, timeout=None):
+    """
+    Значение из кэша или результат build().
+
+    Страницу после промаха строит только один запрос: он берет блокировку
+    в кэше, остальные ждут появления значения, а не строят его параллельно.
+    Без общего кэша значение строится каждый раз: версии в памяти процесса
+    не увеличиваются при импорте в другом процессе, и страница бы устарела.
+    """
+    if not versions_shared():
+        return build()
+
+    timeout = settings.CATALOG_CACHE_TIMEOUT if timeout is None else timeout
+    value = cache.get(key)
+    if value is not None:
+        return value
+
+    lock_key = f'{key}:lock'
+    lock_timeout = settings.CATALOG_CACHE_LOCK_TIMEOUT
+    if cache.add(lock_key, 1, timeout=lock_timeout):
+        try:
+            value = build()
+            if value is not None:
+                cache.set(key, value, timeout=timeout)
+            return value
+        finally:
+            cache.delete(lock_key)
+
+    deadline = time.monotonic() + lock_timeout
+    while time.monotonic() < deadline:
+        time.sleep(0.05)
+        value = cache.get(key)
+        if value is not None:
+            return value
+    # Строивший запрос не успел или упал - строим сами
+    return build()
@@ -0,0 +1,168 @@
+"""
+Read model каталога: плоский каталог (CatalogEntry) - одна строка на
+предложение магазина в наличии, и агрегат фасетов параметров (ParameterFacet)
+"""
+from collections import Counter, defaultdict
+
+from django.conf import settings
+from django.db.models import Count, F, Q, Sum
+
+from .models import CatalogEntry, ParameterFacet, ProductInfo, ProductParameter
+
+# Поля ProductInfo -> поля CatalogEntry
+SOURCE_FIELDS = {
+    'id': 'id',
+    'product_id': 'product_id',
+    'product__name': 'product_name',
+    'product__category_id': 'category_id',
+    'product__category__name': 'category_name',
+    'shop_id': 'shop_id',
+    'shop__name': 'shop_name',
+    'shop__url': 'shop_url',
+    'external_id': 'external_id',
+    'model': 'model',
+    'price': 'price',
+    'price_rrc': 'price_rrc',
+    'quantity': 'quantity',
+}
+
+
+def refresh_catalog(scope, batch_size=None):
+    """
+    Пересобирает строки плоского каталога в пределах scope.
+
+    scope - условие Q по полям id, shop_id и external_id, которые одинаково
+    называются в ProductInfo и CatalogEntry: строки scope удаляются и заново
+    строятся по тем предложениям, что сейчас в наличии у активных магазинов.
+    Транзакцией управляет вызывающий код.
+    """
+    batch_size = batch_size or settings.IMPORT_BATCH_SIZE
+    CatalogEntry.objects.filter(scope).delete()
+
+    source = (ProductInfo.objects.filter(scope, quantity__gt=0, shop__is_active=True)
+              .order_by('id').values_list(*SOURCE_FIELDS))
+    rows = []
+    for row in source.iterator(chunk_size=batch_size):
+        rows.append(row)
+        if len(rows) >= batch_size:
+            _create_entries(rows, batch_size)
+            rows = []
+    _create_entries(rows, batch_size)
+
+
+def refresh_catalog_ids(product_info_ids, batch_size=None):
+    """Пересобирает строки каталога для предложений с указанными id, в том числе удаленных"""
+    batch_size = batch_size or settings.IMPORT_BATCH_SIZE
+    product_info_ids = sorted(set(product_info_ids))
+    for start in range(0, len(product_info_ids), batch_size):
+        refresh_catalog(Q(id__in=product_info_ids[start:start + batch_size]), batch_size)
+
+
+def _create_entries(rows, batch_size):
+    if not rows:
+        return
+
+    parameters = defaultdict(dict)
+    for product_info_id, name, value in ProductParameter.objects.filter(
+            product_info_id__in=[row[0] for row in rows]).values_list('product_info_id', 'parameter__name', 'value'):
+        parameters[product_info_id][name] = value
+
+    entries = []
+    for row in rows:
+        entry = CatalogEntry(parameters=parameters[row[0]], **dict(zip(SOURCE_FIELDS.values(), row)))
+        entry.search_text = build_search_text(entry.product_name, entry.model, entry.parameters)
+        entries.append(entry)
+    CatalogEntry.objects.bulk_create(entries, batch_size=batch_size)
+
+
+def build_search_text(product_name, model, parameters):
+    """Текст строки каталога для полнотекстового поиска"""
+    return ' '.join(part for part in (product_name, model, *parameters.values()) if part)
+
+
+def refresh_facets(shop_ids, batch_size=None):
+    """Пересчитывает агрегат фасетов магазинов одним GROUP BY на магазины"""
+    batch_size = batch_size or settings.IMPORT_BATCH_SIZE
+    shop_ids = set(shop_ids)
+    ParameterFacet.objects.filter(shop_id__in=shop_ids).delete()
+
+    counts = (ProductParameter.objects
+              .filter(product_info__shop_id__in=shop_ids, product_info__shop__is_active=True,
+                      product_info__quantity__gt=0)
+              .values_list('product_info__shop_id', 'product_info__product__category_id', 'parameter__name', 'value')
+              .annotate(count=Count('id'))
+              .order_by())
+    ParameterFacet.objects.bulk_create(
+        [ParameterFacet(shop_id=shop_id, category_id=category_id, parameter=parameter, value=value, count=count)
+         for shop_id, category_id, parameter, value, count in counts],
+        batch_size=batch_size
+    )
+
+
+# Больше изменившихся значений параметров дешевле пересчитать по магазину одним GROUP BY
+ADJUST_FACETS_MAX_VALUES = 200
+
+
+def adjust_facets(appeared=(), disappeared=(), batch_size=None):
+    """
+    Обновляет агрегат фасетов без пересчета магазина.
+
+    appeared - id предложений, которые появились в наличии, disappeared -
+    закончились. Счетчики значений их параметров меняются на разницу.
+    Вызывающий код блокирует строки предложений, транзакцией управляет он же.
+    """
+    batch_size = batch_size or settings.IMPORT_BATCH_SIZE
+    deltas = Counter()
+    for product_info_ids, sign in ((list(appeared), 1), (list(disappeared), -1)):
+        for start in range(0, len(product_info_ids), batch_size):
+            rows = (ProductParameter.objects
+                    .filter(product_info_id__in=product_info_ids[start:start + batch_size],
+                            product_info__shop__is_active=True)
+                    .values_list('product_info__shop_id', 'product_info__product__category_id',
+                                 'parameter__name', 'value'))
+            for key in rows:
+                deltas[key] += sign
+
+    deltas = {key: delta for key, delta in deltas.items() if delta}
+    if len(deltas) > ADJUST_FACETS_MAX_VALUES:
+        refresh_facets({shop_id for shop_id, _, _, _ in deltas}, batch_size)
+        return
+
+    for (shop_id, category_id, parameter, value), delta in deltas.items():
+        facets = ParameterFacet.objects.filter(shop_id=shop_id, category_id=category_id,
+                                               parameter=parameter, value=value)
+        if delta < 0:
+            # Значение больше не встречается в наличии
+            facets.filter(count__lte=-delta).delete()
+        if not facets.update(count=F('count') + delta) and delta > 0:
+            ParameterFacet.objects.create(shop_id=shop_id, category_id=category_id,
+                                          parameter=parameter, value=value, count=delta)
+
+
+def facet_counts(shop_id=None, category_id=None):
+    """Фасеты по агрегату: {параметр: {значение: число предложений}}"""
+    facets = ParameterFacet.objects.all()
+    if shop_id:
+        facets = facets.filter(shop_id=shop_id)
+    if category_id:
+        facets = facets.filter(category_id=category_id)
+    rows = facets.values_list('parameter', 'value').annotate(total=Sum('count')).order_by()
+    return _group_facets(rows)
+
+
+def count_facets(entries):
+    """Фасеты по произвольной выборке плоского каталога (фильтры по параметрам, поиск)"""
+    counter = Counter()
+    for parameters in entries.values_list('parameters', flat=True).order_by().iterator(chunk_size=2000):
+        counter.update(parameters.items())
+    return _group_facets((parameter, value, total) for (parameter, value), total in counter.items())
+
+
+def _group_facets(rows):
+    facets = defaultdict(list)
+    for parameter, value, total in rows:
+        facets[parameter].append((value, total))
+    return {
+        parameter: dict(sorted(values, key=lambda item: (-item[1], item[0])))
+        for parameter, values in sorted(facets.items())
+    }
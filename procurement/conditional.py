@@ -0,0 +1,50 @@
+"""
+Условные GET-запросы: ETag из дешевых маркеров версий данных.
+
+Представление задает get_etag_parts(request) - значения, от которых зависит
+ответ: версии каталога в кэше, время изменения корзины и заказов. ETag
+вычисляется до основных запросов; при совпадении с If-None-Match ответ 304
+отдается без выборки данных и сериализации.
+
+Версии каталога в памяти процесса не меняются при импорте в Celery или
+в другом процессе, поэтому без общего кэша (CACHE_SHARED) ETag не отдается.
+"""
+import hashlib
+
+from django.utils.cache import parse_etags, quote_etag
+from rest_framework import status
+from rest_framework.response import Response
+
+from .cache import versions_shared
+
+
+def make_etag(*parts):
+    """Сильный ETag из значений маркеров"""
+    return quote_etag(hashlib.md5('|'.join(str(part) for part in parts).encode('utf-8')).hexdigest())
+
+
+class ConditionalGetMixin:
+    """ETag и ответ 304 на If-None-Match для GET представлений DRF"""
+
+    def get_etag_parts(self, request):
+        raise NotImplementedError
+
+    def get_etag(self, request):
+        # Адрес с параметрами и формат ответа различают представления одного ресурса
+        return make_etag(request.get_full_path(), request.accepted_media_type, *self.get_etag_parts(request))
+
+    def get(self, request, *args, **kwargs):
+        if not versions_shared():
+            return super().get(request, *args, **kwargs)
+
+        # Маркеры читаются до данных: если данные изменятся между ними, клиент получит
+        # новый ответ со старым ETag и при следующем запросе просто загрузит его заново
+        etag = self.get_etag(request)
+        if_none_match = parse_etags(request.META.get('HTTP_IF_NONE_MATCH', ''))
+        if etag in if_none_match or '*' in if_none_match:
+            return Response(status=status.HTTP_304_NOT_MODIFIED, headers={'ETag': etag})
+
+        response = super().get(request, *args, **kwargs)
+        if response.status_code == status.HTTP_200_OK:
+            response['ETag'] = etag
+        return response
@@ -0,0 +1,101 @@
+"""
+Выборочные поля ответа: параметры запроса fields= и expand=.
+
+fields - поля верхнего уровня через запятую, по умолчанию все. expand -
+раскрываемые связи через запятую, вложенные - через точку: product,
+product.category, shop, parameters. Без expand раскрываются все связи,
+как раньше; с expand нераскрытая связь отдается своим id, а списки
+(parameters, items) не выводятся: список, явно запрошенный в fields без
+expand, - ошибка. Связанные данные выбираются только для раскрытых связей.
+"""
+from django.db.models import Prefetch
+from rest_framework import status
+from rest_framework.response import Response
+
+from .models import ProductParameter
+
+
+def _split(value):
+    if value is None:
+        return None
+    return {name.strip() for name in value.split(',') if name.strip()}
+
+
+class Fieldset:
+    """Поля и раскрытые связи ответа"""
+
+    def __init__(self, fields=None, expand=None):
+        # None - все поля и все связи
+        self.fields = fields or None
+        self.expand = expand
+
+    @classmethod
+    def from_query_params(cls, query_params):
+        return cls(_split(query_params.get('fields')), _split(query_params.get('expand')))
+
+    def includes(self, name):
+        """Входит ли поле верхнего уровня в ответ"""
+        return self.fields is None or name in self.fields
+
+    def expands(self, path):
+        """Раскрывается ли связь: явно или как часть более глубокого пути в expand"""
+        if not self.includes(path.split('.')[0]):
+            return False
+        if self.expand is None:
+            return True
+        return any(name == path or name.startswith(f'{path}.') for name in self.expand)
+
+    def error(self, fields, expandable, lists=()):
+        """
+        Текст ошибки для неизвестных полей и связей или None.
+        lists - списки верхнего уровня, которые без раскрытия не выводятся
+        """
+        unknown = sorted((self.fields or set()) - set(fields)) + sorted((self.expand or set()) - set(expandable))
+        if unknown:
+            return f'Неизвестные поля: {unknown}. Допустимые fields: {list(fields)}, expand: {list(expandable)}'
+        for name in sorted(set(lists) & (self.fields or set())):
+            if not self.expands(name):
+                return f'Поле {name} выводится только с expand={name}'
+        return None
+
+
+def select_expanded(queryset, fieldset, select=None, prefetch=None):
+    """
+    select_related и prefetch_related только для раскрытых связей.
+    select и prefetch - {путь в expand: lookup или Prefetch}
+    """
+    for path, lookup in (select or {}).items():
+        if fieldset.expands(path):
+            queryset = queryset.select_related(lookup)
+    for path, lookup in (prefetch or {}).items():
+        if fieldset.expands(path):
+            queryset = queryset.prefetch_related(lookup)
+    return queryset
+
+
+def parameters_prefetch(lookup):
+    """Параметры предложения с названиями, в порядке id - как в быстрой сериализации каталога"""
+    return Prefetch(lookup, queryset=ProductParameter.objects.select_related('parameter').order_by('id'))
+
+
+class FieldsetViewMixin:
+    """fields= и expand= для списков DRF: проверка параметров и fieldset в контексте сериализатора"""
+
+    def get_fieldset(self):
+        if not hasattr(self, '_fieldset'):
+            self._fieldset = Fieldset.from_query_params(self.request.query_params)
+        return self._fieldset
+
+    def fieldset_error(self):
+        serializer_class = self.get_serializer_class()
+        return self.get_fieldset().error(serializer_class.Meta.fields, serializer_class.expandable_paths(),
+                                         serializer_class.list_fields())
+
+    def get_serializer_context(self):
+        return {**super().get_serializer_context(), 'fieldset': self.get_fieldset()}
+
+    def list(self, request, *args, **kwargs):
+        error = self.fieldset_error()
+        if error:
+            return Response({'Status': False, 'Error': error}, status=status.HTTP_400_BAD_REQUEST)
+        return super().list(request, *args, **kwargs)
@@ -0,0 +1,90 @@
+"""
+Фильтры и сортировка каталога: параметры товаров, диапазон цены
+"""
+import re
+from decimal import Decimal, InvalidOperation
+
+from .models import ProductParameter
+
+PARAMETER_FILTER_RE = re.compile(r'^param\[(.+)\]$')
+
+PRICE_FILTERS = {'price_min': 'price__gte', 'price_max': 'price__lte'}
+
+# Поля сортировки каталога (с минусом - по убыванию)
+ORDERING_FIELDS = ('price', 'price_rrc')
+
+
+def catalog_params_error(query_params):
+    """Текст ошибки в параметрах цены и сортировки или None"""
+    for name in PRICE_FILTERS:
+        value = query_params.get(name)
+        if value:
+            try:
+                valid = Decimal(value).is_finite()
+            except InvalidOperation:
+                valid = False
+            if not valid:
+                return f'Неверное значение {name}: {value}'
+
+    ordering = query_params.get('ordering')
+    if ordering and ordering.lstrip('-') not in ORDERING_FIELDS:
+        allowed = [prefix + field for field in ORDERING_FIELDS for prefix in ('', '-')]
+        return f'Неверная сортировка. Допустимые: {allowed}'
+    return None
+
+
+def catalog_ordering(query_params):
+    """
+    Порядок выдачи каталога. id добавляется для однозначного порядка при равных
+    ценах и идет в том же направлении, что и цена: так порядок совпадает с индексом
+    """
+    ordering = query_params.get('ordering')
+    if not ordering:
+        return ('id',)
+    return (ordering, '-id' if ordering.startswith('-') else 'id')
+
+
+def filter_by_price(queryset, query_params):
+    """Диапазон цены закупки: price_min и price_max включительно"""
+    for name, lookup in PRICE_FILTERS.items():
+        value = query_params.get(name)
+        if value:
+            queryset = queryset.filter(**{lookup: value})
+    return queryset
+
+
+def parameter_filters(query_params):
+    """{название параметра: [значения]} из параметров запроса вида param[Цвет]=черный"""
+    filters = {}
+    for key in query_params:
+        match = PARAMETER_FILTER_RE.match(key)
+        if match:
+            values = [value for value in query_params.getlist(key) if value != '']
+            if values:
+                filters[match.group(1)] = values
+    return filters
+
+
+def filter_by_parameters(queryset, filters):
+    """
+    Оставляет предложения, у которых каждый параметр принимает одно из значений.
+    Подходит для ProductInfo и CatalogEntry: id строки каталога совпадает с id предложения.
+    """
+    for name, values in filters.items():
+        queryset = queryset.filter(id__in=ProductParameter.objects.filter(
+            parameter__name=name, value__in=values).values('product_info_id'))
+    return queryset
+
+
+def filter_catalog_entries(queryset, query_params):
+    """Фильтры плоского каталога: category_id, shop_id, цена и параметры товара"""
+    category_id = query_params.get('category_id')
+    if category_id:
+        queryset = queryset.filter(category_id=category_id)
+
+    shop_id = query_params.get('shop_id')
+    if shop_id:
+        queryset = queryset.filter(shop_id=shop_id)
+
+    queryset = filter_by_price(queryset, query_params)
+    return filter_by_parameters(queryset, parameter_filters(query_params))
@@ -0,0 +1,571 @@
+"""
+Пакетный импорт прайс-листов поставщиков
+"""
+from collections import defaultdict
+from decimal import Decimal
+from itertools import islice
+
+import yaml
+from django.conf import settings
+from django.db import connection, transaction
+from django.db.backends.utils import format_number
+from django.db.models import Case, F, Q, Value, When
+
+from .models import Shop, Category, Product, ProductInfo, Parameter, ProductParameter
+from .cache import invalidate_shops
+from .catalog import adjust_facets, refresh_catalog, refresh_catalog_ids, refresh_facets
+from .price_lists import PriceList, PriceListError, goods_digest, summarize
+
+
+def chunked(iterable, size):
+    """Разбивает итерируемый объект на списки длиной не более size"""
+    iterator = iter(iterable)
+    while True:
+        chunk = list(islice(iterator, size))
+        if not chunk:
+            return
+        yield chunk
+
+
+class BulkImporter:
+    """
+    Импорт товаров магазина пачками.
+
+    Существующие категории, товары и параметры загружаются одним запросом
+    в словари, новые строки пишутся через bulk_create по batch_size штук.
+    Транзакцией управляет вызывающий код.
+
+    Полный импорт пересоздает строки товаров. Если сохранены хеши пачек
+    прошлого импорта с тем же размером пачки, товары магазина сопоставляются
+    по external_id: пачки, совпадающие с прошлым импортом, пропускаются,
+    строки остальных пересоздаются, а товары, которых нет в прайсе, удаляются.
+    """
+
+    def __init__(self, shop, batch_size=None, progress=None):
+        self.shop = shop
+        self.batch_size = batch_size or settings.IMPORT_BATCH_SIZE
+        # progress(processed) вызывается после каждой пачки товаров
+        self.progress = progress
+        self.goods_count = 0
+        self.inserted = 0
+        self.updated = 0
+        self.unchanged = 0
+        self.removed = 0
+
+        # (название, id категории) -> id товара
+        self.products = {}
+        # название параметра -> id параметра
+        self.parameters = None
+        # категории, товары которых уже загружены в self.products
+        self._loaded_categories = set()
+        # категории, уже привязанные к магазину в этом импорте
+        self._imported_categories = set()
+        # хеши пачек товаров, сохраняются в магазине после импорта
+        self.chunk_digests = []
+        # external_id -> id ProductInfo текущего прайса магазина
+        self._existing = {}
+        self._seen = set()
+        # id новых, измененных и удаленных ProductInfo - для обновления плоского каталога
+        self._touched = set()
+        # Все старые товары удалены в begin - плоский каталог пересобирается по магазину
+        self._replaced_all = False
+
+    def import_categories(self, categories_data):
+        """Создает недостающие категории и привязывает их к магазину"""
+        names = {category['id']: category['name'] for category in categories_data
+                 if category['id'] not in self._imported_categories}
+        if not names:
+            return
+
+        existing = Category.objects.in_bulk(list(names))
+        Category.objects.bulk_create(
+            [Category(id=category_id, name=name) for category_id, name in names.items()
+             if category_id not in existing],
+            batch_size=self.batch_size,
+            ignore_conflicts=True
+        )
+        self.shop.categories.add(*names)
+        self._imported_categories.update(names)
+
+    def begin(self):
+        """
+        Удаляет старые товары магазина перед загрузкой нового прайса.
+        Если пачки можно сравнить с прошлым импортом, загружает external_id текущих товаров
+        """
+        if self._previous_chunks() is not None and not self._load_existing():
+            return
+
+        self._existing = {}
+        self._replaced_all = True
+        _, deleted = ProductInfo.objects.filter(shop=self.shop).delete()
+        self.removed = deleted.get(ProductInfo._meta.label, 0)
+
+    def _previous_chunks(self):
+        """Хеши пачек прошлого импорта или None, если сравнивать пачки не с чем"""
+        previous = self.shop.import_chunk_digests or {}
+        if previous.get('batch_size') != self.batch_size:
+            return None
+        return previous.get('chunks')
+
+    def _load_existing(self):
+        """
+        Загружает external_id текущих товаров магазина одним запросом.
+        Возвращает id строк с повторяющимся external_id
+        """
+        duplicates = []
+        for external_id, pk in ProductInfo.objects.filter(shop=self.shop).order_by('id').values_list(
+                'external_id', 'id'):
+            if external_id in self._existing:
+                duplicates.append(pk)
+            else:
+                self._existing[external_id] = pk
+        return duplicates
+
+    def import_goods(self, goods_data):
+        """Создает товары, информацию о них в магазине и их параметры"""
+        for index, chunk in enumerate(chunked(goods_data, self.batch_size)):
+            digest = goods_digest(chunk)
+            self.chunk_digests.append(digest)
+            if not self._skip_chunk(index, digest, chunk):
+                self._import_chunk(chunk)
+            self.goods_count += len(chunk)
+            if self.progress:
+                self.progress(self.goods_count)
+
+    def finish(self):
+        """Удаляет товары, которых нет в новом прайсе"""
+        self._delete([pk for external_id, pk in self._existing.items() if external_id not in self._seen])
+
+    def update_catalog(self):
+        """
+        Если импорт заменил все товары, плоский каталог магазина пересобирается целиком,
+        иначе - только строки новых, измененных и удаленных товаров
+        """
+        if self._replaced_all:
+            refresh_catalog(Q(shop_id=self.shop.id), self.batch_size)
+        else:
+            refresh_catalog_ids(self._touched, self.batch_size)
+
+    def _skip_chunk(self, index, digest, goods):
+        """Пачка, совпадающая с той же пачкой прошлого импорта, не требует записи в БД"""
+        chunks = self._previous_chunks()
+        if self._replaced_all or chunks is None or index >= len(chunks) or chunks[index] != digest:
+            return False
+
+        external_ids = {good['id'] for good in goods}
+        if not external_ids <= self._existing.keys():
+            return False
+
+        self._seen |= external_ids
+        self.unchanged += len(external_ids)
+        return True
+
+    def _delete(self, ids):
+        for chunk in chunked(ids, self.batch_size):
+            ProductInfo.objects.filter(id__in=chunk).delete()
+        self.removed += len(ids)
+        self._touched.update(ids)
+
+    @property
+    def stats(self):
+        return {
+            'Inserted': self.inserted,
+            'Updated': self.updated,
+            'Unchanged': self.unchanged,
+            'Removed': self.removed,
+        }
+
+    def _import_chunk(self, goods):
+        # Строки товаров измененной пачки пересоздаются
+        external_ids = {good['id'] for good in goods}
+        self._seen |= external_ids
+        self._delete([self._existing.pop(external_id) for external_id in external_ids if external_id in self._existing])
+
+        self._resolve_products(goods)
+        self._resolve_parameters(goods)
+        product_infos = [self._build_product_info(good) for good in goods]
+        self._create_product_infos(goods, product_infos)
+        self._touched.update(product_info.id for product_info in product_infos)
+
+    def _build_product_info(self, good):
+        return ProductInfo(
+            product_id=self.products[(good['name'], good['category'])],
+            shop=self.shop,
+            external_id=good['id'],
+            model=good.get('model', ''),
+            price=good['price'],
+            price_rrc=good['price_rrc'],
+            quantity=good['quantity']
+        )
+
+    def _build_parameters(self, good):
+        """Параметры товара в виде {id параметра: значение}"""
+        return {
+            self.parameters[param_name]: str(param_value)
+            for param_name, param_value in good.get('parameters', {}).items()
+        }
+
+    def _create_product_infos(self, goods, product_infos):
+        ProductInfo.objects.bulk_create(product_infos, batch_size=self.batch_size)
+        if not connection.features.can_return_rows_from_bulk_insert:
+            self._fetch_product_info_ids(product_infos)
+
+        ProductParameter.objects.bulk_create(
+            [
+                ProductParameter(product_info_id=product_info.id, parameter_id=parameter_id, value=value)
+                for good, product_info in zip(goods, product_infos)
+                for parameter_id, value in self._build_parameters(good).items()
+            ],
+            batch_size=self.batch_size
+        )
+        self.inserted += len(product_infos)
+
+    def _resolve_products(self, goods):
+        """Находит id товаров пачки, недостающие товары создает"""
+        category_ids = {good['category'] for good in goods} - self._loaded_categories
+        if category_ids:
+            # Товары еще не встречавшихся категорий загружаются одним запросом
+            products = Product.objects.filter(category_id__in=category_ids).order_by('-id')
+            for product_id, name, category_id in products.values_list('id', 'name', 'category_id'):
+                self.products[(name, category_id)] = product_id
+            self._loaded_categories |= category_ids
+
+        missing = {(good['name'], good['category']) for good in goods} - self.products.keys()
+        if not missing:
+            return
+
+        products = Product.objects.bulk_create(
+            [Product(name=name, category_id=category_id) for name, category_id in missing],
+            batch_size=self.batch_size
+        )
+        if not connection.features.can_return_rows_from_bulk_insert:
+            products = Product.objects.filter(
+                category_id__in={category_id for _, category_id in missing}
+            ).order_by('-id')
+        for product in products:
+            key = (product.name, product.category_id)
+            if key in missing:
+                self.products[key] = product.id
+
+    def _resolve_parameters(self, goods):
+        """Находит id параметров пачки, недостающие параметры создает"""
+        if self.parameters is None:
+            # Справочник параметров загружается один раз за импорт
+            self.parameters = dict(Parameter.objects.order_by('-id').values_list('name', 'id'))
+
+        missing = {name for good in goods for name in good.get('parameters', {})} - self.parameters.keys()
+        if not missing:
+            return
+
+        # Параметр мог создать параллельный импорт другого магазина
+        Parameter.objects.bulk_create([Parameter(name=name) for name in missing],
+                                      batch_size=self.batch_size, ignore_conflicts=True)
+        self.parameters.update(Parameter.objects.filter(name__in=missing).values_list('name', 'id'))
+
+    def _fetch_product_info_ids(self, product_infos):
+        """Дочитывает id созданных строк, если БД не возвращает их из bulk_create"""
+        ids = {
+            (product_id, external_id): pk
+            for pk, product_id, external_id in ProductInfo.objects.filter(
+                shop=self.shop, external_id__in=[product_info.external_id for product_info in product_infos]
+            ).values_list('id', 'product_id', 'external_id')
+        }
+        for product_info in product_infos:
+            product_info.id = ids[(product_info.product_id, product_info.external_id)]
+
+
+class DeltaImporter(BulkImporter):
+    """
+    Дифференциальный импорт.
+
+    Товары сопоставляются с текущими по (магазин, external_id) и делятся на
+    новые, измененные, неизмененные и удаленные - в БД пишутся только отличия,
+    поэтому неизмененные строки и ссылающиеся на них позиции заказов сохраняются.
+    """
+
+    fields = ['product', 'model', 'price', 'price_rrc', 'quantity']
+
+    def begin(self):
+        """Загружает external_id текущих товаров магазина одним запросом"""
+        # Строки с повторяющимся external_id не сопоставить однозначно
+        self._delete(self._load_existing())
+
+    def _import_chunk(self, goods):
+        # При повторе external_id действует последняя запись
+        goods = list({good['id']: good for good in goods}.values())
+        self._resolve_products(goods)
+        self._resolve_parameters(goods)
+
+        existing_ids = [self._existing[good['id']] for good in goods if good['id'] in self._existing]
+        current = ProductInfo.objects.in_bulk(existing_ids)
+        current_parameters = defaultdict(dict)
+        for product_parameter in ProductParameter.objects.filter(product_info_id__in=existing_ids):
+            current_parameters[product_parameter.product_info_id][product_parameter.parameter_id] = product_parameter
+
+        new_goods, new_infos, changed_infos = [], [], []
+        new_parameters, changed_parameters, removed_parameters = [], [], []
+        for good in goods:
+            self._seen.add(good['id'])
+            product_info = self._build_product_info(good)
+            pk = self._existing.get(good['id'])
+            if pk is None:
+                new_goods.append(good)
+                new_infos.append(product_info)
+                continue
+
+            product_info.id = pk
+            changed = self._is_changed(current[pk], product_info)
+            if changed:
+                changed_infos.append(product_info)
+
+            parameters = self._build_parameters(good)
+            old_parameters = current_parameters[pk]
+            for parameter_id, value in parameters.items():
+                old = old_parameters.get(parameter_id)
+                if old is None:
+                    new_parameters.append(
+                        ProductParameter(product_info_id=pk, parameter_id=parameter_id, value=value))
+                    changed = True
+                elif old.value != value:
+                    old.value = value
+                    changed_parameters.append(old)
+                    changed = True
+            for parameter_id, old in old_parameters.items():
+                if parameter_id not in parameters:
+                    removed_parameters.append(old.id)
+                    changed = True
+
+            if changed:
+                self.updated += 1
+                self._touched.add(pk)
+            else:
+                self.unchanged += 1
+
+        ProductInfo.objects.bulk_update(changed_infos, self.fields, batch_size=self.batch_size)
+        ProductParameter.objects.bulk_update(changed_parameters, ['value'], batch_size=self.batch_size)
+        ProductParameter.objects.bulk_create(new_parameters, batch_size=self.batch_size)
+        for chunk in chunked(removed_parameters, self.batch_size):
+            ProductParameter.objects.filter(id__in=chunk).delete()
+
+        self._create_product_infos(new_goods, new_infos)
+        for product_info in new_infos:
+            self._existing[product_info.external_id] = product_info.id
+            self._touched.add(product_info.id)
+
+    def _is_changed(self, old, new):
+        return (
+            old.product_id != new.product_id
+            or old.model != new.model
+            or old.price != self._stored_decimal('price', new.price)
+            or old.price_rrc != self._stored_decimal('price_rrc', new.price_rrc)
+            or old.quantity != new.quantity
+        )
+
+    @staticmethod
+    def _stored_decimal(field_name, value):
+        """Цена в том виде, в каком ее сохранит БД: округление до decimal_places поля"""
+        field = ProductInfo._meta.get_field(field_name)
+        return Decimal(format_number(Decimal(str(value)), field.max_digits, field.decimal_places))
+
+
+# Режимы импорта: full - полная замена прайса, delta - запись только отличий
+IMPORT_MODES = {
+    'full': BulkImporter,
+    'delta': DeltaImporter,
+}
+
+
+def reset_import_digests(shop_ids):
+    """
+    Сбрасывает хеши последнего импорта магазинов.
+
+    Вызывается при изменении товаров в обход импорта, чтобы повторная
+    загрузка того же прайса снова записала его в БД.
+    """
+    Shop.objects.filter(id__in=set(shop_ids)).update(import_digest='', import_chunk_digests={})
+
+
+def update_stock(shop, items, batch_size=None):
+    """
+    Быстрое обновление остатков и цен товаров магазина.
+
+    items - словари с external_id, quantity и необязательными price/price_rrc.
+    На каждую пачку выполняется один UPDATE с CASE по external_id.
+    Возвращает количество обновленных строк.
+    """
+    batch_size = batch_size or settings.IMPORT_BATCH_SIZE
+    # При повторе external_id действует последняя запись
+    items = list({item['external_id']: item for item in items}.values())
+
+    updated = 0
+    # id предложений, которые появились в наличии и закончились
+    appeared, disappeared = [], []
+    with transaction.atomic():
+        # Обновления остатков магазина идут по очереди: фасеты меняются на разницу
+        # с прочитанными остатками, и счетчик нового значения не создается дважды
+        Shop.objects.select_for_update().get(pk=shop.pk)
+
+        for chunk in chunked(items, batch_size):
+            values = {'quantity': _case_by_external_id(chunk, 'quantity')}
+            for field in ('price', 'price_rrc'):
+                if any(field in item for item in chunk):
+                    values[field] = _case_by_external_id(chunk, field)
+
+            external_ids = [item['external_id'] for item in chunk]
+            offers = ProductInfo.objects.filter(shop=shop, external_id__in=external_ids)
+
+            quantities = {item['external_id']: item['quantity'] for item in chunk}
+            for pk, external_id, quantity in offers.select_for_update().values_list('id', 'external_id', 'quantity'):
+                in_stock = quantities[external_id] > 0
+                if in_stock != (quantity > 0):
+                    (appeared if in_stock else disappeared).append(pk)
+
+            updated += offers.update(**values)
+            refresh_catalog(Q(shop_id=shop.id, external_id__in=external_ids), batch_size)
+
+        # Число предложений в наличии по значениям параметров меняют только
+        # предложения, остаток которых перешел через ноль
+        adjust_facets(appeared, disappeared, batch_size)
+
+        # Прайс в БД разошелся с последним импортированным файлом
+        reset_import_digests([shop.id])
+        invalidate_shops([shop.id])
+    return updated
+
+
+def _case_by_external_id(items, field):
+    return Case(
+        *[When(external_id=item['external_id'], then=Value(item[field])) for item in items if field in item],
+        default=F(field),
+        output_field=ProductInfo._meta.get_field(field)
+    )
+
+
+def upsert_dictionaries(summary, batch_size=None):
+    """
+    Создает недостающие категории и параметры прайс-листа.
+
+    Справочники общие для всех магазинов, поэтому они записываются до импорта
+    товаров в короткой отдельной транзакции вставкой с ignore_conflicts.
+    Ключи вставляются по возрастанию, чтобы параллельные импорты
+    не блокировали друг друга крест-накрест.
+    """
+    batch_size = batch_size or settings.IMPORT_BATCH_SIZE
+    with transaction.atomic():
+        Category.objects.bulk_create(
+            [Category(id=category_id, name=summary.categories[category_id])
+             for category_id in sorted(summary.categories)],
+            batch_size=batch_size,
+            ignore_conflicts=True
+        )
+        Parameter.objects.bulk_create(
+            [Parameter(name=name) for name in sorted(summary.parameters)],
+            batch_size=batch_size,
+            ignore_conflicts=True
+        )
+
+
+def check_not_modified(user, digest):
+    """
+    Результат импорта, если файл совпадает с последним импортом магазина
+    поставщика, иначе None.
+
+    Проверка до разбора файла: повторная загрузка того же прайса не читает
+    его и не пишет справочники. import_price_list повторяет ее под блокировкой магазина.
+    """
+    if not digest:
+        return None
+    shop_name = Shop.objects.filter(user=user, import_digest=digest).values_list('name', flat=True).first()
+    return _not_modified(shop_name) if shop_name else None
+
+
+def _not_modified(shop_name):
+    return {
+        'Status': True,
+        'Message': f'Прайс-лист не изменился, импорт пропущен. Магазин: {shop_name}',
+        'NotModified': True
+    }
+
+
+def import_price_list(data, user, mode='full', progress=None, digest=None, summary=None):
+    """
+    Импорт прайс-листа (словаря или PriceList) от имени поставщика.
+
+    digest - хеш загруженного файла: если он совпадает с хешем последнего
+    успешного импорта магазина, запись в БД пропускается.
+    summary - итоги предварительного прохода по файлу (PriceListSummary):
+    по ним общие справочники создаются до блокировки магазина.
+    Возвращает словарь с результатом в формате ответов API.
+    Ошибки разбора файла пробрасываются вызывающему коду.
+    """
+    if isinstance(data, dict):
+        # Словарь уже в памяти - итоги считаются отдельным проходом по товарам
+        summary = summarize(PriceList.from_dict(data))
+        data = PriceList.from_dict(data)
+
+    # Поле shop может идти в файле после goods - тогда он известен только из итогов прохода.
+    # В плоских форматах магазин может быть не указан - берем магазин поставщика
+    shop_name = (data.shop or (summary.shop if summary else None)
+                 or Shop.objects.filter(user=user).values_list('name', flat=True).first())
+    if not shop_name:
+        return {'Status': False, 'Error': 'В прайс-листе не указан магазин (поле shop)'}
+
+    try:
+        # Магазин создается отдельно от импорта, чтобы импорт мог заблокировать его строку
+        with transaction.atomic():
+            shop, created = Shop.objects.get_or_create(
+                name=shop_name,
+                defaults={'user': user, 'is_active': True}
+            )
+
+        # Если магазин уже существует, проверяем владельца
+        if not created and shop.user_id != user.id:
+            return {'Status': False, 'Error': 'У вас нет прав на обновление этого магазина'}
+
+        if summary:
+            upsert_dictionaries(summary)
+
+        with transaction.atomic():
+            # Блокировка строки магазина: импорты одного магазина идут по очереди,
+            # импорты разных магазинов - параллельно
+            shop = Shop.objects.select_for_update().get(pk=shop.pk)
+
+            # Тот же файл уже импортирован - в БД ничего не меняется
+            if digest and shop.import_digest == digest:
+                return _not_modified(shop.name)
+
+            importer = IMPORT_MODES[mode](shop, progress=progress)
+
+            # Обрабатываем категории
+            importer.import_categories(data.categories)
+
+            # Полный импорт удаляет старые товары, дифференциальный - загружает их для сравнения
+            importer.begin()
+
+            # Обрабатываем товары пачками
+            importer.import_goods(data.goods)
+
+            # Категории могут быть записаны в файле после goods
+            importer.import_categories(data.categories)
+
+            importer.finish()
+
+            # Плоский каталог и фасеты обновляются в той же транзакции
+            importer.update_catalog()
+            refresh_facets([shop.id], importer.batch_size)
+
+            shop.import_digest = digest or ''
+            shop.import_chunk_digests = {'batch_size': importer.batch_size, 'chunks': importer.chunk_digests}
+            # Сохранение магазина сбрасывает кэш каталога (signals.shop_saved)
+            shop.save(update_fields=['import_digest', 'import_chunk_digests'])
+
+            return {
+                'Status': True,
+                'Message': f'Импорт завершен. Магазин: {shop.name}, Товаров: {importer.goods_count}',
+                **importer.stats
+            }
+
+    except (yaml.YAMLError, PriceListError):
+        raise
+    except Exception as e:
+        return {'Status': False, 'Error': f'Ошибка транзакции: {str(e)}'}
@@ -0,0 +1,94 @@
+import json
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.db.models import Prefetch
+from rest_framework.renderers import JSONRenderer
+
+from procurement.models import ProductInfo, ProductParameter
+from procurement.serializers import PRODUCT_INFO_VALUES, ProductInfoSerializer, serialize_product_infos
+
+from .benchmark_import import QueryCounter
+
+
+class Command(BaseCommand):
+    help = ('Замеры сериализации страниц /products/: ProductInfoSerializer против serialize_product_infos '
+            'на данных настроенной БД. Проверяет, что JSON обоих путей совпадает побайтно.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--pages', type=int, default=20, help='Число страниц')
+        parser.add_argument('--page-size', type=int, default=40)
+        parser.add_argument('--shop-id', type=int)
+        parser.add_argument('--category-id', type=int)
+        parser.add_argument('--repeat', type=int, default=3, help='Повторов каждой страницы, берется лучший')
+        parser.add_argument('--output', '-o', help='Файл для записи результатов в JSON')
+
+    def handle(self, *args, **options):
+        queryset = ProductInfo.objects.filter(shop__is_active=True, quantity__gt=0).order_by('id')
+        if options['shop_id']:
+            queryset = queryset.filter(shop_id=options['shop_id'])
+        if options['category_id']:
+            queryset = queryset.filter(product__category_id=options['category_id'])
+
+        size = options['page_size']
+        pages = [queryset[number * size:(number + 1) * size] for number in range(options['pages'])]
+        runs = {'serializer': [], 'values': []}
+        for page in pages:
+            reference, serializer_run = self.measure(lambda: self.render_serializer(page), options['repeat'])
+            data, values_run = self.measure(lambda: self.render_values(page), options['repeat'])
+            if data != reference:
+                raise CommandError(f'JSON не совпадает для страницы из {len(json.loads(reference))} строк')
+            if not json.loads(data):
+                break
+            runs['serializer'].append(serializer_run)
+            runs['values'].append(values_run)
+
+        if not runs['values']:
+            raise CommandError('В каталоге нет товаров для замера')
+
+        result = {
+            'vendor': connection.vendor,
+            'page_size': size,
+            'pages': len(runs['values']),
+            **{name: self.summarize(name_runs) for name, name_runs in runs.items()},
+        }
+        result['speedup'] = round(result['serializer']['ms_per_page'] / result['values']['ms_per_page'], 1)
+
+        for name in runs:
+            self.stdout.write(f'{name:<10} {result[name]["ms_per_page"]:>8.2f} мс/страница '
+                              f'{result[name]["queries_per_page"]:>5} запросов')
+        self.stdout.write(f'Ускорение: x{result["speedup"]} (страниц: {result["pages"]}, JSON совпадает)')
+
+        if options['output']:
+            with open(options['output'], 'w', encoding='utf-8') as stream:
+                json.dump(result, stream, ensure_ascii=False, indent=2)
+            self.stdout.write(f'Результаты записаны в {options["output"]}')
+
+    def render_serializer(self, page):
+        """Путь DRF с запросами без N+1: связанные объекты через select_related и prefetch"""
+        page = page.select_related('product__category', 'shop').prefetch_related(
+            Prefetch('parameters', queryset=ProductParameter.objects.select_related('parameter').order_by('id')))
+        return JSONRenderer().render(ProductInfoSerializer(page, many=True).data)
+
+    def render_values(self, page):
+        return JSONRenderer().render(serialize_product_infos(page.values(*PRODUCT_INFO_VALUES)))
+
+    def measure(self, render, repeat):
+        """Лучшее время из repeat повторов: запросы, сериализация и рендеринг JSON"""
+        best = None
+        for _ in range(repeat):
+            counter = QueryCounter()
+            with connection.execute_wrapper(counter):
+                started = time.perf_counter()
+                data = render()
+                seconds = time.perf_counter() - started
+            if best is None or seconds < best['seconds']:
+                best = {'seconds': seconds, 'queries': counter.count}
+        return data, best
+
+    def summarize(self, runs):
+        return {
+            'ms_per_page': round(sum(run['seconds'] for run in runs) / len(runs) * 1000, 2),
+            'queries_per_page': round(sum(run['queries'] for run in runs) / len(runs), 1),
+        }
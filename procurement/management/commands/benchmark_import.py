@@ -0,0 +1,171 @@
+import argparse
+import json
+import os
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+
+from django.conf import settings
+from django.core.files import File
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+
+from procurement.importers import IMPORT_MODES, import_price_list
+from procurement.models import User
+from procurement.price_lists import PRICE_LIST_FORMATS, file_digest, scan_price_list
+from procurement.synthetic import write_price_list
+
+ENGINES = {
+    'sqlite': 'django.db.backends.sqlite3',
+    'postgresql': 'django.db.backends.postgresql',
+}
+
+
+class QueryCounter:
+    """Обертка выполнения запросов: считает запросы, не сохраняя их текст"""
+
+    def __init__(self):
+        self.count = 0
+
+    def __call__(self, execute, sql, params, many, context):
+        self.count += 1
+        return execute(sql, params, many, context)
+
+
+def peak_rss_mb():
+    """Пиковый RSS процесса в МБ (ru_maxrss - КБ на Linux, байты на macOS)"""
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return round(peak / (1024 * 1024 if sys.platform == 'darwin' else 1024), 1)
+
+
+class Command(BaseCommand):
+    help = ('Замеры импорта прайс-листа на синтетических каталогах: время, число запросов и пиковая память. '
+            'Каждый замер идет в отдельном процессе на отдельной тестовой БД.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--sizes', type=int, nargs='+', default=[1000, 10000, 100000],
+                            help='Размеры каталога (число товаров)')
+        parser.add_argument('--engines', nargs='+', choices=sorted(ENGINES),
+                            help='СУБД для замеров (по умолчанию - настроенная в DB_ENGINE)')
+        parser.add_argument('--format', choices=sorted(PRICE_LIST_FORMATS), default='yaml')
+        parser.add_argument('--mode', choices=sorted(IMPORT_MODES), default='full',
+                            help='Режим повторного импорта того же файла')
+        parser.add_argument('--categories', type=int, default=50)
+        parser.add_argument('--parameters', type=int, default=5, help='Параметров у каждого товара')
+        parser.add_argument('--parameter-pool', type=int, default=50)
+        parser.add_argument('--output', '-o', help='Файл для записи результатов в JSON')
+        # Служебный аргумент: один замер в дочернем процессе
+        parser.add_argument('--run-size', type=int, help=argparse.SUPPRESS)
+
+    def handle(self, *args, **options):
+        if options['run_size']:
+            result = self.run_benchmark(options['run_size'], options)
+            self.stdout.write(json.dumps(result, ensure_ascii=False))
+            return
+
+        results = []
+        for engine in options['engines'] or [None]:
+            for size in options['sizes']:
+                result = self.run_child(engine, size, options)
+                results.append(result)
+                self.print_result(result)
+
+        if options['output']:
+            with open(options['output'], 'w', encoding='utf-8') as stream:
+                json.dump(results, stream, ensure_ascii=False, indent=2)
+            self.stdout.write(f'Результаты записаны в {options["output"]}')
+
+    def run_child(self, engine, size, options):
+        """Запускает замер в отдельном процессе, чтобы пиковая память относилась к одному размеру"""
+        env = os.environ.copy()
+        if engine:
+            env['DB_ENGINE'] = ENGINES[engine]
+        if env.get('DB_ENGINE', '').endswith('sqlite3'):
+            env['DB_NAME'] = os.path.join(tempfile.gettempdir(), 'benchmark_import.sqlite3')
+
+        command = [
+            sys.executable, str(settings.BASE_DIR / 'manage.py'), 'benchmark_import',
+            '--run-size', str(size),
+            '--format', options['format'],
+            '--mode', options['mode'],
+            '--categories', str(options['categories']),
+            '--parameters', str(options['parameters']),
+            '--parameter-pool', str(options['parameter_pool']),
+        ]
+        process = subprocess.run(command, env=env, capture_output=True, text=True)
+        if process.returncode != 0:
+            raise CommandError(f'Замер {size} товаров завершился с ошибкой:\n{process.stderr}')
+        # Последняя строка вывода - результат, выше может быть вывод настроек
+        return json.loads(process.stdout.strip().splitlines()[-1])
+
+    def run_benchmark(self, size, options):
+        """Один замер: начальный импорт в пустую БД и повторный импорт того же файла"""
+        if connection.vendor == 'sqlite':
+            # Файловая БД вместо :memory:, чтобы замер был ближе к реальной работе
+            connection.settings_dict['TEST']['NAME'] = os.path.join(
+                tempfile.gettempdir(), f'test_benchmark_import_{os.getpid()}.sqlite3')
+        old_name = connection.settings_dict['NAME']
+        connection.creation.create_test_db(verbosity=0, autoclobber=True, serialize=False)
+
+        try:
+            with tempfile.NamedTemporaryFile('w+', encoding='utf-8', newline='',
+                                             suffix=f'.{options["format"]}') as price_file:
+                write_price_list(price_file, options['format'], goods=size,
+                                 categories=options['categories'], parameters=options['parameters'],
+                                 parameter_pool=options['parameter_pool'])
+                price_file.flush()
+                file_size = os.path.getsize(price_file.name)
+
+                user = User.objects.create_user(email='benchmark@example.com', password='benchmark', type='shop')
+                rss_before = peak_rss_mb()
+                runs = [
+                    self.measure('initial', price_file.name, user, 'full', options['format']),
+                    self.measure('reimport', price_file.name, user, options['mode'], options['format']),
+                ]
+        finally:
+            connection.creation.destroy_test_db(old_name, verbosity=0)
+
+        return {
+            'vendor': connection.vendor,
+            'size': size,
+            'format': options['format'],
+            'mode': options['mode'],
+            'file_mb': round(file_size / (1024 * 1024), 1),
+            'rss_before_mb': rss_before,
+            'peak_rss_mb': peak_rss_mb(),
+            'runs': runs,
+        }
+
+    def measure(self, name, path, user, mode, price_list_format):
+        """Замер импорта по тому же пути, что и PartnerUpdate: хеш, предварительный проход, импорт"""
+        counter = QueryCounter()
+        with open(path, 'rb') as stream, connection.execute_wrapper(counter):
+            started = time.perf_counter()
+            price_file = File(stream)
+            # Хеш считается, как в PartnerUpdate, но не передается: иначе повторный импорт будет пропущен
+            file_digest(price_file)
+            summary = scan_price_list(price_file, price_list_format)
+            price_file.seek(0)
+            result = import_price_list(PRICE_LIST_FORMATS[price_list_format](price_file), user, mode,
+                                       summary=summary)
+            seconds = time.perf_counter() - started
+
+        if not result['Status']:
+            raise CommandError(result['Error'])
+        return {
+            'pass': name,
+            'seconds': round(seconds, 2),
+            'queries': counter.count,
+            'goods_per_second': round(summary.total / seconds) if seconds else None,
+            'result': {key: value for key, value in result.items() if key not in ('Status', 'Message')},
+        }
+
+    def print_result(self, result):
+        for run in result['runs']:
+            self.stdout.write(
+                f'{result["vendor"]:<10} {result["size"]:>8} {result["format"]:<6} {run["pass"]:<8} '
+                f'{run["seconds"]:>8.2f} с {run["queries"]:>7} запросов '
+                f'{run["goods_per_second"] or 0:>8} тов/с  пик RSS {result["peak_rss_mb"]} МБ'
+            )
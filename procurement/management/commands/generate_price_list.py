@@ -0,0 +1,39 @@
+import sys
+
+from django.core.management.base import BaseCommand
+
+from procurement.price_lists import PRICE_LIST_FORMATS
+from procurement.synthetic import write_price_list
+
+
+class Command(BaseCommand):
+    help = 'Генерирует синтетический прайс-лист для нагрузочных замеров импорта'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--goods', type=int, default=1000, help='Число товаров')
+        parser.add_argument('--categories', type=int, default=10, help='Число категорий')
+        parser.add_argument('--parameters', type=int, default=5, help='Параметров у каждого товара')
+        parser.add_argument('--parameter-pool', type=int, default=50, help='Всего разных названий параметров')
+        parser.add_argument('--format', choices=sorted(PRICE_LIST_FORMATS), default='yaml')
+        parser.add_argument('--shop', default='Синтетический магазин', help='Название магазина')
+        parser.add_argument('--seed', type=int, default=0, help='Зерно генератора случайных чисел')
+        parser.add_argument('--output', '-o', help='Файл для записи (по умолчанию stdout)')
+
+    def handle(self, *args, **options):
+        params = {
+            'price_list_format': options['format'],
+            'shop': options['shop'],
+            'goods': options['goods'],
+            'categories': options['categories'],
+            'parameters': options['parameters'],
+            'parameter_pool': options['parameter_pool'],
+            'seed': options['seed'],
+        }
+
+        if not options['output']:
+            write_price_list(sys.stdout, **params)
+            return
+
+        with open(options['output'], 'w', encoding='utf-8', newline='') as stream:
+            count = write_price_list(stream, **params)
+        self.stderr.write(f'Записано товаров: {count} в {options["output"]}')
@@ -0,0 +1,38 @@
+# Generated by Django 4.2 on 2026-10-18 12:26
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('procurement', '0003_alter_user_managers_remove_user_username'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ImportJob',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('file', models.FileField(upload_to='imports/%Y/%m/%d/', verbose_name='Файл прайс-листа')),
+                ('mode', models.CharField(default='full', max_length=10, verbose_name='Режим импорта')),
+                ('state', models.CharField(choices=[('pending', 'В очереди'), ('running', 'Выполняется'), ('done', 'Завершен'), ('failed', 'Ошибка')], default='pending', max_length=10, verbose_name='Состояние')),
+                ('task_id', models.CharField(blank=True, max_length=50, verbose_name='ID задачи Celery')),
+                ('total', models.PositiveIntegerField(blank=True, null=True, verbose_name='Всего товаров')),
+                ('processed', models.PositiveIntegerField(default=0, verbose_name='Обработано товаров')),
+                ('errors', models.JSONField(blank=True, default=list, verbose_name='Ошибки')),
+                ('result', models.JSONField(blank=True, null=True, verbose_name='Результат')),
+                ('created_at', models.DateTimeField(auto_now_add=True, verbose_name='Дата создания')),
+                ('started_at', models.DateTimeField(blank=True, null=True, verbose_name='Начало импорта')),
+                ('finished_at', models.DateTimeField(blank=True, null=True, verbose_name='Окончание импорта')),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='import_jobs', to=settings.AUTH_USER_MODEL, verbose_name='Поставщик')),
+            ],
+            options={
+                'verbose_name': 'Задание импорта',
+                'verbose_name_plural': 'Задания импорта',
+                'ordering': ['-created_at'],
+            },
+        ),
+    ]
@@ -0,0 +1,23 @@
+# Generated by Django 4.2 on 2026-10-18 12:28
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('procurement', '0004_importjob'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='shop',
+            name='import_chunk_digests',
+            field=models.JSONField(blank=True, default=dict, verbose_name='Хеши пачек последнего прайса'),
+        ),
+        migrations.AddField(
+            model_name='shop',
+            name='import_digest',
+            field=models.CharField(blank=True, max_length=64, verbose_name='Хеш последнего прайса'),
+        ),
+    ]
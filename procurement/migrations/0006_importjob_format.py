@@ -0,0 +1,18 @@
+# Generated by Django 4.2 on 2026-10-18 12:30
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('procurement', '0005_shop_import_chunk_digests_shop_import_digest'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='importjob',
+            name='format',
+            field=models.CharField(default='yaml', max_length=10, verbose_name='Формат файла'),
+        ),
+    ]
@@ -0,0 +1,42 @@
+# Generated by Django 4.2 on 2026-10-18 12:33
+
+from django.db import migrations, models
+from django.db.models import Count, Min
+
+
+def merge_duplicate_parameters(apps, schema_editor):
+    """Объединяет параметры с одинаковым названием перед добавлением уникальности"""
+    Parameter = apps.get_model('procurement', 'Parameter')
+    ProductParameter = apps.get_model('procurement', 'ProductParameter')
+
+    duplicates = (Parameter.objects.values('name')
+                  .annotate(keep_id=Min('id'), total=Count('id'))
+                  .filter(total__gt=1))
+    for duplicate in duplicates:
+        keep_id = duplicate['keep_id']
+        other_ids = list(Parameter.objects.filter(name=duplicate['name'])
+                         .exclude(id=keep_id).values_list('id', flat=True))
+
+        for other_id in other_ids:
+            # Значения, которые уже есть у оставляемого параметра, удаляем
+            kept_products = ProductParameter.objects.filter(parameter_id=keep_id).values('product_info_id')
+            ProductParameter.objects.filter(parameter_id=other_id,
+                                            product_info_id__in=kept_products).delete()
+            ProductParameter.objects.filter(parameter_id=other_id).update(parameter_id=keep_id)
+        Parameter.objects.filter(id__in=other_ids).delete()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('procurement', '0006_importjob_format'),
+    ]
+
+    operations = [
+        migrations.RunPython(merge_duplicate_parameters, migrations.RunPython.noop),
+        migrations.AlterField(
+            model_name='parameter',
+            name='name',
+            field=models.CharField(max_length=100, unique=True, verbose_name='Название параметра'),
+        ),
+    ]
@@ -0,0 +1,66 @@
+# Generated by Django 4.2 on 2026-10-18 12:38
+
+from django.db import migrations, models
+from django.db.models import Count, Min
+
+
+def merge_duplicate_baskets(apps, schema_editor):
+    """Объединяет лишние корзины пользователя в самую раннюю перед добавлением уникальности"""
+    Order = apps.get_model('procurement', 'Order')
+    OrderItem = apps.get_model('procurement', 'OrderItem')
+
+    duplicates = (Order.objects.filter(status='basket').values('user_id')
+                  .annotate(keep_id=Min('id'), total=Count('id'))
+                  .filter(total__gt=1))
+    for duplicate in duplicates:
+        keep_id = duplicate['keep_id']
+        kept_items = {item.product_info_id: item for item in OrderItem.objects.filter(order_id=keep_id)}
+        other_ids = list(Order.objects.filter(user_id=duplicate['user_id'], status='basket')
+                         .exclude(id=keep_id).values_list('id', flat=True))
+
+        for item in OrderItem.objects.filter(order_id__in=other_ids):
+            if item.product_info_id in kept_items:
+                kept = kept_items[item.product_info_id]
+                kept.quantity += item.quantity
+                kept.save(update_fields=['quantity'])
+                item.delete()
+            else:
+                item.order_id = keep_id
+                item.save(update_fields=['order'])
+                kept_items[item.product_info_id] = item
+        Order.objects.filter(id__in=other_ids).delete()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('procurement', '0007_parameter_name_unique'),
+    ]
+
+    operations = [
+        migrations.RunPython(merge_duplicate_baskets, migrations.RunPython.noop),
+        migrations.AddIndex(
+            model_name='order',
+            index=models.Index(fields=['user', 'status'], name='order_user_status_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='order',
+            index=models.Index(fields=['user', '-created_at'], name='order_user_created_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='order',
+            index=models.Index(fields=['-created_at'], name='order_created_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='productinfo',
+            index=models.Index(condition=models.Q(('quantity__gt', 0)), fields=['shop', 'id'], name='productinfo_shop_in_stock_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='productinfo',
+            index=models.Index(condition=models.Q(('quantity__gt', 0)), fields=['product', 'id'], name='productinfo_prod_in_stock_idx'),
+        ),
+        migrations.AddConstraint(
+            model_name='order',
+            constraint=models.UniqueConstraint(condition=models.Q(('status', 'basket')), fields=('user',), name='unique_basket_per_user'),
+        ),
+    ]
@@ -0,0 +1,83 @@
+# Generated by Django 4.2 on 2026-10-18 12:40
+
+from collections import defaultdict
+
+from django.db import migrations, models
+
+
+def fill_catalog(apps, schema_editor):
+    """Заполняет плоский каталог текущими предложениями в наличии"""
+    ProductInfo = apps.get_model('procurement', 'ProductInfo')
+    ProductParameter = apps.get_model('procurement', 'ProductParameter')
+    CatalogEntry = apps.get_model('procurement', 'CatalogEntry')
+
+    product_infos = (ProductInfo.objects.filter(quantity__gt=0, shop__is_active=True).order_by('id')
+                     .values('id', 'product_id', 'product__name', 'product__category_id',
+                             'product__category__name', 'shop_id', 'shop__name', 'shop__url',
+                             'external_id', 'model', 'price', 'price_rrc', 'quantity'))
+    chunk = []
+    for row in product_infos.iterator(chunk_size=1000):
+        chunk.append(row)
+        if len(chunk) == 1000:
+            _create_entries(CatalogEntry, ProductParameter, chunk)
+            chunk = []
+    _create_entries(CatalogEntry, ProductParameter, chunk)
+
+
+def _create_entries(CatalogEntry, ProductParameter, rows):
+    parameters = defaultdict(dict)
+    for product_info_id, name, value in ProductParameter.objects.filter(
+            product_info_id__in=[row['id'] for row in rows]).values_list('product_info_id', 'parameter__name', 'value'):
+        parameters[product_info_id][name] = value
+    CatalogEntry.objects.bulk_create([
+        CatalogEntry(
+            id=row['id'], product_id=row['product_id'], product_name=row['product__name'],
+            category_id=row['product__category_id'], category_name=row['product__category__name'],
+            shop_id=row['shop_id'], shop_name=row['shop__name'], shop_url=row['shop__url'],
+            external_id=row['external_id'], model=row['model'], price=row['price'],
+            price_rrc=row['price_rrc'], quantity=row['quantity'], parameters=parameters[row['id']],
+        )
+        for row in rows
+    ])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('procurement', '0008_catalog_and_order_indexes'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='CatalogEntry',
+            fields=[
+                ('id', models.BigIntegerField(primary_key=True, serialize=False, verbose_name='ID предложения')),
+                ('product_id', models.BigIntegerField(verbose_name='ID товара')),
+                ('product_name', models.CharField(max_length=200, verbose_name='Название товара')),
+                ('category_id', models.BigIntegerField(verbose_name='ID категории')),
+                ('category_name', models.CharField(max_length=100, verbose_name='Название категории')),
+                ('shop_id', models.BigIntegerField(verbose_name='ID магазина')),
+                ('shop_name', models.CharField(max_length=100, verbose_name='Название магазина')),
+                ('shop_url', models.URLField(blank=True, null=True, verbose_name='Сайт магазина')),
+                ('external_id', models.PositiveIntegerField(verbose_name='ID у поставщика')),
+                ('model', models.CharField(blank=True, max_length=100, verbose_name='Модель')),
+                ('price', models.DecimalField(decimal_places=2, max_digits=10, verbose_name='Цена закупки')),
+                ('price_rrc', models.DecimalField(decimal_places=2, max_digits=10, verbose_name='Рекомендуемая цена')),
+                ('quantity', models.PositiveIntegerField(verbose_name='Количество на складе')),
+                ('parameters', models.JSONField(default=dict, verbose_name='Параметры')),
+            ],
+            options={
+                'verbose_name': 'Строка каталога',
+                'verbose_name_plural': 'Плоский каталог',
+            },
+        ),
+        migrations.AddIndex(
+            model_name='catalogentry',
+            index=models.Index(fields=['shop_id', 'id'], name='catalogentry_shop_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='catalogentry',
+            index=models.Index(fields=['category_id', 'id'], name='catalogentry_category_idx'),
+        ),
+        migrations.RunPython(fill_catalog, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,72 @@
+# Generated by Django 4.2 on 2026-10-18 12:42
+
+from django.db import migrations, models
+
+# Выражение индекса PostgreSQL; procurement.search строит запросы с тем же выражением
+PG_SEARCH_VECTOR = "to_tsvector('russian'::regconfig, search_text)"
+
+SQLITE_FTS_TABLE = 'procurement_catalogentry_fts'
+
+
+def fill_search_text(apps, schema_editor):
+    CatalogEntry = apps.get_model('procurement', 'CatalogEntry')
+    entries = []
+    for entry in CatalogEntry.objects.only('id', 'product_name', 'model', 'parameters').iterator(chunk_size=1000):
+        entry.search_text = ' '.join(
+            part for part in (entry.product_name, entry.model, *entry.parameters.values()) if part)
+        entries.append(entry)
+        if len(entries) == 1000:
+            CatalogEntry.objects.bulk_update(entries, ['search_text'])
+            entries = []
+    CatalogEntry.objects.bulk_update(entries, ['search_text'])
+
+
+def create_search_index(apps, schema_editor):
+    """PostgreSQL - GIN индекс по tsvector, SQLite - таблица FTS5, синхронизируемая триггерами"""
+    vendor = schema_editor.connection.vendor
+    if vendor == 'postgresql':
+        schema_editor.execute(
+            f'CREATE INDEX catalogentry_search_idx ON procurement_catalogentry USING GIN ({PG_SEARCH_VECTOR})')
+    elif vendor == 'sqlite':
+        for sql in (
+            f"CREATE VIRTUAL TABLE {SQLITE_FTS_TABLE} USING fts5(search_text, content='procurement_catalogentry', "
+            f"content_rowid='id', tokenize='unicode61 remove_diacritics 2')",
+            f"CREATE TRIGGER {SQLITE_FTS_TABLE}_ai AFTER INSERT ON procurement_catalogentry BEGIN "
+            f"INSERT INTO {SQLITE_FTS_TABLE}(rowid, search_text) VALUES (new.id, new.search_text); END",
+            f"CREATE TRIGGER {SQLITE_FTS_TABLE}_ad AFTER DELETE ON procurement_catalogentry BEGIN "
+            f"INSERT INTO {SQLITE_FTS_TABLE}({SQLITE_FTS_TABLE}, rowid, search_text) "
+            f"VALUES ('delete', old.id, old.search_text); END",
+            f"CREATE TRIGGER {SQLITE_FTS_TABLE}_au AFTER UPDATE ON procurement_catalogentry BEGIN "
+            f"INSERT INTO {SQLITE_FTS_TABLE}({SQLITE_FTS_TABLE}, rowid, search_text) "
+            f"VALUES ('delete', old.id, old.search_text); "
+            f"INSERT INTO {SQLITE_FTS_TABLE}(rowid, search_text) VALUES (new.id, new.search_text); END",
+            f"INSERT INTO {SQLITE_FTS_TABLE}({SQLITE_FTS_TABLE}) VALUES ('rebuild')",
+        ):
+            schema_editor.execute(sql)
+
+
+def drop_search_index(apps, schema_editor):
+    vendor = schema_editor.connection.vendor
+    if vendor == 'postgresql':
+        schema_editor.execute('DROP INDEX IF EXISTS catalogentry_search_idx')
+    elif vendor == 'sqlite':
+        for suffix in ('ai', 'ad', 'au'):
+            schema_editor.execute(f'DROP TRIGGER IF EXISTS {SQLITE_FTS_TABLE}_{suffix}')
+        schema_editor.execute(f'DROP TABLE IF EXISTS {SQLITE_FTS_TABLE}')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('procurement', '0009_catalogentry'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='catalogentry',
+            name='search_text',
+            field=models.TextField(blank=True, default='', verbose_name='Текст для поиска'),
+        ),
+        migrations.RunPython(fill_search_text, migrations.RunPython.noop),
+        migrations.RunPython(create_search_index, drop_search_index),
+    ]
@@ -0,0 +1,59 @@
+# Generated by Django 4.2 on 2026-10-18 12:54
+
+from django.db import migrations, models
+from django.db.models import Count
+
+
+def fill_facets(apps, schema_editor):
+    """Считает агрегат фасетов по текущим предложениям в наличии"""
+    ProductParameter = apps.get_model('procurement', 'ProductParameter')
+    ParameterFacet = apps.get_model('procurement', 'ParameterFacet')
+
+    counts = (ProductParameter.objects
+              .filter(product_info__shop__is_active=True, product_info__quantity__gt=0)
+              .values_list('product_info__shop_id', 'product_info__product__category_id', 'parameter__name', 'value')
+              .annotate(count=Count('id'))
+              .order_by())
+    ParameterFacet.objects.bulk_create(
+        [ParameterFacet(shop_id=shop_id, category_id=category_id, parameter=parameter, value=value, count=count)
+         for shop_id, category_id, parameter, value, count in counts],
+        batch_size=1000
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('procurement', '0010_catalog_search'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ParameterFacet',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('shop_id', models.BigIntegerField(verbose_name='ID магазина')),
+                ('category_id', models.BigIntegerField(verbose_name='ID категории')),
+                ('parameter', models.CharField(max_length=100, verbose_name='Название параметра')),
+                ('value', models.CharField(max_length=100, verbose_name='Значение')),
+                ('count', models.PositiveIntegerField(verbose_name='Число предложений')),
+            ],
+            options={
+                'verbose_name': 'Фасет параметра',
+                'verbose_name_plural': 'Фасеты параметров',
+            },
+        ),
+        migrations.AddIndex(
+            model_name='productparameter',
+            index=models.Index(fields=['parameter', 'value'], name='productparam_value_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='parameterfacet',
+            index=models.Index(fields=['shop_id'], name='parameterfacet_shop_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='parameterfacet',
+            index=models.Index(fields=['category_id'], name='parameterfacet_category_idx'),
+        ),
+        migrations.RunPython(fill_facets, migrations.RunPython.noop),
+    ]
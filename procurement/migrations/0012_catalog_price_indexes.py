@@ -0,0 +1,37 @@
+# Generated by Django 4.2 on 2026-10-18 12:57
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('procurement', '0011_parameter_facets'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='catalogentry',
+            index=models.Index(fields=['category_id', 'price', 'id'], name='catalogentry_cat_price_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='catalogentry',
+            index=models.Index(fields=['category_id', 'price_rrc', 'id'], name='catalogentry_cat_rrc_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='catalogentry',
+            index=models.Index(fields=['shop_id', 'price', 'id'], name='catalogentry_shop_price_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='catalogentry',
+            index=models.Index(fields=['shop_id', 'price_rrc', 'id'], name='catalogentry_shop_rrc_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='productinfo',
+            index=models.Index(condition=models.Q(('quantity__gt', 0)), fields=['shop', 'price', 'id'], name='productinfo_shop_price_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='productinfo',
+            index=models.Index(condition=models.Q(('quantity__gt', 0)), fields=['shop', 'price_rrc', 'id'], name='productinfo_shop_rrc_idx'),
+        ),
+    ]
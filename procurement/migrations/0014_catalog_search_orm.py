@@ -0,0 +1,52 @@
+# Generated by Django 4.2 on 2026-10-18 13:26
+
+from django.db import migrations, models
+
+# Прежнее выражение индекса PostgreSQL из 0010_catalog_search
+PG_SEARCH_VECTOR = "to_tsvector('russian'::regconfig, search_text)"
+
+
+def search_index():
+    """GIN индекс по выражению SearchVector, с которым procurement.search строит запросы"""
+    from django.contrib.postgres.indexes import GinIndex
+    from django.contrib.postgres.search import SearchVector
+    return GinIndex(SearchVector('search_text', config='russian'), name='catalogentry_search_idx')
+
+
+def rebuild_search_index(apps, schema_editor):
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    CatalogEntry = apps.get_model('procurement', 'CatalogEntry')
+    schema_editor.execute('DROP INDEX IF EXISTS catalogentry_search_idx')
+    schema_editor.add_index(CatalogEntry, search_index())
+
+
+def restore_search_index(apps, schema_editor):
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    schema_editor.execute('DROP INDEX IF EXISTS catalogentry_search_idx')
+    schema_editor.execute(
+        f'CREATE INDEX catalogentry_search_idx ON procurement_catalogentry USING GIN ({PG_SEARCH_VECTOR})')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('procurement', '0013_order_updated_at'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='CatalogSearchIndex',
+            fields=[
+                ('rowid', models.BigIntegerField(primary_key=True, serialize=False)),
+                ('search_text', models.TextField()),
+                ('rank', models.FloatField()),
+            ],
+            options={
+                'db_table': 'procurement_catalogentry_fts',
+                'managed': False,
+            },
+        ),
+        migrations.RunPython(rebuild_search_index, restore_search_index),
+    ]
@@ -1,5 +1,6 @@
 from django.contrib.auth.models import AbstractUser, BaseUserManager
 from django.db import models
+from django.utils import timezone
 
 STATUS_CHOICES = (
     ('basket', 'В корзине'),
@@ -16,6 +17,13 @@ USER_TYPES = (
     ('buyer', 'Покупатель'),
 )
 
+IMPORT_STATES = (
+    ('pending', 'В очереди'),
+    ('running', 'Выполняется'),
+    ('done', 'Завершен'),
+    ('failed', 'Ошибка'),
+)
+
 
 class UserManager(BaseUserManager):
     """
@@ -90,6 +98,9 @@ class Shop(models.Model):
     user = models.OneToOneField(User, verbose_name='Владелец', on_delete=models.CASCADE,
                                related_name='shop', blank=True, null=True)
     is_active = models.BooleanField('Принимает заказы', default=True)
+    # Отпечатки последнего успешно импортированного прайс-листа
+    import_digest = models.CharField('Хеш последнего прайса', max_length=64, blank=True)
+    import_chunk_digests = models.JSONField('Хеши пачек последнего прайса', default=dict, blank=True)
 
     class Meta:
         verbose_name = 'Магазин'
@@ -145,16 +156,118 @@ class ProductInfo(models.Model):
         verbose_name = 'Информация о товаре'
         verbose_name_plural = 'Информация о товарах'
         unique_together = ('product', 'shop', 'external_id')
+        indexes = [
+            # Каталог показывает только товары в наличии: частичные индексы по магазину
+            # и по товару (фильтр категории идет через товар), id - для курсорной пагинации
+            models.Index(fields=['shop', 'id'], condition=models.Q(quantity__gt=0),
+                         name='productinfo_shop_in_stock_idx'),
+            models.Index(fields=['product', 'id'], condition=models.Q(quantity__gt=0),
+                         name='productinfo_prod_in_stock_idx'),
+            # Сортировка по цене в магазине; сортировку в категории обслуживает плоский каталог
+            models.Index(fields=['shop', 'price', 'id'], condition=models.Q(quantity__gt=0),
+                         name='productinfo_shop_price_idx'),
+            models.Index(fields=['shop', 'price_rrc', 'id'], condition=models.Q(quantity__gt=0),
+                         name='productinfo_shop_rrc_idx'),
+        ]
 
     def __str__(self):
         return f'{self.product.name} в {self.shop.name}'
 
 
+class CatalogEntry(models.Model):
+    """
+    Плоская строка каталога: предложение магазина в наличии.
+
+    Read model для списка товаров без соединений таблиц. id совпадает с id
+    ProductInfo; строки поддерживаются функциями procurement.catalog.
+    """
+    id = models.BigIntegerField('ID предложения', primary_key=True)
+    product_id = models.BigIntegerField('ID товара')
+    product_name = models.CharField('Название товара', max_length=200)
+    category_id = models.BigIntegerField('ID категории')
+    category_name = models.CharField('Название категории', max_length=100)
+    shop_id = models.BigIntegerField('ID магазина')
+    shop_name = models.CharField('Название магазина', max_length=100)
+    shop_url = models.URLField('Сайт магазина', blank=True, null=True)
+    external_id = models.PositiveIntegerField('ID у поставщика')
+    model = models.CharField('Модель', max_length=100, blank=True)
+    price = models.DecimalField('Цена закупки', max_digits=10, decimal_places=2)
+    price_rrc = models.DecimalField('Рекомендуемая цена', max_digits=10, decimal_places=2)
+    quantity = models.PositiveIntegerField('Количество на складе')
+    # Параметры товара: {название: значение}
+    parameters = models.JSONField('Параметры', default=dict)
+    # Название, модель и значения параметров - по этому полю строится полнотекстовый индекс
+    search_text = models.TextField('Текст для поиска', blank=True, default='')
+
+    class Meta:
+        verbose_name = 'Строка каталога'
+        verbose_name_plural = 'Плоский каталог'
+        indexes = [
+            models.Index(fields=['shop_id', 'id'], name='catalogentry_shop_idx'),
+            models.Index(fields=['category_id', 'id'], name='catalogentry_category_idx'),
+            # Сортировка по цене внутри категории и магазина; в плоском каталоге только товары в наличии
+            models.Index(fields=['category_id', 'price', 'id'], name='catalogentry_cat_price_idx'),
+            models.Index(fields=['category_id', 'price_rrc', 'id'], name='catalogentry_cat_rrc_idx'),
+            models.Index(fields=['shop_id', 'price', 'id'], name='catalogentry_shop_price_idx'),
+            models.Index(fields=['shop_id', 'price_rrc', 'id'], name='catalogentry_shop_rrc_idx'),
+        ]
+
+    def __str__(self):
+        return f'{self.product_name} в {self.shop_name}'
+
+
+class CatalogSearchIndex(models.Model):
+    """
+    Таблица FTS5 полнотекстового индекса плоского каталога в SQLite
+    (миграция 0010_catalog_search). Таблицей управляют триггеры, модель нужна,
+    чтобы поиск присоединял индекс к CatalogEntry и ProductInfo по id средствами ORM.
+    """
+    rowid = models.BigIntegerField(primary_key=True)
+    search_text = models.TextField()
+    # Скрытый столбец FTS5: bm25 строки в полнотекстовом запросе, чем меньше, тем релевантнее
+    rank = models.FloatField()
+    catalog_entry = models.ForeignObject(CatalogEntry, on_delete=models.DO_NOTHING, from_fields=['rowid'],
+                                         to_fields=['id'], related_name='search_index')
+    product_info = models.ForeignObject(ProductInfo, on_delete=models.DO_NOTHING, from_fields=['rowid'],
+                                        to_fields=['id'], related_name='search_index')
+
+    class Meta:
+        managed = False
+        db_table = 'procurement_catalogentry_fts'
+
+
+class ParameterFacet(models.Model):
+    """
+    Число предложений в наличии со значением параметра - по магазину и категории.
+
+    Агрегат для фасетов каталога, пересчитывается по магазину при импорте
+    (procurement.catalog.refresh_facets). Обновление остатков и резервирование
+    при заказе меняют только счетчики закончившихся и появившихся предложений
+    (procurement.catalog.adjust_facets).
+    """
+    shop_id = models.BigIntegerField('ID магазина')
+    category_id = models.BigIntegerField('ID категории')
+    parameter = models.CharField('Название параметра', max_length=100)
+    value = models.CharField('Значение', max_length=100)
+    count = models.PositiveIntegerField('Число предложений')
+
+    class Meta:
+        verbose_name = 'Фасет параметра'
+        verbose_name_plural = 'Фасеты параметров'
+        indexes = [
+            models.Index(fields=['shop_id'], name='parameterfacet_shop_idx'),
+            models.Index(fields=['category_id'], name='parameterfacet_category_idx'),
+        ]
+
+    def __str__(self):
+        return f'{self.parameter}: {self.value} ({self.count})'
+
+
 class Parameter(models.Model):
     """
     Название параметра товара
     """
-    name = models.CharField('Название параметра', max_length=100)
+    name = models.CharField('Название параметра', max_length=100, unique=True)
 
     class Meta:
         verbose_name = 'Параметр'
@@ -177,6 +290,10 @@ class ProductParameter(models.Model):
         verbose_name = 'Параметр товара'
         verbose_name_plural = 'Параметры товаров'
         unique_together = ('product_info', 'parameter')
+        indexes = [
+            # Фильтр каталога param[название]=значение
+            models.Index(fields=['parameter', 'value'], name='productparam_value_idx'),
+        ]
 
     def __str__(self):
         return f'{self.parameter.name}: {self.value}'
@@ -208,6 +325,8 @@ class Order(models.Model):
     """
     user = models.ForeignKey(User, verbose_name='Пользователь', on_delete=models.CASCADE, related_name='orders')
     created_at = models.DateTimeField('Дата создания', auto_now_add=True)
+    # Меняется при сохранении заказа и изменении его позиций и адреса (signals) - маркер для ETag
+    updated_at = models.DateTimeField('Дата изменения', auto_now=True)
     # ИСПРАВЛЯЕМ: используем STATUS_CHOICES
     status = models.CharField('Статус', choices=STATUS_CHOICES, max_length=20, default='basket')
     contact = models.ForeignKey(Contact, verbose_name='Адрес доставки', on_delete=models.SET_NULL,
@@ -217,6 +336,16 @@ class Order(models.Model):
         verbose_name = 'Заказ'
         verbose_name_plural = 'Заказы'
         ordering = ['-created_at']
+        constraints = [
+            # У пользователя одна корзина
+            models.UniqueConstraint(fields=['user'], condition=models.Q(status='basket'),
+                                    name='unique_basket_per_user'),
+        ]
+        indexes = [
+            models.Index(fields=['user', 'status'], name='order_user_status_idx'),
+            models.Index(fields=['user', '-created_at'], name='order_user_created_idx'),
+            models.Index(fields=['-created_at'], name='order_created_idx'),
+        ]
 
     def __str__(self):
         return f'Заказ #{self.id} от {self.user.email}'
@@ -241,4 +370,39 @@ class OrderItem(models.Model):
     @property
     def total_price(self):
         """Общая стоимость позиции"""
-        return self.product_info.price * self.quantity
\ No newline at end of file
+        return self.product_info.price * self.quantity
+
+
+class ImportJob(models.Model):
+    """
+    Задание на асинхронный импорт прайс-листа
+    """
+    user = models.ForeignKey(User, verbose_name='Поставщик', on_delete=models.CASCADE, related_name='import_jobs')
+    file = models.FileField('Файл прайс-листа', upload_to='imports/%Y/%m/%d/')
+    mode = models.CharField('Режим импорта', max_length=10, default='full')
+    format = models.CharField('Формат файла', max_length=10, default='yaml')
+    state = models.CharField('Состояние', choices=IMPORT_STATES, max_length=10, default='pending')
+    task_id = models.CharField('ID задачи Celery', max_length=50, blank=True)
+    total = models.PositiveIntegerField('Всего товаров', null=True, blank=True)
+    processed = models.PositiveIntegerField('Обработано товаров', default=0)
+    errors = models.JSONField('Ошибки', default=list, blank=True)
+    result = models.JSONField('Результат', null=True, blank=True)
+    created_at = models.DateTimeField('Дата создания', auto_now_add=True)
+    started_at = models.DateTimeField('Начало импорта', null=True, blank=True)
+    finished_at = models.DateTimeField('Окончание импорта', null=True, blank=True)
+
+    class Meta:
+        verbose_name = 'Задание импорта'
+        verbose_name_plural = 'Задания импорта'
+        ordering = ['-created_at']
+
+    def __str__(self):
+        return f'Импорт #{self.id} от {self.user.email}'
+
+    @property
+    def throughput(self):
+        """Скорость импорта, товаров в секунду"""
+        if not self.started_at:
+            return None
+        elapsed = ((self.finished_at or timezone.now()) - self.started_at).total_seconds()
+        return round(self.processed / elapsed, 1) if elapsed > 0 else None
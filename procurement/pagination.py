@@ -0,0 +1,229 @@
+"""
+Постраничный вывод списков API
+"""
+import hashlib
+import json
+
+from django.conf import settings
+from django.core.cache import cache
+from django.core.paginator import EmptyPage, InvalidPage, Page, PageNotAnInteger, Paginator
+from django.db import connections
+from django.utils.functional import cached_property
+from django.utils.translation import gettext_lazy as _
+from rest_framework.exceptions import NotFound, ValidationError
+from rest_framework.pagination import BasePagination, CursorPagination, PageNumberPagination
+
+# Режимы count: exact - COUNT(*), cached - COUNT(*) из кэша с TTL,
+# estimated - оценка планировщика PostgreSQL, none - без count
+COUNT_MODES = ('exact', 'cached', 'estimated', 'none')
+
+
+def cached_count(queryset):
+    """COUNT(*) с кэшированием по тексту запроса на COUNT_CACHE_TIMEOUT секунд"""
+    sql, params = queryset.query.sql_with_params()
+    key = f'count:{queryset.db}:{hashlib.md5(f"{sql}|{params!r}".encode("utf-8")).hexdigest()}'
+    count = cache.get(key)
+    if count is None:
+        count = queryset.count()
+        cache.set(key, count, timeout=settings.COUNT_CACHE_TIMEOUT)
+    return count
+
+
+def estimated_count(queryset):
+    """
+    Оценка числа строк планировщиком PostgreSQL (EXPLAIN, без выполнения запроса).
+    Для других СУБД - None. Оценку меньше COUNT_ESTIMATE_THRESHOLD заменяет
+    точный COUNT(*): на малых выборках он дешев, а оценка неточна
+    """
+    if connections[queryset.db].vendor != 'postgresql':
+        return None
+    plan = json.loads(queryset.order_by().explain(format='json'))
+    estimate = int(plan[0]['Plan']['Plan Rows'])
+    if estimate < settings.COUNT_ESTIMATE_THRESHOLD:
+        return queryset.count()
+    return estimate
+
+
+def count_rows(queryset, mode):
+    """Число строк выборки в режиме mode; estimated без PostgreSQL работает как cached"""
+    if mode == 'none':
+        return None
+    if mode == 'estimated':
+        estimate = estimated_count(queryset)
+        if estimate is not None:
+            return estimate
+        mode = 'cached'
+    if mode == 'cached':
+        return cached_count(queryset)
+    return queryset.count()
+
+
+class CountModePaginator(Paginator):
+    """Paginator Django с count в выбранном режиме (для админки - estimated)"""
+    count_mode = 'exact'
+
+    def __init__(self, object_list, per_page, orphans=0, allow_empty_first_page=True, count_mode=None):
+        super().__init__(object_list, per_page, orphans, allow_empty_first_page)
+        self.count_mode = count_mode or self.count_mode
+
+    @cached_property
+    def count(self):
+        if self.count_mode == 'exact' or not hasattr(self.object_list, 'query'):
+            return super().count
+        return count_rows(self.object_list, self.count_mode)
+
+
+class EstimatedCountPaginator(CountModePaginator):
+    """Для списков админки по большим таблицам: число страниц по оценке планировщика"""
+    count_mode = 'estimated'
+
+
+class LookaheadPaginator(CountModePaginator):
+    """
+    Страницы без опоры на count: выбирается на одну строку больше страницы,
+    по ней определяется, есть ли следующая. count нужен только для ответа
+    и может быть приблизительным или не считаться вовсе
+    """
+
+    @cached_property
+    def num_pages(self):
+        return None
+
+    def validate_number(self, number):
+        try:
+            number = int(number)
+        except (TypeError, ValueError):
+            raise PageNotAnInteger(_('That page number is not an integer'))
+        if number < 1:
+            raise EmptyPage(_('That page number is less than 1'))
+        return number
+
+    def page(self, number):
+        number = self.validate_number(number)
+        bottom = (number - 1) * self.per_page
+        rows = list(self.object_list[bottom:bottom + self.per_page + 1])
+        if not rows and number > 1:
+            raise EmptyPage(_('That page contains no results'))
+        return LookaheadPage(rows[:self.per_page], number, self, has_next=len(rows) > self.per_page)
+
+
+class LookaheadPage(Page):
+    def __init__(self, object_list, number, paginator, has_next):
+        super().__init__(object_list, number, paginator)
+        self._has_next = has_next
+
+    def has_next(self):
+        return self._has_next
+
+
+class CountModePagination(PageNumberPagination):
+    """
+    Пагинация по номеру страницы с выбором режима count параметром
+    count=exact|cached|estimated|none (по умолчанию PAGINATION_COUNT_MODE).
+    В режимах кроме exact соседние страницы определяются без COUNT(*),
+    а в ответ добавляется count_mode
+    """
+    count_query_param = 'count'
+
+    def get_count_mode(self, request):
+        mode = request.query_params.get(self.count_query_param) or settings.PAGINATION_COUNT_MODE
+        if mode not in COUNT_MODES:
+            raise ValidationError({self.count_query_param: [f'Неверный режим count. Допустимые: {list(COUNT_MODES)}']})
+        return mode
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.count_mode = self.get_count_mode(request)
+        if self.count_mode == 'exact':
+            return super().paginate_queryset(queryset, request, view)
+
+        self.request = request
+        page_size = self.get_page_size(request)
+        if not page_size:
+            return None
+
+        paginator = LookaheadPaginator(queryset, page_size, count_mode=self.count_mode)
+        page_number = request.query_params.get(self.page_query_param) or 1
+        try:
+            self.page = paginator.page(page_number)
+        except InvalidPage as exc:
+            raise NotFound(self.invalid_page_message.format(page_number=page_number, message=str(exc)))
+        return list(self.page)
+
+    def get_paginated_response(self, data):
+        response = super().get_paginated_response(data)
+        if self.count_mode != 'exact':
+            response.data['count_mode'] = self.count_mode
+        return response
+
+    def get_schema_operation_parameters(self, view):
+        return super().get_schema_operation_parameters(view) + [{
+            'name': self.count_query_param,
+            'required': False,
+            'in': 'query',
+            'description': 'Режим count: exact, cached, estimated или none',
+            'schema': {'type': 'string', 'enum': list(COUNT_MODES)},
+        }]
+
+
+class ProductCursorPagination(CursorPagination):
+    """
+    Курсорная пагинация: следующая страница выбирается условием по полю
+    сортировки (id или цена) по индексу, без COUNT(*). Порядок берется
+    из get_ordering() представления, по умолчанию - по id. При равных
+    ценах DRF пропускает уже отданные строки через небольшой OFFSET.
+    """
+    ordering = 'id'
+
+    def get_ordering(self, request, queryset, view):
+        if hasattr(view, 'get_ordering'):
+            return view.get_ordering()
+        return super().get_ordering(request, queryset, view)
+
+
+class CatalogPagination(BasePagination):
+    """
+    Пагинация каталога, выбираемая в запросе.
+
+    По умолчанию - по номеру страницы (page, count в режиме из параметра
+    count, см. CountModePagination). С параметром
+    pagination=cursor или cursor=... - курсорная: ответ без count,
+    стоимость любой страницы равна стоимости первой. Поисковая выдача (q)
+    упорядочена по релевантности и листается только по номеру страницы.
+    """
+    mode_query_param = 'pagination'
+    search_query_param = 'q'
+
+    def __init__(self):
+        self.page_number = CountModePagination()
+        self.cursor = ProductCursorPagination()
+        self.paginator = self.page_number
+
+    def use_cursor(self, request):
+        if request.query_params.get(self.search_query_param):
+            return False
+        return (request.query_params.get(self.mode_query_param) == 'cursor'
+                or self.cursor.cursor_query_param in request.query_params)
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.paginator = self.cursor if self.use_cursor(request) else self.page_number
+        return self.paginator.paginate_queryset(queryset, request, view)
+
+    def get_paginated_response(self, data):
+        return self.paginator.get_paginated_response(data)
+
+    def get_paginated_response_schema(self, schema):
+        return self.page_number.get_paginated_response_schema(schema)
+
+    @property
+    def display_page_controls(self):
+        return getattr(self.paginator, 'display_page_controls', False)
+
+    def to_html(self):
+        return self.paginator.to_html()
+
+    def get_schema_fields(self, view):
+        return self.page_number.get_schema_fields(view) + self.cursor.get_schema_fields(view)
+
+    def get_schema_operation_parameters(self, view):
+        return (self.page_number.get_schema_operation_parameters(view)
+                + self.cursor.get_schema_operation_parameters(view))
@@ -0,0 +1,461 @@
+"""
+Чтение прайс-листов поставщиков
+"""
+import codecs
+import csv
+import hashlib
+import json
+import os
+from collections import OrderedDict
+from decimal import Decimal, InvalidOperation
+from itertools import chain
+
+import yaml
+
+try:
+    # C-парсер libyaml в разы быстрее чистого Python
+    from yaml import CSafeLoader as SafeLoader
+except ImportError:
+    from yaml import SafeLoader
+
+
+def file_digest(uploaded_file):
+    """SHA-256 загруженного файла, читается частями; после подсчета файл перематывается"""
+    digest = hashlib.sha256()
+    for chunk in uploaded_file.chunks():
+        digest.update(chunk)
+    uploaded_file.seek(0)
+    return digest.hexdigest()
+
+
+def goods_digest(goods):
+    """SHA-256 пачки товаров в каноническом JSON представлении"""
+    payload = json.dumps(goods, sort_keys=True, ensure_ascii=False, default=str)
+    return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+
+# Сколько якорей YAML хранится при потоковом чтении. Вытесняются давно не
+# использованные, поэтому якорь на каждом товаре не держит в памяти весь файл,
+# а общие блоки, на которые ссылаются постоянно, остаются
+MAX_YAML_ANCHORS = 1000
+
+# Обязательные поля товара во всех форматах
+REQUIRED_FIELDS = ('id', 'category', 'name', 'price', 'price_rrc', 'quantity')
+
+
+class PriceListError(ValueError):
+    """Ошибка структуры или данных прайс-листа"""
+
+
+def validate_good(good, number):
+    """Проверяет обязательные поля товара и приводит числовые поля к int"""
+    if not isinstance(good, dict):
+        raise PriceListError(f'Товар #{number}: ожидался объект с полями товара')
+
+    missing = [field for field in REQUIRED_FIELDS if good.get(field) in (None, '')]
+    if missing:
+        raise PriceListError(f'Товар #{number}: не заполнены поля {", ".join(missing)}')
+
+    try:
+        for field in ('id', 'category', 'quantity'):
+            good[field] = int(good[field])
+        for field in ('price', 'price_rrc'):
+            Decimal(str(good[field]))
+    except (TypeError, ValueError, InvalidOperation):
+        raise PriceListError(f'Товар #{number}: неверное числовое значение')
+    if good['id'] < 0 or good['quantity'] < 0:
+        raise PriceListError(f'Товар #{number}: id и quantity не могут быть отрицательными')
+
+    if good.get('parameters') is None:
+        good['parameters'] = {}
+    elif not isinstance(good['parameters'], dict):
+        raise PriceListError(f'Товар #{number}: parameters должен быть объектом')
+    else:
+        # Названия параметров в БД строковые; YAML может дать числовой ключ
+        good['parameters'] = {str(name): value for name, value in good['parameters'].items()}
+    return good
+
+
+class PriceList:
+    """
+    Прайс-лист: название магазина, категории и поток товаров.
+
+    goods может быть генератором - тогда товары читаются по одному,
+    а поля, записанные в файле после goods, заполняются по его окончании.
+    """
+
+    def __init__(self, shop=None, categories=None, goods=()):
+        self.shop = shop
+        self.categories = categories or []
+        self.goods = goods
+
+    @classmethod
+    def from_dict(cls, data):
+        goods = (validate_good(good, number) for number, good in enumerate(data.get('goods', []), 1))
+        return cls(data.get('shop'), data.get('categories', []), goods)
+
+
+class YAMLPriceList(PriceList):
+    """
+    Потоковое чтение YAML прайс-листа.
+
+    Файл разбирается по событиям парсера, в памяти одновременно находится
+    только один товар из goods, поэтому расход памяти не зависит от размера файла.
+    Якорей хранится не больше MAX_YAML_ANCHORS последних использованных:
+    ссылка на вытесненный якорь - ошибка прайс-листа.
+    """
+
+    def __init__(self, stream):
+        super().__init__()
+        self._loader = SafeLoader(stream)
+        self._anchors = OrderedDict()
+
+        self._expect(yaml.StreamStartEvent)
+        self._expect(yaml.DocumentStartEvent)
+        self._expect(yaml.MappingStartEvent)
+        self.goods = self._iter_goods() if self._read_header() else iter(())
+
+    def _read_header(self):
+        """Читает поля верхнего уровня до goods, возвращает True если goods найден"""
+        while not self._loader.check_event(yaml.MappingEndEvent):
+            key = self._construct()
+            if key == 'goods':
+                return True
+            value = self._construct()
+            if key == 'shop':
+                self.shop = value
+            elif key == 'categories':
+                self.categories = value or []
+        return False
+
+    def _iter_goods(self):
+        try:
+            if self._loader.check_event(yaml.SequenceStartEvent):
+                self._loader.get_event()
+                number = 0
+                while not self._loader.check_event(yaml.SequenceEndEvent):
+                    number += 1
+                    yield validate_good(self._construct(), number)
+                self._loader.get_event()
+            elif self._construct() is not None:
+                raise yaml.YAMLError('Поле goods должно быть списком')
+
+            # Поля, записанные после goods
+            if self._read_header():
+                raise yaml.YAMLError('Поле goods указано повторно')
+        finally:
+            self._loader.dispose()
+
+    def _expect(self, event_class):
+        event = self._loader.get_event()
+        if not isinstance(event, event_class):
+            raise yaml.YAMLError(f'Неверная структура прайс-листа: {event}')
+        return event
+
+    def _construct(self):
+        """Собирает следующий узел из событий парсера и превращает его в объект Python"""
+        return self._loader.construct_document(self._compose())
+
+    def _compose(self):
+        loader = self._loader
+        event = loader.get_event()
+
+        if isinstance(event, yaml.AliasEvent):
+            if event.anchor not in self._anchors:
+                raise yaml.YAMLError(f'Неизвестный якорь: {event.anchor} (хранятся только '
+                                     f'{MAX_YAML_ANCHORS} последних использованных якорей)')
+            self._anchors.move_to_end(event.anchor)
+            return self._anchors[event.anchor]
+
+        if isinstance(event, yaml.ScalarEvent):
+            tag = event.tag
+            if tag is None or tag == '!':
+                tag = loader.resolve(yaml.ScalarNode, event.value, event.implicit)
+            node = yaml.ScalarNode(tag, event.value, event.start_mark, event.end_mark, style=event.style)
+        elif isinstance(event, yaml.SequenceStartEvent):
+            tag = event.tag
+            if tag is None or tag == '!':
+                tag = loader.resolve(yaml.SequenceNode, None, event.implicit)
+            node = yaml.SequenceNode(tag, [], event.start_mark, None, flow_style=event.flow_style)
+        elif isinstance(event, yaml.MappingStartEvent):
+            tag = event.tag
+            if tag is None or tag == '!':
+                tag = loader.resolve(yaml.MappingNode, None, event.implicit)
+            node = yaml.MappingNode(tag, [], event.start_mark, None, flow_style=event.flow_style)
+        else:
+            raise yaml.YAMLError(f'Неверная структура прайс-листа: {event}')
+
+        if event.anchor is not None:
+            self._anchors[event.anchor] = node
+            self._anchors.move_to_end(event.anchor)
+            if len(self._anchors) > MAX_YAML_ANCHORS:
+                self._anchors.popitem(last=False)
+
+        if isinstance(node, yaml.SequenceNode):
+            while not loader.check_event(yaml.SequenceEndEvent):
+                node.value.append(self._compose())
+            node.end_mark = loader.get_event().end_mark
+        elif isinstance(node, yaml.MappingNode):
+            while not loader.check_event(yaml.MappingEndEvent):
+                node.value.append((self._compose(), self._compose()))
+            node.end_mark = loader.get_event().end_mark
+
+        return node
+
+
+def _csv_reader(stream):
+    """csv.reader по байтовому потоку; разделитель определяется по строке заголовка"""
+    lines = codecs.iterdecode(stream, 'utf-8-sig')
+    header = next(lines, '')
+    delimiter = ';' if header.count(';') > header.count(',') else ','
+    return csv.reader(chain([header], lines), delimiter=delimiter)
+
+
+class CSVPriceList(PriceList):
+    """
+    Потоковое чтение плоского CSV прайс-листа.
+
+    Первая строка - заголовок. Колонки: id, category, name, price, price_rrc,
+    quantity, необязательные shop, category_name и model; остальные колонки
+    считаются параметрами товара. Разделитель - запятая или точка с запятой.
+    """
+
+    columns = ('shop', 'id', 'category', 'category_name', 'name', 'model', 'price', 'price_rrc', 'quantity')
+
+    def __init__(self, stream):
+        super().__init__()
+        reader = _csv_reader(stream)
+        self._fieldnames = [name.strip() for name in next(reader, [])]
+        missing = [field for field in REQUIRED_FIELDS if field not in self._fieldnames]
+        if missing:
+            raise PriceListError(f'В CSV нет обязательных колонок: {", ".join(missing)}')
+
+        self._rows = reader
+        first = next(reader, None)
+        if first is not None:
+            self.shop = dict(zip(self._fieldnames, first)).get('shop') or None
+            self._rows = chain([first], reader)
+        self._category_ids = set()
+        self.goods = self._iter_goods()
+
+    def _iter_goods(self):
+        for number, row in enumerate(self._rows, 1):
+            if not any(row):
+                continue
+            record = dict(zip(self._fieldnames, row))
+            good = {field: record[field] for field in self.columns[1:] if record.get(field, '') != ''}
+            good['parameters'] = {
+                name: value for name, value in record.items() if name not in self.columns and value != ''
+            }
+            category_name = good.pop('category_name', None)
+            good = validate_good(good, number)
+
+            if category_name and good['category'] not in self._category_ids:
+                self._category_ids.add(good['category'])
+                self.categories.append({'id': good['category'], 'name': category_name})
+            yield good
+
+
+class NDJSONPriceList(PriceList):
+    """
+    Потоковое чтение NDJSON прайс-листа: один JSON объект на строку.
+
+    Строки с полем id - товары в формате goods из YAML, остальные строки
+    задают shop и categories.
+    """
+
+    def __init__(self, stream):
+        super().__init__()
+        self._lines = enumerate(stream, 1)
+        self._first = self._read_header()
+        self.goods = self._iter_goods()
+
+    def _read_header(self):
+        """Читает строки до первого товара"""
+        for number, line in self._lines:
+            record = self._parse(number, line)
+            if record is None:
+                continue
+            if 'id' in record:
+                return record
+            self._apply_header(record)
+        return None
+
+    def _iter_goods(self):
+        if self._first is None:
+            return
+        number = 1
+        yield validate_good(self._first, number)
+        for line_number, line in self._lines:
+            record = self._parse(line_number, line)
+            if record is None:
+                continue
+            if 'id' in record:
+                number += 1
+                yield validate_good(record, number)
+            else:
+                self._apply_header(record)
+
+    def _apply_header(self, record):
+        if record.get('shop') and not self.shop:
+            self.shop = record['shop']
+        self.categories.extend(record.get('categories') or [])
+
+    def _parse(self, number, line):
+        line = line.strip()
+        if not line:
+            return None
+        try:
+            record = json.loads(line)
+        except ValueError as e:
+            raise PriceListError(f'Строка {number}: неверный JSON ({e})')
+        if not isinstance(record, dict):
+            raise PriceListError(f'Строка {number}: ожидался JSON объект')
+        return record
+
+
+# Поддерживаемые форматы прайс-листов
+PRICE_LIST_FORMATS = {
+    'yaml': YAMLPriceList,
+    'csv': CSVPriceList,
+    'ndjson': NDJSONPriceList,
+}
+
+CONTENT_TYPES = {
+    'application/x-yaml': 'yaml',
+    'application/yaml': 'yaml',
+    'text/yaml': 'yaml',
+    'text/x-yaml': 'yaml',
+    'text/csv': 'csv',
+    'application/csv': 'csv',
+    'application/x-ndjson': 'ndjson',
+    'application/ndjson': 'ndjson',
+    'application/jsonl': 'ndjson',
+    'application/x-jsonlines': 'ndjson',
+}
+
+EXTENSIONS = {
+    '.yaml': 'yaml',
+    '.yml': 'yaml',
+    '.csv': 'csv',
+    '.ndjson': 'ndjson',
+    '.jsonl': 'ndjson',
+}
+
+
+def detect_format(name='', content_type=''):
+    """Определяет формат по content type, затем по расширению файла; по умолчанию YAML"""
+    content_type = (content_type or '').split(';')[0].strip().lower()
+    if content_type in CONTENT_TYPES:
+        return CONTENT_TYPES[content_type]
+    return EXTENSIONS.get(os.path.splitext(name or '')[1].lower(), 'yaml')
+
+
+class PriceListSummary:
+    """
+    Итоги предварительного прохода по прайс-листу: магазин, число товаров
+    и общие для всех магазинов справочники - категории и названия параметров
+    """
+
+    def __init__(self):
+        # Магазин известен только после прохода: в файле он может быть записан после goods
+        self.shop = None
+        self.total = 0
+        # id категории -> название
+        self.categories = {}
+        self.parameters = set()
+
+    def add_good(self, good):
+        self.total += 1
+        self.parameters.update(good.get('parameters', {}))
+
+    def add_categories(self, categories):
+        for category in categories:
+            self.categories[int(category['id'])] = category['name']
+
+
+def summarize(price_list):
+    """Итоги по прайс-листу; goods прайс-листа при этом вычитывается до конца"""
+    summary = PriceListSummary()
+    for good in price_list.goods:
+        summary.add_good(good)
+    summary.add_categories(price_list.categories)
+    summary.shop = price_list.shop
+    return summary
+
+
+def scan_price_list(stream, price_list_format='yaml'):
+    """Предварительный проход по файлу прайс-листа без импорта"""
+    if price_list_format == 'yaml':
+        return scan_yaml(stream)
+    return summarize(PRICE_LIST_FORMATS[price_list_format](stream))
+
+
+def scan_yaml(stream):
+    """
+    Предварительный проход по YAML прайс-листу.
+
+    Идет только по событиям парсера, не создавая объектов товаров,
+    поэтому в несколько раз быстрее полного разбора.
+    """
+    loader = SafeLoader(stream)
+    summary = PriceListSummary()
+    # Открытые коллекции: [путь, это mapping, ожидается ключ, текущий ключ]
+    stack = []
+    category = {}
+    try:
+        while loader.check_event():
+            event = loader.get_event()
+            if isinstance(event, (yaml.MappingEndEvent, yaml.SequenceEndEvent)):
+                if stack.pop()[0] == ('categories', '*') and 'id' in category:
+                    summary.add_categories([category])
+                    category = {}
+                _value_done(stack)
+                continue
+            if not isinstance(event, (yaml.ScalarEvent, yaml.AliasEvent,
+                                      yaml.MappingStartEvent, yaml.SequenceStartEvent)):
+                continue
+
+            frame = stack[-1] if stack else None
+            if frame and frame[1] and frame[2]:
+                if not isinstance(event, yaml.ScalarEvent):
+                    raise PriceListError('Составные ключи в прайс-листе не поддерживаются')
+                # Ключ слияния << не параметр: его параметры уже записаны в якоре
+                # или будут созданы при импорте пачки
+                if frame[0] == ('goods', '*', 'parameters') and not _is_merge_key(loader, event):
+                    summary.parameters.add(event.value)
+                frame[2] = False
+                frame[3] = event.value
+                continue
+
+            path = frame[0] + ((frame[3] if frame[1] else '*'),) if frame else ()
+            if path == ('goods', '*'):
+                summary.total += 1
+
+            if isinstance(event, yaml.ScalarEvent):
+                if path in (('categories', '*', 'id'), ('categories', '*', 'name')):
+                    category[path[2]] = event.value
+                elif path == ('shop',):
+                    summary.shop = event.value
+                _value_done(stack)
+            elif isinstance(event, yaml.AliasEvent):
+                _value_done(stack)
+            else:
+                stack.append([path, isinstance(event, yaml.MappingStartEvent), True, None])
+    finally:
+        loader.dispose()
+    return summary
+
+
+def _is_merge_key(loader, event):
+    """Ключ слияния YAML: <<: *якорь"""
+    tag = event.tag
+    if tag is None or tag == '!':
+        tag = loader.resolve(yaml.ScalarNode, event.value, event.implicit)
+    return tag == 'tag:yaml.org,2002:merge'
+
+
+def _value_done(stack):
+    """После значения в mapping снова ожидается ключ"""
+    if stack and stack[-1][1]:
+        stack[-1][2] = True
@@ -0,0 +1,82 @@
+"""
+Полнотекстовый поиск по плоскому каталогу.
+
+Индексируется CatalogEntry.search_text: название товара, модель и значения
+параметров. Индекс обновляется вместе с плоским каталогом при импорте.
+PostgreSQL - GIN индекс по выражению search_vector() (миграция
+0014_catalog_search_orm), SQLite - таблица FTS5 на триггерах (миграция
+0010_catalog_search, модель CatalogSearchIndex). Перестройка таблицы
+procurement_catalogentry в SQLite удаляет триггеры - такая миграция должна
+создать их заново.
+"""
+import re
+
+from django.db import connection
+from django.db.models import F, FloatField, Lookup, OuterRef, Subquery, Value
+
+from .models import CatalogEntry, CatalogSearchIndex
+
+SEARCH_CONFIG = 'russian'
+
+WORD_RE = re.compile(r'\w+', re.UNICODE)
+
+
+class Match(Lookup):
+    """Полнотекстовый запрос FTS5: search_index__search_text__match='...'"""
+    lookup_name = 'match'
+
+    def as_sql(self, compiler, connection):
+        lhs, lhs_params = self.process_lhs(compiler, connection)
+        rhs, rhs_params = self.process_rhs(compiler, connection)
+        return f'{lhs} MATCH {rhs}', lhs_params + rhs_params
+
+
+CatalogSearchIndex._meta.get_field('search_text').register_lookup(Match)
+
+
+def search_vector():
+    """Выражение GIN индекса catalogentry_search_idx: запросы должны строиться с тем же выражением"""
+    from django.contrib.postgres.search import SearchVector
+    return SearchVector('search_text', config=SEARCH_CONFIG)
+
+
+def fts5_query(query):
+    """Запрос FTS5 из пользовательского текста: все слова, каждое как префикс"""
+    return ' '.join(f'"{word}"*' for word in WORD_RE.findall(query))
+
+
+def search_catalog(queryset, query):
+    """
+    Фильтрует queryset по поисковому запросу и добавляет rank (чем больше,
+    тем релевантнее). Подходит для CatalogEntry и ProductInfo: id строки
+    каталога совпадает с id предложения. Порядок задает вызывающий код.
+    """
+    if connection.vendor == 'postgresql':
+        return _search_postgresql(queryset, query)
+
+    if connection.vendor == 'sqlite':
+        match = fts5_query(query)
+        if not match:
+            return queryset.none().annotate(rank=Value(0.0, output_field=FloatField()))
+        # Таблица индекса присоединяется по id: СУБД идет от совпадений в индексе,
+        # а не выполняет полнотекстовый запрос для каждой строки
+        return queryset.filter(search_index__search_text__match=match).annotate(rank=-F('search_index__rank'))
+
+    # Прочие СУБД: поиск подстроки без ранжирования
+    matches = CatalogEntry.objects.filter(search_text__icontains=query).values('id')
+    return queryset.filter(id__in=matches).annotate(rank=Value(0.0, output_field=FloatField()))
+
+
+def _search_postgresql(queryset, query):
+    from django.contrib.postgres.search import SearchQuery, SearchRank
+
+    vector = search_vector()
+    search_query = SearchQuery(query, config=SEARCH_CONFIG, search_type='websearch')
+    rank = SearchRank(vector, search_query)
+    if queryset.model is CatalogEntry:
+        return queryset.alias(search=vector).filter(search=search_query).annotate(rank=rank)
+
+    # Предложения: совпадения по индексу плоского каталога, rank - из его строки с тем же id
+    entries = CatalogEntry.objects.alias(search=vector).filter(search=search_query)
+    return queryset.filter(id__in=entries.values('id')).annotate(
+        rank=Subquery(entries.filter(id=OuterRef('id')).annotate(rank=rank).values('rank')[:1]))
@@ -1,6 +1,67 @@
+import json
+from collections import defaultdict
+from itertools import islice
+
+from django.conf import settings
 from rest_framework import serializers
 from django.contrib.auth import authenticate
-from .models import User, Shop, Category, Product, ProductInfo, Parameter, ProductParameter, Contact, Order, OrderItem
+from .models import User, Shop, Category, Product, ProductInfo, Parameter, ProductParameter, Contact, Order, OrderItem, \
+    CatalogEntry
+from .fieldsets import Fieldset
+
+
+class FieldsetMixin:
+    """
+    Выборочные поля по context['fieldset'] (fieldsets.Fieldset): поля
+    верхнего уровня - по fields, вложенные объекты из expandable_fields -
+    по expand. Путь вложенного сериализатора берется из имен полей родителей.
+    """
+    # Раскрываемая связь -> атрибут с id для нераскрытой связи (None - поле не выводится)
+    expandable_fields = {}
+
+    def get_fields(self):
+        fields = super().get_fields()
+        fieldset = self.context.get('fieldset')
+        if fieldset is None:
+            return fields
+
+        path = self.fieldset_path()
+        for name in list(fields):
+            if not path and not fieldset.includes(name):
+                del fields[name]
+            elif name in self.expandable_fields and not fieldset.expands(f'{path}.{name}' if path else name):
+                source = self.expandable_fields[name]
+                if source:
+                    fields[name] = serializers.ReadOnlyField(source=source)
+                else:
+                    del fields[name]
+        return fields
+
+    def fieldset_path(self):
+        names = []
+        node = self
+        while node.parent is not None:
+            if node.field_name:
+                names.append(node.field_name)
+            node = node.parent
+        return '.'.join(reversed(names))
+
+    @classmethod
+    def list_fields(cls):
+        """Раскрываемые связи без id: без раскрытия они не выводятся"""
+        return [name for name, source in cls.expandable_fields.items() if source is None]
+
+    @classmethod
+    def expandable_paths(cls, prefix=''):
+        """Все пути для expand, включая вложенные сериализаторы"""
+        paths = []
+        for name in cls.expandable_fields:
+            paths.append(prefix + name)
+            field = cls._declared_fields[name]
+            child = getattr(field, 'child', field)
+            if isinstance(child, FieldsetMixin):
+                paths += child.expandable_paths(f'{prefix}{name}.')
+        return paths
 
 
 class UserRegistrationSerializer(serializers.ModelSerializer):
@@ -63,8 +124,9 @@ class CategorySerializer(serializers.ModelSerializer):
         fields = ['id', 'name']
 
 
-class ProductSerializer(serializers.ModelSerializer):
+class ProductSerializer(FieldsetMixin, serializers.ModelSerializer):
     category = CategorySerializer(read_only=True)
+    expandable_fields = {'category': 'category_id'}
 
     class Meta:
         model = Product
@@ -85,16 +147,134 @@ class ProductParameterSerializer(serializers.ModelSerializer):
         fields = ['id', 'parameter', 'value']
 
 
-class ProductInfoSerializer(serializers.ModelSerializer):
+class ProductInfoSerializer(FieldsetMixin, serializers.ModelSerializer):
     product = ProductSerializer(read_only=True)
     shop = ShopSerializer(read_only=True)
     parameters = ProductParameterSerializer(many=True, read_only=True)
+    expandable_fields = {'product': 'product_id', 'shop': 'shop_id', 'parameters': None}
 
     class Meta:
         model = ProductInfo
         fields = ['id', 'product', 'shop', 'external_id', 'model', 'price', 'price_rrc', 'quantity', 'parameters']
 
 
+# Поля ProductInfo, из которых serialize_product_infos строит полный ответ
+PRODUCT_INFO_VALUES = ('id', 'product_id', 'product__name', 'product__category_id', 'shop_id',
+                       'external_id', 'model', 'price', 'price_rrc', 'quantity')
+
+# Цены форматируются тем же полем DRF, что и в ProductInfoSerializer
+_price = serializers.DecimalField(max_digits=10, decimal_places=2).to_representation
+_total_price = serializers.DecimalField(max_digits=None, decimal_places=2).to_representation
+
+
+def product_info_values(fieldset):
+    """Поля values() для serialize_product_infos: без соединения с товаром, если он не раскрыт"""
+    if fieldset.expands('product'):
+        return PRODUCT_INFO_VALUES
+    return tuple(name for name in PRODUCT_INFO_VALUES if not name.startswith('product__'))
+
+
+def serialize_product_infos(rows, fieldset=None):
+    """
+    Быстрая сериализация страницы каталога: тот же JSON, что у
+    ProductInfoSerializer(many=True), из строк values(*product_info_values()).
+
+    Модели и поля DRF не создаются: магазины, категории и параметры
+    читаются по одному запросу на страницу в словари по id, и только
+    если связь раскрыта (fieldset). Параметры упорядочены по id, как в
+    prefetch с order_by('id').
+    """
+    fieldset = fieldset or Fieldset()
+    rows = list(rows)
+    if not rows:
+        return []
+
+    shops = None
+    if fieldset.expands('shop'):
+        shops = {
+            shop['id']: shop for shop in
+            Shop.objects.filter(id__in={row['shop_id'] for row in rows}).values('id', 'name', 'url', 'is_active')
+        }
+
+    expand_product = fieldset.expands('product')
+    categories = None
+    if fieldset.expands('product.category'):
+        categories = {
+            category['id']: category for category in
+            Category.objects.filter(id__in={row['product__category_id'] for row in rows}).values('id', 'name')
+        }
+
+    parameters = None
+    if fieldset.expands('parameters'):
+        parameter_names = {}
+        parameters = defaultdict(list)
+        for product_info_id, product_parameter_id, parameter_id, name, value in (
+                ProductParameter.objects.filter(product_info_id__in=[row['id'] for row in rows]).order_by('id')
+                .values_list('product_info_id', 'id', 'parameter_id', 'parameter__name', 'value')):
+            parameter = parameter_names.setdefault(parameter_id, {'id': parameter_id, 'name': name})
+            parameters[product_info_id].append({'id': product_parameter_id, 'parameter': parameter, 'value': value})
+
+    items = []
+    for row in rows:
+        item = {
+            'id': row['id'],
+            'product': row['product_id'],
+            'shop': shops[row['shop_id']] if shops is not None else row['shop_id'],
+            'external_id': row['external_id'],
+            'model': row['model'],
+            'price': _price(row['price']),
+            'price_rrc': _price(row['price_rrc']),
+            'quantity': row['quantity'],
+        }
+        if expand_product:
+            category_id = row['product__category_id']
+            item['product'] = {
+                'id': row['product_id'],
+                'name': row['product__name'],
+                'category': categories[category_id] if categories is not None else category_id,
+            }
+        if parameters is not None:
+            item['parameters'] = parameters[row['id']]
+        if fieldset.fields is not None:
+            item = {name: value for name, value in item.items() if name in fieldset.fields}
+        items.append(item)
+    return items
+
+
+def iter_product_infos_ndjson(queryset, fieldset=None, chunk_size=None):
+    """
+    Строки NDJSON выгрузки каталога в формате serialize_product_infos.
+    Предложения читаются курсором (iterator) и сериализуются пачками по
+    chunk_size, поэтому память не зависит от размера каталога.
+    """
+    fieldset = fieldset or Fieldset()
+    chunk_size = chunk_size or settings.EXPORT_CHUNK_SIZE
+    rows = queryset.values(*product_info_values(fieldset)).iterator(chunk_size=chunk_size)
+    while True:
+        chunk = list(islice(rows, chunk_size))
+        if not chunk:
+            return
+        yield ''.join(json.dumps(item, ensure_ascii=False, separators=(',', ':')) + '\n'
+                      for item in serialize_product_infos(chunk, fieldset)).encode('utf-8')
+
+
+class CatalogEntrySerializer(FieldsetMixin, serializers.ModelSerializer):
+    """Плоская строка каталога"""
+
+    class Meta:
+        model = CatalogEntry
+        fields = ['id', 'product_id', 'product_name', 'category_id', 'category_name', 'shop_id', 'shop_name',
+                  'shop_url', 'external_id', 'model', 'price', 'price_rrc', 'quantity', 'parameters']
+
+
+class StockItemSerializer(serializers.Serializer):
+    """Остаток и цены товара для быстрого обновления поставщиком"""
+    external_id = serializers.IntegerField(min_value=0)
+    quantity = serializers.IntegerField(min_value=0)
+    price = serializers.DecimalField(max_digits=10, decimal_places=2, min_value=0, required=False)
+    price_rrc = serializers.DecimalField(max_digits=10, decimal_places=2, min_value=0, required=False)
+
+
 class ContactSerializer(serializers.ModelSerializer):
     class Meta:
         model = Contact
@@ -102,8 +282,9 @@ class ContactSerializer(serializers.ModelSerializer):
         read_only_fields = ['id']
 
 
-class OrderItemSerializer(serializers.ModelSerializer):
+class OrderItemSerializer(FieldsetMixin, serializers.ModelSerializer):
     product_info = ProductInfoSerializer(read_only=True)
+    expandable_fields = {'product_info': 'product_info_id'}
 
     class Meta:
         model = OrderItem
@@ -111,9 +292,26 @@ class OrderItemSerializer(serializers.ModelSerializer):
         read_only_fields = ['id']
 
 
-class OrderSerializer(serializers.ModelSerializer):
+class BasketItemSerializer(OrderItemSerializer):
+    """Позиция корзины со стоимостью, посчитанной в SQL (аннотация line_total)"""
+    total_price = serializers.DecimalField(source='line_total', max_digits=None, decimal_places=2, read_only=True)
+
+    class Meta(OrderItemSerializer.Meta):
+        fields = OrderItemSerializer.Meta.fields + ['total_price']
+
+
+def serialize_basket_totals(totals):
+    """Итоги корзины из агрегата: число товаров и стоимость (пустая корзина - нули)"""
+    return {
+        'total_quantity': totals['total_quantity'] or 0,
+        'total_price': _total_price(totals['total_price'] or 0),
+    }
+
+
+class OrderSerializer(FieldsetMixin, serializers.ModelSerializer):
     items = OrderItemSerializer(many=True, read_only=True)
     contact = ContactSerializer(read_only=True)
+    expandable_fields = {'items': None, 'contact': 'contact_id'}
 
     class Meta:
         model = Order
@@ -0,0 +1,158 @@
+"""
+Сброс кэша и обновление плоского каталога при изменении данных каталога,
+отметка времени изменения заказов для ETag корзины и списка заказов.
+
+Изменение товаров в обход импорта также сбрасывает хеши последнего импорта
+магазинов: повторная загрузка того же прайса должна снова записать его в БД.
+
+Массовые операции импорта сигналов не вызывают и обновляют каталог сами.
+На удаление ProductInfo обработчиков нет намеренно: они отключили бы
+быстрое удаление товаров при импорте. Предложения, удаленные каскадом
+с товаром или категорией, убираются из каталога обработчиками pre_delete.
+"""
+import weakref
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from django.db import transaction
+from django.db.models import Q, QuerySet
+from django.db.models.signals import post_delete, post_save, pre_delete
+from django.dispatch import receiver
+from django.utils import timezone
+
+from .cache import invalidate_shops
+from .catalog import refresh_catalog, refresh_catalog_ids, refresh_facets
+from .importers import reset_import_digests
+from .models import Shop, Category, Product, ProductInfo, CatalogEntry, ParameterFacet, Order, OrderItem, Contact
+
+# Поля магазина, которые попадают в плоский каталог
+SHOP_CATALOG_FIELDS = {'name', 'url', 'is_active'}
+
+# Внутри order_items_bulk сигналы OrderItem не обновляют время изменения заказа
+_order_items_bulk = ContextVar('order_items_bulk', default=False)
+
+
+@contextmanager
+def order_items_bulk():
+    """
+    Массовое изменение позиций заказа: вызывающий код сам обновляет
+    время изменения заказа один раз, а не на каждую позицию
+    """
+    token = _order_items_bulk.set(True)
+    try:
+        yield
+    finally:
+        _order_items_bulk.reset(token)
+
+
+@receiver(post_save, sender=Shop)
+def shop_saved(sender, instance, update_fields=None, **kwargs):
+    """Смена is_active и данных магазина, в том числе сохранение магазина в конце импорта"""
+    invalidate_shops([instance.id])
+    if update_fields is None or SHOP_CATALOG_FIELDS & set(update_fields):
+        refresh_catalog(Q(shop_id=instance.id))
+        refresh_facets([instance.id])
+
+
+@receiver(pre_delete, sender=Shop)
+def shop_deleted(sender, instance, **kwargs):
+    invalidate_shops([instance.id])
+
+
+@receiver(post_delete, sender=Shop)
+def shop_catalog_deleted(sender, instance, **kwargs):
+    CatalogEntry.objects.filter(shop_id=instance.id).delete()
+    ParameterFacet.objects.filter(shop_id=instance.id).delete()
+
+
+def offers_changed(shop_ids):
+    """Предложения магазинов изменены в обход импорта: кэш сбрасывается после фиксации транзакции"""
+    shop_ids = set(shop_ids)
+    invalidate_shops(shop_ids)
+    reset_import_digests(shop_ids)
+
+
+@receiver(post_save, sender=ProductInfo)
+def product_info_saved(sender, instance, **kwargs):
+    """
+    Одиночные изменения предложения: админка, резервирование при подтверждении заказа.
+    Фасеты здесь не пересчитываются - их обновит следующий импорт или обновление остатков.
+    """
+    refresh_catalog_ids([instance.id])
+    offers_changed([instance.shop_id])
+
+
+# Удаления, предложения которых уже собраны, по id(origin): каскад категории удаляет
+# товары по одному, и pre_delete каждого товара приходит с тем же origin
+_deleted_origins = weakref.WeakValueDictionary()
+
+# Связь ProductInfo с удаляемой моделью
+OFFER_LOOKUPS = {Product: 'product', Category: 'product__category'}
+
+
+@receiver(pre_delete, sender=Category)
+@receiver(pre_delete, sender=Product)
+def offers_deleted(sender, instance, origin=None, **kwargs):
+    """
+    Предложения удаляются каскадом с товаром или категорией. У плоского каталога
+    нет внешнего ключа на ProductInfo, поэтому его строки и фасеты магазинов
+    пересобираются после фиксации удаления
+    """
+    origin_model = origin.model if isinstance(origin, QuerySet) else type(origin)
+    if origin_model in OFFER_LOOKUPS:
+        # Предложения всего удаления собираются одним запросом при первом сигнале
+        if _deleted_origins.get(id(origin)) is origin:
+            return
+        _deleted_origins[id(origin)] = origin
+        lookup = OFFER_LOOKUPS[origin_model]
+        offers = ProductInfo.objects.filter(
+            **({f'{lookup}__in': origin} if isinstance(origin, QuerySet) else {lookup: origin}))
+    else:
+        offers = ProductInfo.objects.filter(**{OFFER_LOOKUPS[sender]: instance})
+
+    rows = list(offers.values_list('id', 'shop_id'))
+    if not rows:
+        return
+    product_info_ids = [product_info_id for product_info_id, _ in rows]
+    shop_ids = {shop_id for _, shop_id in rows}
+    # Категории магазинов для сброса кэша определяются до удаления
+    offers_changed(shop_ids)
+
+    def refresh():
+        with transaction.atomic():
+            refresh_catalog_ids(product_info_ids)
+            refresh_facets(shop_ids)
+    transaction.on_commit(refresh)
+
+
+@receiver(post_save, sender=Category)
+def category_saved(sender, instance, created=False, **kwargs):
+    if not created:
+        CatalogEntry.objects.filter(category_id=instance.id).update(category_name=instance.name)
+        offers_changed(ProductInfo.objects.filter(product__category_id=instance.id)
+                       .values_list('shop_id', flat=True).distinct())
+
+
+@receiver(post_save, sender=Product)
+def product_saved(sender, instance, created=False, **kwargs):
+    if not created:
+        # Название товара входит в текст поиска - строки пересобираются целиком
+        refresh_catalog_ids(CatalogEntry.objects.filter(product_id=instance.id).values_list('id', flat=True))
+        offers_changed(ProductInfo.objects.filter(product_id=instance.id)
+                       .values_list('shop_id', flat=True).distinct())
+
+
+@receiver(post_save, sender=OrderItem)
+@receiver(post_delete, sender=OrderItem)
+def order_item_changed(sender, instance, **kwargs):
+    """Позиции корзины и заказа меняются без сохранения самого заказа"""
+    if _order_items_bulk.get():
+        return
+    Order.objects.filter(id=instance.order_id).update(updated_at=timezone.now())
+
+
+@receiver(post_save, sender=Contact)
+@receiver(pre_delete, sender=Contact)
+def contact_changed(sender, instance, **kwargs):
+    """Адрес доставки входит в ответ списка заказов"""
+    Order.objects.filter(contact_id=instance.id).update(updated_at=timezone.now())
@@ -0,0 +1,103 @@
+"""
+Генерация синтетических прайс-листов для нагрузочных замеров импорта
+"""
+import csv
+import json
+import random
+
+# Значения параметров: небольшой набор, как в реальных каталогах
+PARAMETER_VALUES = ('черный', 'белый', 'синий', '64', '128', '256', '6.1', '6.7', 'да', 'нет')
+
+
+def generate_goods(goods=1000, categories=10, parameters=5, parameter_pool=50, seed=0, first_id=1):
+    """
+    Генератор товаров в формате goods прайс-листа.
+
+    parameters - число параметров у каждого товара, parameter_pool - сколько
+    всего разных названий параметров в прайс-листе. При одинаковом seed
+    генерируется одинаковый каталог.
+    """
+    rnd = random.Random(seed)
+    parameters = min(parameters, parameter_pool)
+    names = [f'Параметр {number}' for number in range(1, parameter_pool + 1)]
+    for external_id in range(first_id, first_id + goods):
+        price = rnd.randint(100, 200000)
+        yield {
+            'id': external_id,
+            'category': rnd.randint(1, categories),
+            'model': f'model/{external_id}',
+            'name': f'Товар {external_id}',
+            'price': price,
+            'price_rrc': price + price // 10,
+            'quantity': rnd.randint(0, 100),
+            'parameters': {name: rnd.choice(PARAMETER_VALUES) for name in rnd.sample(names, parameters)},
+        }
+
+
+def generate_categories(categories=10):
+    return [{'id': number, 'name': f'Категория {number}'} for number in range(1, categories + 1)]
+
+
+def write_price_list(stream, price_list_format='yaml', shop='Синтетический магазин',
+                     goods=1000, categories=10, parameters=5, parameter_pool=50, seed=0):
+    """
+    Пишет прайс-лист в текстовый поток построчно, не собирая его в памяти.
+    Возвращает число записанных товаров.
+    """
+    writer = PRICE_LIST_WRITERS[price_list_format]
+    return writer(stream, shop, generate_categories(categories),
+                  generate_goods(goods, categories, parameters, parameter_pool, seed),
+                  parameter_pool)
+
+
+def _yaml_scalar(value):
+    """Строка JSON - допустимый скаляр YAML в двойных кавычках"""
+    return json.dumps(value, ensure_ascii=False) if isinstance(value, str) else str(value)
+
+
+def _write_yaml(stream, shop, categories, goods, parameter_pool):
+    stream.write(f'shop: {_yaml_scalar(shop)}\ncategories:\n')
+    for category in categories:
+        stream.write(f'  - id: {category["id"]}\n    name: {_yaml_scalar(category["name"])}\n')
+    stream.write('goods:\n')
+    count = 0
+    for good in goods:
+        stream.write(f'  - id: {good["id"]}\n')
+        for field in ('category', 'model', 'name', 'price', 'price_rrc', 'quantity'):
+            stream.write(f'    {field}: {_yaml_scalar(good[field])}\n')
+        stream.write('    parameters:\n')
+        for name, value in good['parameters'].items():
+            stream.write(f'      {_yaml_scalar(name)}: {_yaml_scalar(value)}\n')
+        count += 1
+    return count
+
+
+def _write_csv(stream, shop, categories, goods, parameter_pool):
+    category_names = {category['id']: category['name'] for category in categories}
+    parameter_names = [f'Параметр {number}' for number in range(1, parameter_pool + 1)]
+    writer = csv.writer(stream, delimiter=';')
+    writer.writerow(['shop', 'id', 'category', 'category_name', 'name', 'model', 'price', 'price_rrc',
+                     'quantity'] + parameter_names)
+    count = 0
+    for good in goods:
+        writer.writerow([shop, good['id'], good['category'], category_names[good['category']], good['name'],
+                         good['model'], good['price'], good['price_rrc'], good['quantity']]
+                        + [good['parameters'].get(name, '') for name in parameter_names])
+        count += 1
+    return count
+
+
+def _write_ndjson(stream, shop, categories, goods, parameter_pool):
+    stream.write(json.dumps({'shop': shop, 'categories': categories}, ensure_ascii=False) + '\n')
+    count = 0
+    for good in goods:
+        stream.write(json.dumps(good, ensure_ascii=False) + '\n')
+        count += 1
+    return count
+
+
+PRICE_LIST_WRITERS = {
+    'yaml': _write_yaml,
+    'csv': _write_csv,
+    'ndjson': _write_ndjson,
+}
@@ -1,6 +1,13 @@
+import yaml
 from celery import shared_task
 from django.core.mail import send_mail
 from django.conf import settings
+from django.utils import timezone
+
+from .baskets import flush_baskets
+from .importers import check_not_modified, import_price_list
+from .models import ImportJob
+from .price_lists import PRICE_LIST_FORMATS, PriceListError, file_digest, scan_price_list
 
 
 @shared_task
@@ -59,4 +66,67 @@ def send_order_email_async(order_id, user_email):
     Спасибо за покупку!
     """
 
-    return send_email_async.delay(subject, message, [user_email])
\ No newline at end of file
+    return send_email_async.delay(subject, message, [user_email])
+
+
+@shared_task(bind=True)
+def import_price_list_async(self, job_id):
+    """
+    Асинхронный импорт прайс-листа поставщика.
+
+    Ход импорта публикуется через состояние задачи PROGRESS: сам импорт
+    идет в одной транзакции, и запись прогресса в БД не видна до ее окончания.
+    """
+    job = ImportJob.objects.select_related('user').get(id=job_id)
+    print(f"📦 Celery: Импорт прайс-листа (задание #{job_id})")
+
+    job.state = 'running'
+    job.started_at = timezone.now()
+    job.save(update_fields=['state', 'started_at'])
+
+    def progress(processed):
+        job.processed = processed
+        if not self.request.is_eager:
+            self.update_state(state='PROGRESS', meta={'processed': processed, 'total': job.total})
+
+    try:
+        with job.file.open('rb') as stream:
+            digest = file_digest(stream)
+            # Тот же файл уже импортирован - разбирать его не нужно
+            result = check_not_modified(job.user, digest)
+            if result is None:
+                summary = scan_price_list(stream, job.format)
+                job.total = summary.total
+                job.save(update_fields=['total'])
+
+                stream.seek(0)
+                price_list = PRICE_LIST_FORMATS[job.format](stream)
+                result = import_price_list(price_list, job.user, job.mode, progress=progress,
+                                           digest=digest, summary=summary)
+    except yaml.YAMLError as e:
+        result = {'Status': False, 'Error': f'Ошибка парсинга YAML: {str(e)}'}
+    except PriceListError as e:
+        result = {'Status': False, 'Error': f'Ошибка в прайс-листе: {str(e)}'}
+    except Exception as e:
+        result = {'Status': False, 'Error': f'Ошибка импорта: {str(e)}'}
+    finally:
+        # Файл нужен только на время импорта, повторно задание не запускается
+        job.file.delete(save=False)
+
+    job.result = result
+    job.state = 'done' if result['Status'] else 'failed'
+    if not result['Status']:
+        job.errors.append(result['Error'])
+    job.finished_at = timezone.now()
+    job.save(update_fields=['result', 'state', 'errors', 'processed', 'finished_at', 'file'])
+
+    print(f"✅ Импорт #{job_id} завершен: {result}")
+    return result
+
+
+@shared_task
+def flush_baskets_async():
+    """
+    Периодическая выгрузка корзин из Redis в Order и OrderItem (CELERY_BEAT_SCHEDULE)
+    """
+    return flush_baskets()
@@ -1,3 +1,1529 @@
-from django.test import TestCase
+import gzip
+import io
+import json
+import os
+import tempfile
+from concurrent.futures import ThreadPoolExecutor
+from decimal import Decimal
+from unittest import mock, skipIf, skipUnless
 
-# Create your tests here.
+import yaml
+
+try:
+    # Тестовая зависимость из requirements-dev.txt
+    import fakeredis
+except ImportError:
+    fakeredis = None
+
+from django.core.cache import cache
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import call_command
+from django.db import IntegrityError, connection, connections, transaction
+from django.db.models import Prefetch, Q
+from django.test import SimpleTestCase, TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from rest_framework.authtoken.models import Token
+from rest_framework.renderers import JSONRenderer
+from rest_framework.request import Request
+from rest_framework.test import APIRequestFactory
+
+from .models import User, Shop, Category, Product, ProductInfo, Parameter, ProductParameter, Order, CatalogEntry, \
+    Contact, ImportJob, OrderItem, ParameterFacet
+from .baskets import DIRTY_KEY, DatabaseBasket, RedisBasket, flush_baskets, get_basket, parse_batch
+from .cache import catalog_page_key
+from .catalog import refresh_catalog, refresh_facets
+from .importers import import_price_list, reset_import_digests, update_stock
+from .price_lists import PRICE_LIST_FORMATS, CSVPriceList, NDJSONPriceList, PriceListError, YAMLPriceList, \
+    detect_format, scan_price_list, scan_yaml, summarize, validate_good
+from .fieldsets import Fieldset
+from .search import search_catalog
+from .tasks import import_price_list_async
+from .serializers import PRODUCT_INFO_VALUES, ProductInfoSerializer, product_info_values, serialize_product_infos
+
+
+class QueryPlanTests(TestCase):
+    """Горячие запросы каталога и заказов используют индексы"""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user(email='buyer@example.com', password='password')
+        cls.shop = Shop.objects.create(name='Магазин')
+        cls.category = Category.objects.create(name='Категория')
+        for number in range(50):
+            product = Product.objects.create(name=f'Товар {number}', category=cls.category)
+            ProductInfo.objects.create(product=product, shop=cls.shop, external_id=number,
+                                       price=100, price_rrc=120, quantity=number % 3)
+        Order.objects.create(user=cls.user, status='basket')
+        Order.objects.create(user=cls.user, status='new')
+
+    def assertUsesIndex(self, queryset, *index_names):
+        with connection.cursor() as cursor:
+            if connection.vendor == 'postgresql':
+                # На маленьких тестовых таблицах PostgreSQL предпочтет полный просмотр
+                cursor.execute('SET LOCAL enable_seqscan = off')
+        plan = queryset.explain()
+        self.assertTrue(any(name in plan for name in index_names), plan)
+
+    def test_catalog_by_shop(self):
+        queryset = ProductInfo.objects.filter(shop__is_active=True, quantity__gt=0, shop_id=self.shop.id)
+        self.assertUsesIndex(queryset.order_by('id')[:40], 'productinfo_shop_in_stock_idx')
+
+    def test_catalog_by_category(self):
+        queryset = ProductInfo.objects.filter(shop__is_active=True, quantity__gt=0,
+                                              product__category_id=self.category.id)
+        self.assertUsesIndex(queryset.order_by('id')[:40], 'productinfo_prod_in_stock_idx')
+
+    def test_basket_lookup(self):
+        # get() и get_or_create() сбрасывают сортировку заказов по умолчанию
+        queryset = Order.objects.filter(user=self.user, status='basket').order_by()
+        self.assertUsesIndex(queryset, 'order_user_status_idx', 'unique_basket_per_user')
+
+    def test_order_history(self):
+        queryset = Order.objects.filter(user=self.user).exclude(status='basket')
+        self.assertUsesIndex(queryset, 'order_user_created_idx', 'order_user_status_idx')
+
+    def test_one_basket_per_user(self):
+        with self.assertRaises(IntegrityError), transaction.atomic():
+            Order.objects.create(user=self.user, status='basket')
+
+    def test_catalog_sorted_by_price_in_category(self):
+        queryset = CatalogEntry.objects.filter(category_id=self.category.id, price__gte=50)
+        self.assertUsesIndex(queryset.order_by('price', 'id')[:40], 'catalogentry_cat_price_idx')
+
+    def test_catalog_sorted_by_price_in_shop(self):
+        queryset = ProductInfo.objects.filter(shop__is_active=True, quantity__gt=0, shop_id=self.shop.id)
+        self.assertUsesIndex(queryset.order_by('-price', '-id')[:40], 'productinfo_shop_price_idx')
+
+
+class CatalogSerializationTests(TestCase):
+    """Быстрая сериализация каталога дает тот же JSON, что и ProductInfoSerializer"""
+
+    @classmethod
+    def setUpTestData(cls):
+        shop = Shop.objects.create(name='Магазин', url='https://shop.example.com')
+        other_shop = Shop.objects.create(name='Другой магазин')
+        category = Category.objects.create(name='Категория')
+        color = Parameter.objects.create(name='Цвет')
+        size = Parameter.objects.create(name='Размер')
+        for number in range(10):
+            product = Product.objects.create(name=f'Товар {number}', category=category)
+            product_info = ProductInfo.objects.create(
+                product=product, shop=other_shop if number % 2 else shop, external_id=number,
+                model=f'model-{number}' if number % 3 else '', price=Decimal('10.5') * number,
+                price_rrc=100, quantity=number + 1)
+            ProductParameter.objects.create(product_info=product_info, parameter=size, value=str(number))
+            if number % 4:
+                ProductParameter.objects.create(product_info=product_info, parameter=color, value='черный')
+
+    def test_same_json_as_serializer(self):
+        queryset = ProductInfo.objects.order_by('id')
+        expected = JSONRenderer().render(ProductInfoSerializer(queryset.prefetch_related(
+            Prefetch('parameters', queryset=ProductParameter.objects.order_by('id'))), many=True).data)
+        self.assertEqual(JSONRenderer().render(serialize_product_infos(queryset.values(*PRODUCT_INFO_VALUES))),
+                         expected)
+
+    def test_fieldset_skips_related_queries(self):
+        fieldset = Fieldset(fields={'id', 'product', 'price'}, expand={'product'})
+        with self.assertNumQueries(1):
+            items = serialize_product_infos(ProductInfo.objects.order_by('id').values(*product_info_values(fieldset)),
+                                            fieldset)
+        product = ProductInfo.objects.select_related('product').order_by('id').first().product
+        self.assertEqual(items[0], {'id': items[0]['id'], 'price': '0.00',
+                                    'product': {'id': product.id, 'name': product.name, 'category': product.category_id}})
+
+    def test_empty_page(self):
+        self.assertEqual(serialize_product_infos(ProductInfo.objects.none().values(*PRODUCT_INFO_VALUES)), [])
+
+
+class FieldsetAPITests(TestCase):
+    """fields= и expand= в корзине и списке заказов"""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user(email='buyer@example.com', password='password')
+        product = Product.objects.create(name='Товар', category=Category.objects.create(name='Категория'))
+        cls.product_info = ProductInfo.objects.create(product=product, shop=Shop.objects.create(name='Магазин'),
+                                                      external_id=1, price=100, price_rrc=120, quantity=5)
+        ProductParameter.objects.create(product_info=cls.product_info, parameter=Parameter.objects.create(name='Цвет'),
+                                        value='черный')
+        contact = Contact.objects.create(user=cls.user, city='Москва', street='Тверская', phone='+70000000000')
+        cls.order = Order.objects.create(user=cls.user, status='new', contact=contact)
+        OrderItem.objects.create(order=cls.order, product_info=cls.product_info, quantity=2)
+        basket = Order.objects.create(user=cls.user, status='basket')
+        OrderItem.objects.create(order=basket, product_info=cls.product_info, quantity=3)
+        cls.token = Token.objects.create(user=cls.user)
+
+    def setUp(self):
+        self.client.defaults['HTTP_AUTHORIZATION'] = f'Token {self.token.key}'
+
+    def get(self, url, status_code=200, **params):
+        with CaptureQueriesContext(connection) as context:
+            response = self.client.get(url, params)
+        self.assertEqual(response.status_code, status_code, response.data)
+        return response.data, ' '.join(query['sql'] for query in context.captured_queries)
+
+    def test_errors(self):
+        for url, params, message in (
+                ('/api/v1/basket/', {'fields': 'id,price'}, "Неизвестные поля: ['price']"),
+                ('/api/v1/basket/', {'expand': 'product_info.owner'}, "Неизвестные поля: ['product_info.owner']"),
+                ('/api/v1/orders/', {'fields': 'id,total'}, "Неизвестные поля: ['total']"),
+                ('/api/v1/orders/', {'expand': 'items.product'}, "Неизвестные поля: ['items.product']"),
+                # Список без раскрытия не выводится - явный запрос его в fields не теряется молча
+                ('/api/v1/orders/', {'fields': 'id,items', 'expand': 'contact'}, 'items выводится только с expand=items'),
+                ('/api/v1/orders/', {'fields': 'id,items', 'expand': ''}, 'items выводится только с expand=items'),
+                ('/api/v1/products/', {'fields': 'id,parameters', 'expand': 'shop'},
+                 'parameters выводится только с expand=parameters')):
+            with self.subTest(url=url, params=params):
+                self.assertIn(message, self.get(url, 400, **params)[0]['Error'])
+
+    def test_orders(self):
+        data, sql = self.get('/api/v1/orders/', fields='id,items', expand='items.product_info')
+        item = data['results'][0]['items'][0]
+        self.assertEqual(data['results'][0].keys(), {'id', 'items'})
+        # Вложенные связи предложения не раскрыты: товар и магазин - id, параметров нет
+        self.assertEqual(item['product_info'], {
+            'id': self.product_info.id, 'product': self.product_info.product_id, 'shop': self.product_info.shop_id,
+            'external_id': 1, 'model': '', 'price': '100.00', 'price_rrc': '120.00', 'quantity': 5})
+        self.assertNotIn('"procurement_contact"', sql)
+        self.assertNotIn('"procurement_productparameter"', sql)
+        self.assertNotIn('"procurement_shop"', sql)
+
+        data, sql = self.get('/api/v1/orders/', fields='id,status,contact', expand='contact')
+        self.assertEqual(data['results'][0]['contact']['city'], 'Москва')
+        self.assertNotIn('"procurement_orderitem"', sql)
+
+    def test_basket(self):
+        data, sql = self.get('/api/v1/basket/', fields='product_info,quantity', expand='product_info.product.category')
+        self.assertEqual(data['results'][0]['product_info']['product'], {
+            'id': self.product_info.product_id, 'name': 'Товар',
+            'category': {'id': self.product_info.product.category_id, 'name': 'Категория'}})
+        self.assertEqual(data['results'][0]['product_info']['shop'], self.product_info.shop_id)
+        self.assertNotIn('"procurement_shop"', sql)
+        self.assertNotIn('"procurement_productparameter"', sql)
+
+        data, sql = self.get('/api/v1/basket/', fields='id,product_info,quantity', expand='')
+        self.assertEqual(data['results'][0]['product_info'], self.product_info.id)
+        self.assertNotIn('"procurement_product"', sql)
+        self.assertNotIn('"procurement_category"', sql)
+
+
+@override_settings(CACHE_SHARED=True)
+class ConditionalGetTests(TestCase):
+    """ETag меняется вместе с данными, If-None-Match отдает 304 без основных запросов"""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user(email='buyer@example.com', password='password')
+        shop = Shop.objects.create(name='Магазин')
+        product = Product.objects.create(name='Товар', category=Category.objects.create(name='Категория'))
+        cls.product_info = ProductInfo.objects.create(product=product, shop=shop, external_id=1,
+                                                      price=100, price_rrc=120, quantity=5)
+        cls.token = Token.objects.create(user=cls.user)
+
+    def setUp(self):
+        self.client.defaults['HTTP_AUTHORIZATION'] = f'Token {self.token.key}'
+
+    def assertNotModified(self, url, etag, queries):
+        with self.assertNumQueries(queries):
+            response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response['ETag'], etag)
+
+    def test_catalog(self):
+        etag = self.client.get('/api/v1/products/')['ETag']
+        # Только проверка токена: версии каталога читаются из кэша
+        self.assertNotModified('/api/v1/products/', etag, 1)
+
+        # Версии каталога увеличиваются после фиксации транзакции
+        with self.captureOnCommitCallbacks(execute=True):
+            update_stock(self.product_info.shop, [{'external_id': 1, 'quantity': 4}])
+        self.assertEqual(self.client.get('/api/v1/products/', HTTP_IF_NONE_MATCH=etag).status_code, 200)
+
+    def test_basket(self):
+        Order.objects.create(user=self.user, status='basket')
+        etag = self.client.get('/api/v1/basket/')['ETag']
+        # Токен, корзина и магазины ее товаров
+        self.assertNotModified('/api/v1/basket/', etag, 3)
+
+        self.client.post('/api/v1/basket/add/', {'product_info_id': self.product_info.id, 'quantity': 1},
+                         content_type='application/json')
+        self.assertEqual(self.client.get('/api/v1/basket/', HTTP_IF_NONE_MATCH=etag).status_code, 200)
+
+    def test_orders(self):
+        contact = Contact.objects.create(user=self.user, city='Москва', street='Тверская', phone='+70000000000')
+        order = Order.objects.create(user=self.user, status='new', contact=contact)
+        OrderItem.objects.create(order=order, product_info=self.product_info, quantity=1)
+        etag = self.client.get('/api/v1/orders/')['ETag']
+        # Токен, маркер заказов и магазины их товаров
+        self.assertNotModified('/api/v1/orders/', etag, 3)
+
+        # Корзина и заказы других пользователей в маркер не входят
+        Order.objects.create(user=self.user, status='basket')
+        other = User.objects.create_user(email='other@example.com', password='password')
+        Order.objects.create(user=other, status='new')
+        self.assertNotModified('/api/v1/orders/', etag, 3)
+
+        def changed(change):
+            nonlocal etag
+            with self.captureOnCommitCallbacks(execute=True):
+                change()
+            response = self.client.get('/api/v1/orders/', HTTP_IF_NONE_MATCH=etag)
+            self.assertEqual(response.status_code, 200)
+            etag = response['ETag']
+
+        # Статус заказа, адрес доставки, позиции и цены товаров в ответе
+        changed(lambda: Order.objects.get(id=order.id).save())
+        changed(contact.save)
+        changed(lambda: update_stock(self.product_info.shop, [{'external_id': 1, 'quantity': 5, 'price': 90}]))
+        changed(lambda: OrderItem.objects.get(order=order).delete())
+        changed(lambda: Order.objects.create(user=self.user, status='new'))
+
+    @override_settings(CACHE_SHARED=False)
+    def test_disabled_without_shared_cache(self):
+        # Версии в памяти процесса не увидят импорт в Celery - 304 мог бы отдать устаревшие данные
+        for url in ('/api/v1/products/', '/api/v1/basket/', '/api/v1/orders/'):
+            with self.subTest(url=url):
+                response = self.client.get(url, HTTP_IF_NONE_MATCH='*')
+                self.assertEqual(response.status_code, 200)
+                self.assertNotIn('ETag', response)
+
+
+class BasketBackendTests(TestCase):
+    """Корзина в БД и выбор хранилища"""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user(email='buyer@example.com', password='password')
+        product = Product.objects.create(name='Товар', category=Category.objects.create(name='Категория'))
+        cls.product_info = ProductInfo.objects.create(product=product, shop=Shop.objects.create(name='Магазин'),
+                                                      external_id=1, price=100, price_rrc=120, quantity=5)
+        cls.token = Token.objects.create(user=cls.user)
+
+    def setUp(self):
+        self.client.defaults['HTTP_AUTHORIZATION'] = f'Token {self.token.key}'
+
+    @override_settings(BASKET_BACKEND='redis', BASKET_REDIS_URL='')
+    def test_redis_without_url_uses_db(self):
+        self.assertIsInstance(get_basket(self.user), DatabaseBasket)
+
+    def test_database_basket(self):
+        basket = get_basket(self.user)
+        self.assertIsNone(basket.materialize())
+
+        basket.add(self.product_info, 1)
+        basket.add(self.product_info, 2)
+        self.assertEqual(basket.items(), {self.product_info.id: 3})
+        self.assertEqual(basket.materialize().items.get().quantity, 3)
+
+        self.assertTrue(basket.remove(self.product_info.id))
+        self.assertFalse(basket.remove(self.product_info.id))
+        self.assertEqual(basket.items(), {})
+
+    def test_batch(self):
+        other = ProductInfo.objects.create(product=self.product_info.product, shop=self.product_info.shop,
+                                           external_id=2, price=50, price_rrc=60, quantity=5)
+
+        def batch(items):
+            response = self.client.post('/api/v1/basket/batch/', {'items': items}, content_type='application/json')
+            return response.status_code, {item['product_info']['id']: item['quantity']
+                                          for item in response.json().get('Items', [])}
+
+        self.assertEqual(batch([{'product_info_id': self.product_info.id, 'quantity': 2},
+                                {'product_info_id': self.product_info.id, 'quantity': '3'},
+                                {'product_info_id': other.id, 'quantity': 1, 'op': 'set'}]),
+                         (200, {self.product_info.id: 5, other.id: 1}))
+        # Неизвестный товар - пакет не применяется целиком
+        self.assertEqual(batch([{'product_info_id': other.id, 'op': 'remove'},
+                                {'product_info_id': other.id + 100, 'quantity': 1}])[0], 400)
+        self.assertEqual(batch([{'product_info_id': other.id, 'op': 'remove'},
+                                {'product_info_id': self.product_info.id, 'quantity': 1, 'op': 'set'}]),
+                         (200, {self.product_info.id: 1}))
+
+    def test_batch_ids(self):
+        for value in (True, 1.5, '1.5', '0', -3, None, [1]):
+            with self.subTest(value=value):
+                self.assertEqual(parse_batch([{'product_info_id': value}]),
+                                 (None, 'Строка 1: неверный product_info_id'))
+        self.assertEqual(parse_batch([{'product_info_id': ' 7 ', 'op': 'remove'}, {'product_info_id': 8}]),
+                         ({7: ('remove', 0), 8: ('add', 1)}, None))
+
+    def test_batch_single_delete(self):
+        basket = get_basket(self.user)
+        ids = [self.product_info.id]
+        for external_id in range(2, 5):
+            ids.append(ProductInfo.objects.create(product=self.product_info.product, shop=self.product_info.shop,
+                                                  external_id=external_id, price=10, price_rrc=12, quantity=5).id)
+        basket.apply({product_info_id: ('add', 1) for product_info_id in ids})
+        updated_at = Order.objects.get(user=self.user).updated_at
+
+        with CaptureQueriesContext(connection) as context:
+            basket.apply({ids[0]: ('set', 3), **{product_info_id: ('remove', 0) for product_info_id in ids[1:]}})
+        statements = [query['sql'].split()[0] for query in context.captured_queries]
+        self.assertEqual((statements.count('DELETE'), statements.count('UPDATE')), (1, 1))
+        self.assertEqual(basket.items(), {ids[0]: 3})
+        self.assertGreater(Order.objects.get(user=self.user).updated_at, updated_at)
+
+    def test_view_is_read_only_with_fixed_queries(self):
+        response = self.client.get('/api/v1/basket/')
+        self.assertEqual((response.data['count'], response.data['total_quantity'], response.data['total_price']),
+                         (0, 0, '0.00'))
+        self.assertFalse(Order.objects.exists())
+
+        parameter = Parameter.objects.create(name='Цвет')
+        basket = get_basket(self.user)
+        queries = []
+        for external_id in range(2, 5):
+            product_info = ProductInfo.objects.create(product=self.product_info.product, shop=self.product_info.shop,
+                                                      external_id=external_id, price='10.50', price_rrc=12, quantity=5)
+            ProductParameter.objects.create(product_info=product_info, parameter=parameter, value='Красный')
+            basket.add(product_info, 2)
+            with CaptureQueriesContext(connection) as context:
+                response = self.client.get('/api/v1/basket/')
+            queries.append(len(context))
+
+        self.assertEqual(len(set(queries)), 1, queries)
+        self.assertEqual([item['total_price'] for item in response.data['results']], ['21.00'] * 3)
+        self.assertEqual((response.data['total_quantity'], response.data['total_price']), (6, '63.00'))
+
+
+@skipIf(connection.vendor == 'sqlite', 'Тестовая БД SQLite в памяти не ждет блокировок, а сразу отвечает ошибкой')
+class ConcurrentBasketAddTests(TransactionTestCase):
+    """Параллельные добавления в корзину не теряют количество"""
+
+    def test_parallel_adds(self):
+        user = User.objects.create_user(email='buyer@example.com', password='password')
+        token = Token.objects.create(user=user)
+        product = Product.objects.create(name='Товар', category=Category.objects.create(name='Категория'))
+        product_info = ProductInfo.objects.create(product=product, shop=Shop.objects.create(name='Магазин'),
+                                                  external_id=1, price=100, price_rrc=120, quantity=5)
+
+        def add(quantity):
+            try:
+                # Данные формы: количество приходит строкой
+                return self.client_class().post('/api/v1/basket/add/', {'product_info_id': product_info.id,
+                                                                         'quantity': str(quantity)},
+                                                HTTP_AUTHORIZATION=f'Token {token.key}').status_code
+            finally:
+                connections.close_all()
+
+        with ThreadPoolExecutor(max_workers=8) as executor:
+            statuses = list(executor.map(add, [1, 2, 3] * 8))
+
+        self.assertEqual(statuses, [200] * 24)
+        self.assertEqual(Order.objects.get(user=user, status='basket').items.get().quantity, 48)
+
+
+@skipIf(connection.vendor == 'sqlite', 'Тестовая БД SQLite в памяти не ждет блокировок, а сразу отвечает ошибкой')
+class ConcurrentOrderConfirmTests(TransactionTestCase):
+    """Параллельные подтверждения заказов не продают остаток дважды и не уводят фасеты в минус"""
+
+    def test_parallel_confirms(self):
+        shop = Shop.objects.create(name='Магазин')
+        product = Product.objects.create(name='Товар', category=Category.objects.create(name='Категория'))
+        product_info = ProductInfo.objects.create(product=product, shop=shop, external_id=1,
+                                                  price=100, price_rrc=120, quantity=3)
+        ProductParameter.objects.create(product_info=product_info, parameter=Parameter.objects.create(name='Цвет'),
+                                        value='черный')
+        refresh_facets([shop.id])
+
+        buyers = []
+        for number in range(4):
+            user = User.objects.create_user(email=f'buyer{number}@example.com', password='password')
+            contact = Contact.objects.create(user=user, city='Москва', street='Тверская', phone='+70000000000')
+            DatabaseBasket(user).add(product_info, 3)
+            buyers.append((Token.objects.create(user=user).key, contact.id))
+
+        def confirm(buyer):
+            token, contact_id = buyer
+            try:
+                return self.client_class().post('/api/v1/order/confirm/', {'contact_id': contact_id},
+                                                HTTP_AUTHORIZATION=f'Token {token}').status_code
+            finally:
+                connections.close_all()
+
+        with mock.patch('procurement.views.send_order_confirmation_email'), \
+                mock.patch('procurement.views.send_order_to_admin_email'), \
+                ThreadPoolExecutor(max_workers=4) as executor:
+            statuses = sorted(executor.map(confirm, buyers))
+
+        # Весь остаток уходит одному заказу, остальные видят заблокированный остаток 0
+        self.assertEqual(statuses, [200, 400, 400, 400])
+        self.assertEqual(ProductInfo.objects.get(id=product_info.id).quantity, 0)
+        self.assertFalse(ParameterFacet.objects.exists())
+
+
+class CatalogExportTests(TestCase):
+    """Выгрузка каталога: NDJSON пачками курсора, сжатие gzip по Accept-Encoding"""
+
+    @classmethod
+    def setUpTestData(cls):
+        shop = Shop.objects.create(name='Магазин')
+        category = Category.objects.create(name='Категория')
+        for number in range(7):
+            product = Product.objects.create(name=f'Товар {number}', category=category)
+            ProductInfo.objects.create(product=product, shop=shop, external_id=number,
+                                       price=100, price_rrc=120, quantity=number % 4)
+
+    def export(self, **headers):
+        with self.settings(EXPORT_CHUNK_SIZE=2):
+            response = self.client.get('/api/v1/products/export/', {'fields': 'id,quantity'}, **headers)
+        self.assertEqual(response.status_code, 200)
+        return response, b''.join(response.streaming_content)
+
+    def test_ndjson(self):
+        response, content = self.export()
+        self.assertEqual(response['Content-Type'], 'application/x-ndjson; charset=utf-8')
+        rows = [json.loads(line) for line in content.decode('utf-8').splitlines()]
+        expected = ProductInfo.objects.filter(quantity__gt=0).order_by('id')
+        self.assertEqual(rows, [{'id': item.id, 'quantity': item.quantity} for item in expected])
+
+    def test_gzip(self):
+        response, content = self.export(HTTP_ACCEPT_ENCODING='gzip, deflate')
+        self.assertEqual(response['Content-Encoding'], 'gzip')
+        self.assertEqual(len(gzip.decompress(content).splitlines()), 5)
+
+
+class CountModeTests(TestCase):
+    """Режимы count: без COUNT(*) соседние страницы определяются по лишней строке"""
+
+    @classmethod
+    def setUpTestData(cls):
+        shop = Shop.objects.create(name='Магазин')
+        category = Category.objects.create(name='Категория')
+        for number in range(45):
+            product = Product.objects.create(name=f'Товар {number}', category=category)
+            ProductInfo.objects.create(product=product, shop=shop, external_id=number,
+                                       price=100, price_rrc=120, quantity=1)
+
+    def get_page(self, **params):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get('/api/v1/products/', {'source': 'flat', **params})
+        counts = [query['sql'] for query in queries.captured_queries if 'COUNT(' in query['sql']]
+        return response, counts
+
+    def test_without_count(self):
+        response, counts = self.get_page(count='none')
+        self.assertEqual(counts, [])
+        self.assertIsNone(response.data['count'])
+        self.assertIsNotNone(response.data['next'])
+
+        response, counts = self.get_page(count='none', page=2)
+        self.assertEqual(len(response.data['results']), 5)
+        self.assertIsNone(response.data['next'])
+        self.assertEqual(self.get_page(count='none', page=3)[0].status_code, 404)
+
+    def test_cached_count(self):
+        response, counts = self.get_page(count='cached')
+        self.assertEqual((response.data['count'], response.data['count_mode'], len(counts)), (45, 'cached', 1))
+        # Другая страница того же списка: count из кэша
+        response, counts = self.get_page(count='cached', page=2)
+        self.assertEqual((response.data['count'], len(counts)), (45, 0))
+
+    def test_unknown_mode(self):
+        self.assertEqual(self.get_page(count='approximate')[0].status_code, 400)
+
+
+class SearchTests(TestCase):
+    """Полнотекстовый поиск: совпадения по названию, модели и параметрам, порядок по релевантности"""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.shop = Shop.objects.create(name='Магазин')
+        category = Category.objects.create(name='Смартфоны')
+        compatible = Parameter.objects.create(name='Совместимость')
+        offers = [
+            ('Смартфон Samsung Galaxy', 'galaxy-s23', 300, None),
+            ('Смартфон Apple iPhone', 'iphone-15', 500, None),
+            ('Чехол', 'case-1', 10, 'Apple iPhone 15, iPhone 15 Pro и другие модели смартфонов Apple'),
+        ]
+        cls.ids = {}
+        for number, (name, model, price, compatibility) in enumerate(offers):
+            product = Product.objects.create(name=name, category=category)
+            product_info = ProductInfo.objects.create(product=product, shop=cls.shop, external_id=number,
+                                                      model=model, price=price, price_rrc=price, quantity=1)
+            if compatibility:
+                ProductParameter.objects.create(product_info=product_info, parameter=compatible,
+                                                value=compatibility)
+            cls.ids[model] = product_info.id
+        # Параметры входят в текст поиска: каталог пересобирается после их создания
+        refresh_catalog(Q(shop_id=cls.shop.id))
+
+    def search_ids(self, query, **params):
+        response = self.client.get('/api/v1/products/', {'q': query, **params})
+        self.assertEqual(response.status_code, 200)
+        return [item['id'] for item in response.data['results']]
+
+    def test_matches(self):
+        self.assertEqual(set(self.search_ids('iphone')), {self.ids['iphone-15'], self.ids['case-1']})
+        self.assertEqual(self.search_ids('samsung galaxy'), [self.ids['galaxy-s23']])
+        self.assertEqual(self.search_ids('nokia'), [])
+
+    def test_rank(self):
+        # Короткое название с запросом выше длинного описания чехла
+        expected = [self.ids['iphone-15'], self.ids['case-1']]
+        self.assertEqual(self.search_ids('apple iphone'), expected)
+        self.assertEqual(self.search_ids('apple iphone', source='flat'), expected)
+
+        ranks = list(search_catalog(ProductInfo.objects.all(), 'apple iphone')
+                     .order_by('-rank', 'id').values_list('rank', flat=True))
+        self.assertEqual(len(ranks), 2)
+        self.assertGreater(ranks[0], ranks[1])
+
+    def test_explicit_ordering(self):
+        self.assertEqual(self.search_ids('apple iphone', ordering='price'),
+                         [self.ids['case-1'], self.ids['iphone-15']])
+
+    @skipUnless(connection.vendor == 'sqlite', 'префиксный поиск FTS5')
+    def test_prefix_and_empty_query(self):
+        self.assertEqual(set(self.search_ids('смартф')), set(self.ids.values()))
+        self.assertEqual(self.search_ids('!!!'), [])
+
+
+# Небольшой прайс-лист для тестов импорта: товары 1 и 3 в наличии, 2 - нет
+PRICE_LIST_GOODS = [
+    {'id': 1, 'category': 1, 'name': 'Смартфон', 'model': 'phone-1', 'price': 500, 'price_rrc': 550,
+     'quantity': 3, 'parameters': {'Цвет': 'черный', 'Память': 128}},
+    {'id': 2, 'category': 1, 'name': 'Смартфон', 'model': 'phone-2', 'price': 700, 'price_rrc': 750,
+     'quantity': 0, 'parameters': {'Цвет': 'белый'}},
+    {'id': 3, 'category': 2, 'name': 'Чехол', 'model': 'case-1', 'price': 10, 'price_rrc': 15,
+     'quantity': 20, 'parameters': {'Цвет': 'черный'}},
+]
+
+
+def price_list_yaml(goods=PRICE_LIST_GOODS, shop='Магазин'):
+    """YAML прайс-лист в формате выгрузки поставщика"""
+    return yaml.safe_dump({
+        'shop': shop,
+        'categories': [{'id': 1, 'name': 'Смартфоны'}, {'id': 2, 'name': 'Аксессуары'}],
+        'goods': goods,
+    }, allow_unicode=True, sort_keys=False).encode('utf-8')
+
+
+class PriceListUploadMixin:
+    """Загрузка прайс-листа через API поставщика"""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user(email='shop@example.com', password='password', type='shop')
+        cls.token = Token.objects.create(user=cls.user)
+
+    def setUp(self):
+        self.client.defaults['HTTP_AUTHORIZATION'] = f'Token {self.token.key}'
+
+    def upload(self, content, name='price.yaml', status_code=200, **data):
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client.post('/api/v1/partner/update/',
+                                        {'file': SimpleUploadedFile(name, content), **data})
+        self.assertEqual(response.status_code, status_code, response.data)
+        return response.data
+
+    def offers(self):
+        """external_id -> (цена, остаток, {параметр: значение}) товаров магазина"""
+        offers = {}
+        for product_info in ProductInfo.objects.prefetch_related('parameters__parameter'):
+            offers[product_info.external_id] = (product_info.price, product_info.quantity, {
+                product_parameter.parameter.name: product_parameter.value
+                for product_parameter in product_info.parameters.all()
+            })
+        return offers
+
+
+@override_settings(IMPORT_BATCH_SIZE=2)
+class BulkImportTests(PriceListUploadMixin, TestCase):
+    """Полный импорт пачками: новые строки через bulk_create, старые товары магазина удаляются"""
+
+    def test_insert(self):
+        result = self.upload(price_list_yaml())
+        self.assertTrue(result['Status'])
+        self.assertEqual([result[key] for key in ('Inserted', 'Updated', 'Unchanged', 'Removed')], [3, 0, 0, 0])
+
+        shop = Shop.objects.get(user=self.user)
+        self.assertEqual(shop.name, 'Магазин')
+        self.assertEqual(set(shop.categories.values_list('name', flat=True)), {'Смартфоны', 'Аксессуары'})
+        # Два предложения одного товара: товары ищутся по (название, категория)
+        self.assertEqual(Product.objects.count(), 2)
+        self.assertEqual(self.offers(), {
+            1: (Decimal('500.00'), 3, {'Цвет': 'черный', 'Память': '128'}),
+            2: (Decimal('700.00'), 0, {'Цвет': 'белый'}),
+            3: (Decimal('10.00'), 20, {'Цвет': 'черный'}),
+        })
+
+    def test_reimport_replaces_goods(self):
+        self.upload(price_list_yaml())
+        old_ids = set(ProductInfo.objects.values_list('id', flat=True))
+
+        goods = [dict(PRICE_LIST_GOODS[0], price=450), dict(PRICE_LIST_GOODS[2], id=4)]
+        result = self.upload(price_list_yaml(goods))
+        self.assertEqual([result[key] for key in ('Inserted', 'Updated', 'Unchanged', 'Removed')], [2, 0, 0, 3])
+        self.assertEqual(set(self.offers()), {1, 4})
+        self.assertEqual(self.offers()[1][0], Decimal('450.00'))
+        # Полный импорт пересоздает строки
+        self.assertFalse(old_ids & set(ProductInfo.objects.values_list('id', flat=True)))
+
+    def test_shop_after_goods(self):
+        def content(shop, goods=PRICE_LIST_GOODS):
+            # safe_dump по умолчанию сортирует ключи: goods записывается раньше shop
+            data = yaml.safe_load(price_list_yaml(goods, shop))
+            return yaml.safe_dump(data, allow_unicode=True).encode('utf-8')
+
+        self.assertTrue(content('Магазин').startswith(b'categories:'))
+        result = self.upload(content('Магазин'))
+        self.assertTrue(result['Status'], result)
+        self.assertEqual(Shop.objects.get(user=self.user).name, 'Магазин')
+
+        # Магазин из файла не подменяется существующим магазином поставщика
+        other = User.objects.create_user(email='other@example.com', password='password', type='shop')
+        Shop.objects.create(name='Чужой', user=other)
+        result = self.upload(content('Чужой', PRICE_LIST_GOODS[:1]))
+        self.assertFalse(result['Status'])
+        self.assertIn('нет прав', result['Error'])
+        self.assertEqual(set(self.offers()), {1, 2, 3})
+
+    def test_invalid_good_is_rolled_back(self):
+        self.upload(price_list_yaml())
+        goods = PRICE_LIST_GOODS + [{'id': 5, 'category': 1, 'name': 'Без цены', 'quantity': 1}]
+        result = self.upload(price_list_yaml(goods), status_code=400)
+        self.assertIn('Товар #4', result['Error'])
+        self.assertEqual(set(self.offers()), {1, 2, 3})
+
+
+# Категории после goods, параметры через якорь
+YAML_CATEGORIES_AFTER_GOODS = """\
+goods:
+  - id: 1
+    category: 1
+    name: Смартфон
+    price: 500
+    price_rrc: 550
+    quantity: 3
+    parameters: &phone
+      Цвет: черный
+      Память: 128
+  - {id: 2, category: 1, name: Смартфон, price: 700.5, price_rrc: 750, quantity: '0', parameters: *phone}
+shop: Магазин
+categories:
+  - id: 1
+    name: Смартфоны
+""".encode('utf-8')
+
+
+class YAMLPriceListTests(SimpleTestCase):
+    """Потоковый разбор YAML: товары по одному, поля после goods - по окончании товаров"""
+
+    def test_fields_after_goods(self):
+        price_list = YAMLPriceList(io.BytesIO(YAML_CATEGORIES_AFTER_GOODS))
+        self.assertIsNone(price_list.shop)
+        goods = list(price_list.goods)
+        self.assertEqual(price_list.shop, 'Магазин')
+        self.assertEqual(price_list.categories, [{'id': 1, 'name': 'Смартфоны'}])
+
+        self.assertEqual([good['id'] for good in goods], [1, 2])
+        # quantity приводится к int, якорь раскрывается в каждом товаре
+        self.assertEqual(goods[1]['quantity'], 0)
+        self.assertEqual(goods[1]['parameters'], {'Цвет': 'черный', 'Память': 128})
+
+    def test_scan_matches_full_parse(self):
+        summary = scan_yaml(io.BytesIO(YAML_CATEGORIES_AFTER_GOODS))
+        expected = summarize(YAMLPriceList(io.BytesIO(YAML_CATEGORIES_AFTER_GOODS)))
+        self.assertEqual((summary.shop, summary.total, summary.categories, summary.parameters),
+                         (expected.shop, expected.total, expected.categories, expected.parameters))
+        self.assertEqual((summary.shop, summary.total, summary.parameters), ('Магазин', 2, {'Цвет', 'Память'}))
+
+    def test_scan_skips_merge_key(self):
+        content = YAML_CATEGORIES_AFTER_GOODS.replace(
+            b'parameters: *phone}', 'parameters: {<<: *phone, Вес: 150}}'.encode('utf-8'))
+        summary = scan_yaml(io.BytesIO(content))
+        self.assertEqual(summary.parameters, {'Цвет', 'Память', 'Вес'})
+        goods = list(YAMLPriceList(io.BytesIO(content)).goods)
+        self.assertEqual(goods[1]['parameters'], {'Цвет': 'черный', 'Память': 128, 'Вес': 150})
+
+    @mock.patch('procurement.price_lists.MAX_YAML_ANCHORS', 10)
+    def test_anchors_bounded(self):
+        # Якорь на каждом товаре и общий блок параметров, на который ссылаются все товары
+        lines = ['shop: Магазин', 'goods:']
+        for number in range(1, 201):
+            lines.append(f'  - &good{number} {{id: {number}, category: 1, name: Товар, price: 1, price_rrc: 1, '
+                         f'quantity: 1, parameters: {"&common {Цвет: черный}" if number == 1 else "*common"}}}')
+        price_list = YAMLPriceList(io.BytesIO('\n'.join(lines).encode('utf-8')))
+        goods = list(price_list.goods)
+        self.assertEqual(len(goods), 200)
+        self.assertEqual(goods[-1]['parameters'], {'Цвет': 'черный'})
+        # Хранятся только последние использованные якоря, общий блок среди них
+        self.assertEqual(len(price_list._anchors), 10)
+        self.assertIn('common', price_list._anchors)
+
+        lines.append('  - *good1')
+        price_list = YAMLPriceList(io.BytesIO('\n'.join(lines).encode('utf-8')))
+        with self.assertRaisesMessage(yaml.YAMLError, 'Неизвестный якорь: good1'):
+            list(price_list.goods)
+
+    def test_goods_must_be_list(self):
+        price_list = YAMLPriceList(io.BytesIO('shop: Магазин\ngoods: {id: 1}\n'.encode('utf-8')))
+        with self.assertRaises(yaml.YAMLError):
+            list(price_list.goods)
+
+    def test_invalid_good(self):
+        price_list = YAMLPriceList(io.BytesIO(b'goods:\n  - {id: 1, category: 1, name: x, price: 1}\n'))
+        with self.assertRaisesMessage(PriceListError, 'price_rrc, quantity'):
+            list(price_list.goods)
+
+
+@override_settings(IMPORT_BATCH_SIZE=2)
+class DeltaImportTests(PriceListUploadMixin, TestCase):
+    """Дифференциальный импорт: в БД пишутся только отличия, неизмененные строки сохраняют id"""
+
+    def counts(self, result):
+        return [result[key] for key in ('Inserted', 'Updated', 'Unchanged', 'Removed')]
+
+    def test_counts(self):
+        self.assertEqual(self.counts(self.upload(price_list_yaml(), mode='delta')), [3, 0, 0, 0])
+        ids = dict(ProductInfo.objects.values_list('external_id', 'id'))
+
+        goods = [PRICE_LIST_GOODS[0], dict(PRICE_LIST_GOODS[1], price=650, quantity=2),
+                 {'id': 4, 'category': 2, 'name': 'Кабель', 'price': 5, 'price_rrc': 7, 'quantity': 100}]
+        self.assertEqual(self.counts(self.upload(price_list_yaml(goods), mode='delta')), [1, 1, 1, 1])
+
+        offers = self.offers()
+        self.assertEqual(set(offers), {1, 2, 4})
+        self.assertEqual(offers[2], (Decimal('650.00'), 2, {'Цвет': 'белый'}))
+        current = dict(ProductInfo.objects.values_list('external_id', 'id'))
+        self.assertEqual((current[1], current[2]), (ids[1], ids[2]))
+
+    def test_parameter_changes(self):
+        self.upload(price_list_yaml(), mode='delta')
+        goods = [dict(PRICE_LIST_GOODS[0], parameters={'Цвет': 'синий', 'Вес': 180})] + PRICE_LIST_GOODS[1:]
+        self.assertEqual(self.counts(self.upload(price_list_yaml(goods), mode='delta')), [0, 1, 2, 0])
+        self.assertEqual(self.offers()[1][2], {'Цвет': 'синий', 'Вес': '180'})
+
+    def test_price_rounded_as_stored(self):
+        goods = [dict(PRICE_LIST_GOODS[0], price=499.999)] + PRICE_LIST_GOODS[1:]
+        self.upload(price_list_yaml(goods), mode='delta')
+        self.assertEqual(self.offers()[1][0], Decimal('500.00'))
+
+        # Первая пачка изменилась из-за товара 2, товар 1 сравнивается с сохраненной ценой 500.00
+        goods[1] = dict(goods[1], quantity=5)
+        self.assertEqual(self.counts(self.upload(price_list_yaml(goods), mode='delta')), [0, 1, 2, 0])
+
+
+class AsyncImportTests(PriceListUploadMixin, TestCase):
+    """Фоновый импорт: файл задания удаляется после обработки, недоступная очередь - 503"""
+
+    def setUp(self):
+        super().setUp()
+        media_root = tempfile.TemporaryDirectory()
+        self.addCleanup(media_root.cleanup)
+        self.media_root = media_root.name
+        media_settings = self.settings(MEDIA_ROOT=self.media_root)
+        media_settings.enable()
+        self.addCleanup(media_settings.disable)
+
+    def stored_files(self):
+        return [name for _, _, names in os.walk(self.media_root) for name in names]
+
+    def upload_async(self, content, status_code=202, delay=None):
+        # Задача выполняется сразу, как при CELERY_TASK_ALWAYS_EAGER
+        delay = delay or (lambda job_id: import_price_list_async.apply(args=(job_id,)))
+        with mock.patch.object(import_price_list_async, 'delay', side_effect=delay):
+            result = self.upload(content, status_code=status_code, **{'async': 'true'})
+        return result, ImportJob.objects.get(id=result['JobId'])
+
+    def test_file_deleted_after_import(self):
+        result, job = self.upload_async(price_list_yaml())
+        self.assertEqual((job.state, job.result['Inserted'], job.processed), ('done', 3, 3))
+        self.assertFalse(job.file)
+        self.assertEqual(self.stored_files(), [])
+
+    def test_file_deleted_after_failed_import(self):
+        result, job = self.upload_async(b'goods: [')
+        self.assertEqual(job.state, 'failed')
+        self.assertIn('Ошибка парсинга YAML', job.errors[0])
+        self.assertEqual(self.stored_files(), [])
+
+    def test_not_modified_before_parsing(self):
+        self.upload(price_list_yaml())
+        with mock.patch('procurement.tasks.scan_price_list') as scan:
+            result, job = self.upload_async(price_list_yaml())
+        scan.assert_not_called()
+        self.assertEqual((job.state, job.result['NotModified'], job.total), ('done', True, None))
+        self.assertEqual(self.stored_files(), [])
+
+    def test_queue_unavailable(self):
+        def delay(job_id):
+            raise ConnectionRefusedError('Connection refused')
+
+        result, job = self.upload_async(price_list_yaml(), status_code=503, delay=delay)
+        self.assertFalse(result['Status'])
+        self.assertEqual(job.state, 'failed')
+        self.assertIn('Connection refused', job.errors[0])
+        self.assertIsNotNone(job.finished_at)
+        self.assertEqual(self.stored_files(), [])
+        self.assertFalse(ProductInfo.objects.exists())
+
+
+@override_settings(IMPORT_BATCH_SIZE=2)
+class ImportDigestTests(PriceListUploadMixin, TestCase):
+    """Хеши файла и пачек товаров: неизменившийся прайс и пачки не записываются в БД"""
+
+    def test_same_file_not_modified(self):
+        for mode in ('full', 'delta'):
+            self.upload(price_list_yaml(), mode=mode)
+            ids = set(ProductInfo.objects.values_list('id', flat=True))
+            result = self.upload(price_list_yaml(), mode=mode)
+            self.assertTrue(result['NotModified'])
+            self.assertEqual(set(ProductInfo.objects.values_list('id', flat=True)), ids)
+            # Другой файл того же магазина импортируется снова
+            self.assertNotIn('NotModified', self.upload(price_list_yaml()[:-1] + b' \n', mode=mode))
+
+    def test_not_modified_before_parsing(self):
+        self.upload(price_list_yaml())
+        with mock.patch('procurement.views.scan_price_list') as scan, \
+                mock.patch('procurement.importers.upsert_dictionaries') as upsert:
+            self.assertTrue(self.upload(price_list_yaml())['NotModified'])
+        scan.assert_not_called()
+        upsert.assert_not_called()
+
+    def test_unchanged_chunk_skipped(self):
+        self.upload(price_list_yaml(), mode='delta')
+        # Изменение в обход импорта без сброса хешей: первая пачка не перечитывается
+        ProductInfo.objects.filter(external_id=1).update(quantity=99)
+
+        goods = PRICE_LIST_GOODS[:2] + [dict(PRICE_LIST_GOODS[2], quantity=19)]
+        result = self.upload(price_list_yaml(goods), mode='delta')
+        self.assertEqual([result[key] for key in ('Updated', 'Unchanged')], [1, 2])
+        self.assertEqual(self.offers()[1][1], 99)
+        self.assertEqual(self.offers()[3][1], 19)
+
+    def test_unchanged_chunk_skipped_in_full_mode(self):
+        self.upload(price_list_yaml())
+        ids = dict(ProductInfo.objects.values_list('external_id', 'id'))
+        ProductInfo.objects.filter(external_id=1).update(quantity=99)
+
+        # Вторая пачка изменилась и пересоздается, первая не перечитывается
+        goods = PRICE_LIST_GOODS[:2] + [dict(PRICE_LIST_GOODS[2], quantity=19)]
+        result = self.upload(price_list_yaml(goods))
+        self.assertEqual([result[key] for key in ('Inserted', 'Updated', 'Unchanged', 'Removed')], [1, 0, 2, 1])
+        new_ids = dict(ProductInfo.objects.values_list('external_id', 'id'))
+        self.assertEqual((new_ids[1], new_ids[2]), (ids[1], ids[2]))
+        self.assertNotEqual(new_ids[3], ids[3])
+        self.assertEqual((self.offers()[1][1], self.offers()[3][1]), (99, 19))
+        self.assertEqual(set(CatalogEntry.objects.values_list('id', flat=True)), {new_ids[1], new_ids[3]})
+
+        # Товара нет в новом прайсе - он удаляется
+        result = self.upload(price_list_yaml(goods[:2]))
+        self.assertEqual([result[key] for key in ('Inserted', 'Unchanged', 'Removed')], [0, 2, 1])
+        self.assertEqual(set(self.offers()), {1, 2})
+
+        # Без хешей пачек полный импорт пересоздает все строки
+        reset_import_digests([Shop.objects.get(user=self.user).id])
+        result = self.upload(price_list_yaml(goods[:2]))
+        self.assertEqual([result[key] for key in ('Inserted', 'Unchanged', 'Removed')], [2, 0, 2])
+        self.assertFalse(set(ids.values()) & set(ProductInfo.objects.values_list('id', flat=True)))
+
+    def test_reset_import_digests(self):
+        self.upload(price_list_yaml(), mode='delta')
+        ProductInfo.objects.filter(external_id=1).update(quantity=99)
+        shop = Shop.objects.get(user=self.user)
+        reset_import_digests([shop.id])
+        shop.refresh_from_db()
+        self.assertEqual((shop.import_digest, shop.import_chunk_digests), ('', {}))
+
+        # Тот же файл сравнивается с БД заново и исправляет строку
+        result = self.upload(price_list_yaml(), mode='delta')
+        self.assertNotIn('NotModified', result)
+        self.assertEqual([result[key] for key in ('Updated', 'Unchanged')], [1, 2])
+        self.assertEqual(self.offers()[1][1], 3)
+
+
+# Разделитель ';', BOM, колонки после обязательных - параметры товара
+PRICE_LIST_CSV = (
+    '\ufeffshop;id;category;category_name;name;model;price;price_rrc;quantity;Цвет;Память\n'
+    'Магазин;1;1;Смартфоны;Смартфон;phone-1;500;550;3;черный;128\n'
+    ';2;1;Смартфоны;Смартфон;phone-2;700;750;0;белый;\n'
+    '\n'
+    ';3;2;Аксессуары;Чехол;case-1;10;15;20;черный;\n'
+).encode('utf-8')
+
+PRICE_LIST_NDJSON = '\n'.join(json.dumps(record, ensure_ascii=False) for record in [
+    {'shop': 'Магазин', 'categories': [{'id': 1, 'name': 'Смартфоны'}]},
+    *PRICE_LIST_GOODS[:2],
+    {'categories': [{'id': 2, 'name': 'Аксессуары'}]},
+    PRICE_LIST_GOODS[2],
+]).encode('utf-8')
+
+
+class PriceListFormatTests(SimpleTestCase):
+    """Плоские форматы прайс-листа, определение формата и проверка товаров"""
+
+    def test_csv(self):
+        price_list = CSVPriceList(io.BytesIO(PRICE_LIST_CSV))
+        self.assertEqual(price_list.shop, 'Магазин')
+        goods = list(price_list.goods)
+        self.assertEqual([good['id'] for good in goods], [1, 2, 3])
+        self.assertEqual(goods[0]['parameters'], {'Цвет': 'черный', 'Память': '128'})
+        # Пустые ячейки параметров пропускаются
+        self.assertEqual(goods[1]['parameters'], {'Цвет': 'белый'})
+        self.assertEqual(goods[1]['quantity'], 0)
+        self.assertEqual(price_list.categories, [{'id': 1, 'name': 'Смартфоны'}, {'id': 2, 'name': 'Аксессуары'}])
+
+    def test_csv_comma_delimiter(self):
+        content = b'id,category,name,price,price_rrc,quantity\n7,1,Phone,1.5,2,4\n'
+        price_list = CSVPriceList(io.BytesIO(content))
+        self.assertIsNone(price_list.shop)
+        self.assertEqual(list(price_list.goods), [
+            {'id': 7, 'category': 1, 'name': 'Phone', 'price': '1.5', 'price_rrc': '2', 'quantity': 4,
+             'parameters': {}}])
+
+    def test_csv_missing_columns(self):
+        with self.assertRaisesMessage(PriceListError, 'price_rrc, quantity'):
+            CSVPriceList(io.BytesIO(b'id;category;name;price\n'))
+
+    def test_ndjson(self):
+        price_list = NDJSONPriceList(io.BytesIO(PRICE_LIST_NDJSON))
+        self.assertEqual(price_list.shop, 'Магазин')
+        self.assertEqual([good['id'] for good in price_list.goods], [1, 2, 3])
+        # Строки без id после товаров дополняют категории
+        self.assertEqual([category['id'] for category in price_list.categories], [1, 2])
+
+    def test_ndjson_errors(self):
+        with self.assertRaisesMessage(PriceListError, 'Строка 2: неверный JSON'):
+            list(NDJSONPriceList(io.BytesIO(b'{"shop": "x"}\n{"id": 1,\n')).goods)
+        with self.assertRaisesMessage(PriceListError, 'Строка 1: ожидался JSON объект'):
+            NDJSONPriceList(io.BytesIO(b'[1, 2]\n'))
+
+    def test_scan_matches_parse(self):
+        for price_list_format, content, parser in (('csv', PRICE_LIST_CSV, CSVPriceList),
+                                                   ('ndjson', PRICE_LIST_NDJSON, NDJSONPriceList)):
+            summary = scan_price_list(io.BytesIO(content), price_list_format)
+            self.assertEqual((summary.total, summary.categories, summary.parameters),
+                             (3, {1: 'Смартфоны', 2: 'Аксессуары'}, {'Цвет', 'Память'}))
+            self.assertEqual(len(list(parser(io.BytesIO(content)).goods)), summary.total)
+
+    def test_detect_format(self):
+        self.assertEqual(detect_format('price.csv', 'text/csv; charset=utf-8'), 'csv')
+        # Content type важнее расширения
+        self.assertEqual(detect_format('price.csv', 'application/x-ndjson'), 'ndjson')
+        self.assertEqual(detect_format('PRICE.JSONL', 'application/octet-stream'), 'ndjson')
+        self.assertEqual(detect_format('price.yml'), 'yaml')
+        self.assertEqual(detect_format('price.txt', None), 'yaml')
+
+    def test_validate_good(self):
+        good = validate_good({'id': '5', 'category': '1', 'name': 'x', 'price': '9.99', 'price_rrc': 10,
+                              'quantity': '2', 'parameters': {1: 'a'}}, 1)
+        self.assertEqual((good['id'], good['category'], good['quantity'], good['parameters']), (5, 1, 2, {'1': 'a'}))
+
+        base = {'id': 1, 'category': 1, 'name': 'x', 'price': 1, 'price_rrc': 1, 'quantity': 1}
+        errors = [
+            ([1], 'ожидался объект'),
+            (dict(base, name=''), 'не заполнены поля name'),
+            (dict(base, quantity='много'), 'неверное числовое значение'),
+            (dict(base, price='1,5'), 'неверное числовое значение'),
+            (dict(base, quantity=-1), 'id и quantity не могут быть отрицательными'),
+            (dict(base, parameters=['Цвет']), 'parameters должен быть объектом'),
+        ]
+        for good, message in errors:
+            with self.subTest(good=good), self.assertRaisesMessage(PriceListError, f'Товар #3: {message}'):
+                validate_good(good, 3)
+
+
+class FlatFormatImportTests(PriceListUploadMixin, TestCase):
+    """CSV и NDJSON через API поставщика: формат по расширению файла"""
+
+    def test_same_rows_as_yaml(self):
+        self.upload(price_list_yaml())
+        expected = self.offers()
+        for name, content in (('price.csv', PRICE_LIST_CSV), ('price.ndjson', PRICE_LIST_NDJSON)):
+            result = self.upload(content, name=name)
+            self.assertEqual((result['Inserted'], result['Removed']), (3, 3), name)
+            self.assertEqual(self.offers(), expected, name)
+
+
+@override_settings(IMPORT_BATCH_SIZE=2)
+class PartnerStockUpdateTests(PriceListUploadMixin, TestCase):
+    """Быстрое обновление остатков и цен: POST /partner/stock/"""
+
+    def post(self, data, status_code=200):
+        response = self.client.post('/api/v1/partner/stock/', data, content_type='application/json')
+        self.assertEqual(response.status_code, status_code, response.data)
+        return response.data
+
+    def test_access(self):
+        buyer = User.objects.create_user(email='buyer@example.com', password='password')
+        items = [{'external_id': 1, 'quantity': 1}]
+        # Поставщик еще не загружал прайс - магазина нет
+        self.assertIn('Магазин не найден', self.post(items, 400)['Error'])
+
+        self.client.defaults['HTTP_AUTHORIZATION'] = f'Token {Token.objects.create(user=buyer).key}'
+        self.assertEqual(self.post(items, 403)['Error'], 'Только для поставщиков')
+        del self.client.defaults['HTTP_AUTHORIZATION']
+        self.post(items, 403)
+
+    def test_invalid_items(self):
+        self.upload(price_list_yaml())
+        for data in ({'items': None}, {'external_id': 1, 'quantity': 1}, [{'external_id': 1}],
+                     [{'external_id': 1, 'quantity': -1}], [{'external_id': 'x', 'quantity': 1}],
+                     [{'external_id': 1, 'quantity': 1, 'price': -5}],
+                     [{'external_id': 1, 'quantity': 1, 'price_rrc': '-0.01'}]):
+            with self.subTest(data=data):
+                self.assertFalse(self.post(data, 400)['Status'])
+        self.assertEqual(self.offers()[1][:2], (Decimal('500.00'), 3))
+
+    def test_update(self):
+        self.upload(price_list_yaml())
+        items = [{'external_id': 1, 'quantity': 0, 'price': '490.50'}, {'external_id': 2, 'quantity': 7},
+                 {'external_id': 3, 'quantity': 1}, {'external_id': 99, 'quantity': 1}]
+        with CaptureQueriesContext(connection) as context:
+            result = self.post({'items': items})
+        # Неизвестный external_id принимается, но не обновляет строк
+        self.assertEqual((result['Received'], result['Updated']), (4, 3))
+
+        offers = self.offers()
+        self.assertEqual([offers[external_id][:2] for external_id in (1, 2, 3)],
+                         [(Decimal('490.50'), 0), (Decimal('700.00'), 7), (Decimal('10.00'), 1)])
+        # Один UPDATE предложений на пачку из IMPORT_BATCH_SIZE товаров
+        table = ProductInfo._meta.db_table
+        updates = [query['sql'] for query in context.captured_queries
+                   if query['sql'].startswith(f'UPDATE "{table}"')]
+        self.assertEqual(len(updates), 2, updates)
+
+
+class CatalogPageCacheTests(TestCase):
+    """Страницы каталога кэшируются только в общем для процессов кэше"""
+
+    @classmethod
+    def setUpTestData(cls):
+        product = Product.objects.create(name='Товар', category=Category.objects.create(name='Категория'))
+        ProductInfo.objects.create(product=product, shop=Shop.objects.create(name='Магазин'), external_id=1,
+                                   price=100, price_rrc=120, quantity=5)
+
+    def setUp(self):
+        cache.clear()
+
+    def prices_after_change(self):
+        """Цены на странице каталога до и после изменения в обход сигналов (как в другом процессе)"""
+        before = self.client.get('/api/v1/products/').data['results'][0]['price']
+        ProductInfo.objects.update(price=90)
+        return before, self.client.get('/api/v1/products/').data['results'][0]['price']
+
+    @override_settings(CACHE_SHARED=True)
+    def test_shared_cache(self):
+        self.assertEqual(self.prices_after_change(), ('100.00', '100.00'))
+
+    @override_settings(CACHE_SHARED=False)
+    def test_process_cache_disabled(self):
+        self.assertEqual(self.prices_after_change(), ('100.00', '90.00'))
+
+
+class SyntheticPriceListTests(TestCase):
+    """Синтетические прайс-листы generate_price_list разбираются и импортируются во всех форматах"""
+
+    def test_formats(self):
+        for price_list_format in PRICE_LIST_FORMATS:
+            with self.subTest(price_list_format=price_list_format), tempfile.TemporaryDirectory() as directory:
+                path = os.path.join(directory, f'price.{price_list_format}')
+                shop_name = f'Синтетический {price_list_format}'
+                call_command('generate_price_list', format=price_list_format, shop=shop_name, goods=30,
+                             categories=4, parameters=3, parameter_pool=6, output=path, stderr=io.StringIO())
+
+                user = User.objects.create_user(email=f'{price_list_format}@example.com', password='password',
+                                                type='shop')
+                with open(path, 'rb') as stream:
+                    summary = scan_price_list(stream, price_list_format)
+                    stream.seek(0)
+                    result = import_price_list(PRICE_LIST_FORMATS[price_list_format](stream), user,
+                                               summary=summary)
+
+                self.assertTrue(result['Status'], result)
+                self.assertEqual((summary.shop, summary.total, len(summary.categories)), (shop_name, 30, 4))
+                self.assertLessEqual(summary.parameters, {f'Параметр {number}' for number in range(1, 7)})
+                shop = Shop.objects.get(user=user)
+                self.assertEqual(shop.name, shop_name)
+                self.assertEqual(shop.categories.count(), 4)
+                self.assertEqual(ProductInfo.objects.filter(shop=shop).count(), 30)
+                self.assertEqual(ProductParameter.objects.filter(product_info__shop=shop).count(), 30 * 3)
+
+
+class CatalogInvalidationTests(TestCase):
+    """Изменения товаров вне импорта меняют ключи кэша каталога и сбрасывают хеши импорта"""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.shop = Shop.objects.create(name='Магазин')
+        cls.other_shop = Shop.objects.create(name='Другой магазин', import_digest='other')
+        cls.category = Category.objects.create(name='Категория')
+        cls.product = Product.objects.create(name='Товар', category=cls.category)
+        cls.product_info = ProductInfo.objects.create(product=cls.product, shop=cls.shop, external_id=1,
+                                                      price=100, price_rrc=120, quantity=5)
+        # Как после импорта: создание предложения выше уже сбросило хеши
+        Shop.objects.filter(id=cls.shop.id).update(import_digest='digest',
+                                                    import_chunk_digests={'batch_size': 2, 'chunks': ['chunk']})
+
+    def page_keys(self):
+        factory = APIRequestFactory()
+        return [catalog_page_key(Request(factory.get('/api/v1/products/', params)))
+                for params in ({}, {'shop_id': self.shop.id}, {'category_id': self.category.id})]
+
+    def assertInvalidated(self, change):
+        keys = self.page_keys()
+        with self.captureOnCommitCallbacks() as callbacks:
+            change()
+        # Версии увеличиваются только после фиксации транзакции
+        self.assertEqual(self.page_keys(), keys)
+        for callback in callbacks:
+            callback()
+        for old, new in zip(keys, self.page_keys()):
+            self.assertNotEqual(old, new)
+
+        shop = Shop.objects.get(id=self.shop.id)
+        self.assertEqual((shop.import_digest, shop.import_chunk_digests), ('', {}))
+        self.assertEqual(Shop.objects.get(id=self.other_shop.id).import_digest, 'other')
+
+    def test_product_info_saved(self):
+        self.product_info.quantity = 4
+        self.assertInvalidated(self.product_info.save)
+        self.assertEqual(CatalogEntry.objects.get(id=self.product_info.id).quantity, 4)
+
+    def test_product_saved(self):
+        self.product.name = 'Новое название'
+        self.assertInvalidated(self.product.save)
+        self.assertEqual(CatalogEntry.objects.get(id=self.product_info.id).product_name, 'Новое название')
+
+    def test_category_saved(self):
+        self.category.name = 'Новая категория'
+        self.assertInvalidated(self.category.save)
+        self.assertEqual(CatalogEntry.objects.get(id=self.product_info.id).category_name, 'Новая категория')
+
+    def assertOffersDeleted(self, delete):
+        ProductParameter.objects.create(product_info=self.product_info, parameter=Parameter.objects.create(name='Цвет'),
+                                        value='черный')
+        refresh_facets([self.shop.id])
+        self.assertTrue(ParameterFacet.objects.filter(shop_id=self.shop.id).exists())
+
+        # Предложения удаляются каскадом: строки каталога и фасеты пересобираются после фиксации
+        self.assertInvalidated(delete)
+        self.assertFalse(ProductInfo.objects.exists())
+        self.assertFalse(CatalogEntry.objects.exists())
+        self.assertFalse(ParameterFacet.objects.exists())
+        response = self.client.get('/api/v1/products/', {'source': 'flat', 'q': 'Товар'})
+        self.assertEqual(response.data['results'], [])
+
+    def test_product_deleted(self):
+        self.assertOffersDeleted(self.product.delete)
+
+    def test_category_deleted(self):
+        Product.objects.create(name='Другой товар', category=self.category)
+        self.assertOffersDeleted(Category.objects.filter(id=self.category.id).delete)
+
+
+@override_settings(IMPORT_BATCH_SIZE=2)
+class FlatCatalogTests(PriceListUploadMixin, TestCase):
+    """Плоский каталог: строки предложений в наличии обновляются импортом и остатками"""
+
+    def entries(self):
+        return {entry.external_id: entry for entry in CatalogEntry.objects.all()}
+
+    def assertMatchesOffers(self):
+        """Строки каталога совпадают с предложениями в наличии"""
+        offers = ProductInfo.objects.filter(quantity__gt=0).select_related('product__category', 'shop')
+        self.assertEqual(
+            {entry.id: (entry.product_name, entry.category_name, entry.shop_name, entry.price, entry.quantity)
+             for entry in CatalogEntry.objects.all()},
+            {offer.id: (offer.product.name, offer.product.category.name, offer.shop.name, offer.price, offer.quantity)
+             for offer in offers})
+
+    def test_import(self):
+        self.upload(price_list_yaml())
+        entries = self.entries()
+        # Товара 2 нет в наличии
+        self.assertEqual(set(entries), {1, 3})
+        self.assertMatchesOffers()
+        self.assertEqual(entries[1].parameters, {'Цвет': 'черный', 'Память': '128'})
+        self.assertEqual(entries[1].search_text, 'Смартфон phone-1 черный 128')
+
+    def test_delta_import(self):
+        self.upload(price_list_yaml(), mode='delta')
+        unchanged_id = CatalogEntry.objects.get(external_id=3).id
+
+        goods = [dict(PRICE_LIST_GOODS[0], quantity=0), dict(PRICE_LIST_GOODS[1], quantity=1, price=650),
+                 PRICE_LIST_GOODS[2]]
+        self.upload(price_list_yaml(goods), mode='delta')
+        self.assertEqual(set(self.entries()), {2, 3})
+        self.assertEqual(self.entries()[2].price, Decimal('650.00'))
+        self.assertEqual(self.entries()[3].id, unchanged_id)
+        self.assertMatchesOffers()
+
+    def test_update_stock(self):
+        self.upload(price_list_yaml())
+        shop = Shop.objects.get(user=self.user)
+        update_stock(shop, [{'external_id': 1, 'quantity': 0}, {'external_id': 2, 'quantity': 4, 'price': 650}])
+        self.assertEqual(set(self.entries()), {2, 3})
+        self.assertEqual((self.entries()[2].quantity, self.entries()[2].price), (4, Decimal('650.00')))
+        self.assertMatchesOffers()
+
+    def test_inactive_shop(self):
+        self.upload(price_list_yaml())
+        shop = Shop.objects.get(user=self.user)
+        shop.is_active = False
+        shop.save(update_fields=['is_active'])
+        self.assertFalse(CatalogEntry.objects.exists())
+
+        shop.is_active = True
+        shop.save(update_fields=['is_active'])
+        self.assertMatchesOffers()
+
+
+@override_settings(IMPORT_BATCH_SIZE=2)
+class FacetTests(PriceListUploadMixin, TestCase):
+    """Агрегат фасетов: пересчет при импорте, изменение на разницу при остатках и заказах"""
+
+    def setUp(self):
+        super().setUp()
+        self.upload(price_list_yaml())
+        self.shop = Shop.objects.get(user=self.user)
+
+    def facets(self):
+        return {(facet.category_id, facet.parameter, facet.value): facet.count
+                for facet in ParameterFacet.objects.filter(shop_id=self.shop.id)}
+
+    def assertFacets(self, expected):
+        self.assertEqual(self.facets(), expected)
+        # Те же счетчики, что и при полном пересчете магазина
+        refresh_facets([self.shop.id])
+        self.assertEqual(self.facets(), expected)
+
+    def test_import(self):
+        self.assertFacets({(1, 'Цвет', 'черный'): 1, (1, 'Память', '128'): 1, (2, 'Цвет', 'черный'): 1})
+        response = self.client.get('/api/v1/products/facets/', {'shop_id': self.shop.id})
+        self.assertEqual(response.data['Facets'], {'Память': {'128': 1}, 'Цвет': {'черный': 2}})
+
+    def test_update_stock(self):
+        items = [{'external_id': 1, 'quantity': 0}, {'external_id': 2, 'quantity': 4},
+                 {'external_id': 3, 'quantity': 5}]
+        with mock.patch('procurement.catalog.refresh_facets') as refresh:
+            update_stock(self.shop, items)
+        # Магазин не пересчитывается: меняются счетчики товаров 1 и 2
+        refresh.assert_not_called()
+        self.assertFacets({(1, 'Цвет', 'белый'): 1, (2, 'Цвет', 'черный'): 1})
+
+        update_stock(self.shop, [{'external_id': 1, 'quantity': 2}])
+        self.assertFacets({(1, 'Цвет', 'белый'): 1, (1, 'Цвет', 'черный'): 1, (1, 'Память', '128'): 1,
+                           (2, 'Цвет', 'черный'): 1})
+
+    def test_many_changes_refresh_shop(self):
+        with mock.patch('procurement.catalog.ADJUST_FACETS_MAX_VALUES', 1):
+            update_stock(self.shop, [{'external_id': 1, 'quantity': 0}])
+        self.assertFacets({(2, 'Цвет', 'черный'): 1})
+
+    def test_order_confirm(self):
+        buyer = User.objects.create_user(email='buyer@example.com', password='password')
+        contact = Contact.objects.create(user=buyer, city='Москва', street='Тверская', phone='+70000000000')
+        DatabaseBasket(buyer).add(ProductInfo.objects.get(external_id=1), 3)
+        DatabaseBasket(buyer).add(ProductInfo.objects.get(external_id=3), 1)
+
+        with mock.patch('procurement.views.send_order_confirmation_email'), \
+                mock.patch('procurement.views.send_order_to_admin_email'), \
+                self.captureOnCommitCallbacks(execute=True):
+            response = self.client.post('/api/v1/order/confirm/', {'contact_id': contact.id},
+                                        HTTP_AUTHORIZATION=f'Token {Token.objects.create(user=buyer).key}')
+        self.assertTrue(response.data['Status'], response.data)
+        # Товар 1 закончился, товара 3 осталось 19
+        self.assertFacets({(2, 'Цвет', 'черный'): 1})
+
+
+class PriceFilterTests(TestCase):
+    """Диапазон цены и сортировка каталога: оба источника, страницы и курсор при равных ценах"""
+
+    @classmethod
+    def setUpTestData(cls):
+        shop = Shop.objects.create(name='Магазин')
+        category = Category.objects.create(name='Категория')
+        prices = [30, 10, 20, 40, 20, 50, 20, Decimal('19.99'), 40, 60]
+        for number, price in enumerate(prices):
+            product = Product.objects.create(name=f'Товар {number}', category=category)
+            ProductInfo.objects.create(product=product, shop=shop, external_id=number,
+                                       price=price, price_rrc=price, quantity=1)
+        # Нет в наличии - не попадает в выдачу при любой цене
+        ProductInfo.objects.create(product=product, shop=shop, external_id=100, price=25, price_rrc=25, quantity=0)
+
+    def get(self, **params):
+        response = self.client.get('/api/v1/products/', params)
+        self.assertEqual(response.status_code, 200, response.data)
+        return response
+
+    def offers(self, **params):
+        for source in ('', 'flat'):
+            results = self.get(source=source, **params).data['results']
+            yield source, [(Decimal(item['price']), item['id']) for item in results]
+
+    def expected(self, low, high, reverse=False):
+        rows = ProductInfo.objects.filter(quantity__gt=0, price__gte=low, price__lte=high).values_list('price', 'id')
+        return sorted(rows, reverse=reverse)
+
+    def test_range_inclusive(self):
+        for source, offers in self.offers(price_min=20, price_max='40.00'):
+            self.assertEqual(sorted(offers), self.expected(20, 40), source)
+            self.assertEqual(len(offers), 6, source)
+
+    def test_ordering(self):
+        for ordering, reverse in (('price', False), ('-price', True)):
+            for source, offers in self.offers(ordering=ordering, price_min='19.99'):
+                # При равных ценах id идет в направлении цены
+                self.assertEqual(offers, self.expected(Decimal('19.99'), 100, reverse), (ordering, source))
+
+    def test_cursor_pages_with_equal_prices(self):
+        offers, params = [], {'pagination': 'cursor', 'ordering': '-price', 'price_max': 40}
+        with mock.patch('procurement.pagination.ProductCursorPagination.page_size', 2):
+            response = self.get(**params)
+            while True:
+                offers += [(Decimal(item['price']), item['id']) for item in response.data['results']]
+                if not response.data['next']:
+                    break
+                response = self.client.get(response.data['next'])
+        self.assertEqual(offers, self.expected(0, 40, reverse=True))
+
+    def test_invalid_params(self):
+        for params in ({'price_min': 'дешево'}, {'price_max': 'NaN'}, {'ordering': 'name'}):
+            with self.subTest(params=params):
+                response = self.client.get('/api/v1/products/', params)
+                self.assertEqual(response.status_code, 400)
+                self.assertFalse(response.data['Status'])
+
+
+@skipUnless(fakeredis, 'fakeredis не установлен (requirements-dev.txt)')
+@override_settings(BASKET_BACKEND='redis', BASKET_REDIS_URL='redis://localhost:6379/2')
+class RedisBasketTests(TestCase):
+    """Корзина в Redis: атомарные изменения хеша, выгрузка в БД, вычитание после подтверждения"""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user(email='buyer@example.com', password='password')
+        cls.other_user = User.objects.create_user(email='other@example.com', password='password')
+        shop = Shop.objects.create(name='Магазин')
+        category = Category.objects.create(name='Категория')
+        cls.product_infos = []
+        for number in range(3):
+            product = Product.objects.create(name=f'Товар {number}', category=category)
+            cls.product_infos.append(ProductInfo.objects.create(
+                product=product, shop=shop, external_id=number, price=100, price_rrc=120, quantity=10))
+
+    def setUp(self):
+        self.redis = fakeredis.FakeRedis(decode_responses=True)
+        patcher = mock.patch('procurement.baskets._redis', self.redis)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def order_items(self, order):
+        return dict(order.items.values_list('product_info_id', 'quantity'))
+
+    def test_changes_stay_in_redis(self):
+        first, second, _ = self.product_infos
+        basket = get_basket(self.user)
+        self.assertIsInstance(basket, RedisBasket)
+
+        basket.add(first, 2)
+        basket.add(first, 1)
+        basket.apply({second.id: ('set', 5)})
+        self.assertEqual(basket.items(), {first.id: 3, second.id: 5})
+        self.assertEqual(basket.marker(), '3')
+        self.assertEqual(self.redis.smembers(DIRTY_KEY), {str(self.user.id)})
+
+        self.assertTrue(basket.remove(second.id))
+        self.assertFalse(basket.remove(second.id))
+        self.assertEqual(basket.items(), {first.id: 3})
+        self.assertFalse(Order.objects.exists())
+
+    def test_flush(self):
+        first, second, third = self.product_infos
+        get_basket(self.user).apply({first.id: ('add', 1), second.id: ('add', 2)})
+        get_basket(self.other_user).add(third, 4)
+
+        self.assertEqual(flush_baskets(), 2)
+        self.assertEqual(self.redis.scard(DIRTY_KEY), 0)
+        order = Order.objects.get(user=self.user, status='basket')
+        self.assertEqual(self.order_items(order), {first.id: 1, second.id: 2})
+        self.assertEqual(self.order_items(Order.objects.get(user=self.other_user)), {third.id: 4})
+
+        # Позиции заказа приводятся к хешу; удаленное предложение пропускается
+        get_basket(self.user).apply({first.id: ('remove', None), second.id: ('set', 7), third.id: ('add', 1)})
+        third.delete()
+        self.assertEqual(flush_baskets(), 1)
+        self.assertEqual(self.order_items(Order.objects.get(id=order.id)), {second.id: 7})
+        self.assertEqual(flush_baskets(), 0)
+
+    def test_flush_failure_keeps_basket_dirty(self):
+        first, _, third = self.product_infos
+        get_basket(self.user).add(first, 1)
+        get_basket(self.other_user).add(third, 4)
+        materialize = RedisBasket.materialize
+
+        def fail_for_user(basket):
+            if basket.user.id == self.user.id:
+                raise IntegrityError('сбой БД')
+            return materialize(basket)
+
+        with mock.patch.object(RedisBasket, 'materialize', fail_for_user), \
+                self.assertRaisesMessage(IntegrityError, 'сбой БД'):
+            flush_baskets()
+        # Корзина другого пользователя выгружена, неудачная осталась в DIRTY_KEY
+        self.assertEqual(self.redis.smembers(DIRTY_KEY), {str(self.user.id)})
+        self.assertTrue(Order.objects.filter(user=self.other_user).exists())
+        self.assertFalse(Order.objects.filter(user=self.user).exists())
+
+        self.assertEqual(flush_baskets(), 1)
+        self.assertEqual(self.order_items(Order.objects.get(user=self.user)), {first.id: 1})
+        self.assertEqual(self.redis.scard(DIRTY_KEY), 0)
+
+    def test_remove_view_validates_id(self):
+        first = self.product_infos[0]
+        get_basket(self.user).add(first, 2)
+        self.client.defaults['HTTP_AUTHORIZATION'] = f'Token {Token.objects.create(user=self.user).key}'
+
+        for data in ({}, {'product_info_id': None}, {'product_info_id': 'abc'}, {'product_info_id': 0},
+                     {'product_info_id': [first.id]}):
+            with self.subTest(data=data):
+                response = self.client.delete('/api/v1/basket/remove/', data, content_type='application/json')
+                self.assertEqual(response.status_code, 400)
+                self.assertEqual(response.data, {'Status': False, 'Error': 'Неверный product_info_id'})
+        self.assertEqual(get_basket(self.user).items(), {first.id: 2})
+
+        response = self.client.delete('/api/v1/basket/remove/', {'product_info_id': str(first.id)},
+                                      content_type='application/json')
+        self.assertTrue(response.data['Status'])
+        self.assertEqual(get_basket(self.user).items(), {})
+
+    def test_confirm_keeps_concurrent_adds(self):
+        first, second, _ = self.product_infos
+        basket = get_basket(self.user)
+        basket.apply({first.id: ('add', 2), second.id: ('add', 1)})
+
+        with self.captureOnCommitCallbacks(execute=True), transaction.atomic():
+            order = basket.materialize()
+            # Добавлено в другом запросе, пока заказ подтверждался
+            get_basket(self.user).add(first, 5)
+            order.status = 'new'
+            order.save()
+            basket.confirmed(order)
+            self.assertEqual(basket.items(), {first.id: 7, second.id: 1})
+
+        self.assertEqual(basket.items(), {first.id: 5})
+        self.assertEqual(self.order_items(order), {first.id: 2, second.id: 1})
+
+        # Остаток выгружается в новую корзину, подтвержденный заказ не меняется
+        self.assertEqual(flush_baskets(), 1)
+        self.assertEqual(self.order_items(Order.objects.get(user=self.user, status='basket')), {first.id: 5})
+        self.assertEqual(self.order_items(Order.objects.get(id=order.id)), {first.id: 2, second.id: 1})
+
+    def test_confirm_view(self):
+        first = self.product_infos[0]
+        get_basket(self.user).add(first, 3)
+        contact = Contact.objects.create(user=self.user, city='Москва', street='Тверская', phone='+70000000000')
+
+        with mock.patch('procurement.views.send_order_confirmation_email'), \
+                mock.patch('procurement.views.send_order_to_admin_email'), \
+                self.captureOnCommitCallbacks(execute=True):
+            response = self.client.post('/api/v1/order/confirm/', {'contact_id': contact.id},
+                                        HTTP_AUTHORIZATION=f'Token {Token.objects.create(user=self.user).key}')
+        self.assertTrue(response.data['Status'], response.data)
+        order = Order.objects.get(id=response.data['OrderId'])
+        self.assertEqual((order.status, self.order_items(order)), ('new', {first.id: 3}))
+        self.assertEqual(get_basket(self.user).items(), {})
+        self.assertEqual(ProductInfo.objects.get(id=first.id).quantity, 7)
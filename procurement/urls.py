@@ -14,11 +14,14 @@ urlpatterns = [
 
     # Товары
     path('products/', views.ProductListView.as_view(), name='product-list'),
+    path('products/export/', views.ProductExportView.as_view(), name='product-export'),
+    path('products/facets/', views.ProductFacetsView.as_view(), name='product-facets'),
 
     # Корзина
     path('basket/', views.CartView.as_view(), name='basket'),
     path('basket/add/', views.CartAddView.as_view(), name='basket-add'),
     path('basket/remove/', views.CartRemoveView.as_view(), name='basket-remove'),
+    path('basket/batch/', views.CartBatchView.as_view(), name='basket-batch'),
 
     # Контакты
     path('user/contacts/', views.ContactListView.as_view(), name='contact-list'),
@@ -31,6 +34,8 @@ urlpatterns = [
 
     # Импорт для поставщиков
     path('partner/update/', views.PartnerUpdate.as_view(), name='partner-update'),
+    path('partner/stock/', views.PartnerStockUpdate.as_view(), name='partner-stock'),
+    path('partner/import/<int:job_id>/', views.PartnerImportStatus.as_view(), name='partner-import-status'),
 
     # Восстановление пароля
     path('user/password/reset/', ResetPasswordRequestToken.as_view(), name='password-reset'),
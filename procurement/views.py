@@ -5,14 +5,35 @@ from rest_framework.response import Response
 from rest_framework.authtoken.models import Token
 from rest_framework.views import APIView
 from django.db import transaction
+from django.http import StreamingHttpResponse
+from django.utils.cache import patch_vary_headers
+from django.utils.text import compress_sequence
+from django.db.models import Count, Max, Prefetch
+import re
 import yaml
+from celery.result import AsyncResult
 from django.utils import timezone
 
-from .models import User, Shop, Category, Product, ProductInfo, Parameter, ProductParameter, Contact, Order, OrderItem
+from .models import Shop, ProductInfo, Contact, Order, OrderItem, ImportJob, CatalogEntry
 from .serializers import *
+from .baskets import RedisBasket, get_basket, parse_batch, parse_id, parse_quantity
+from .cache import catalog_page_key, get_or_build, shop_versions
+from .conditional import ConditionalGetMixin
+from .fieldsets import Fieldset, FieldsetViewMixin, parameters_prefetch, select_expanded
+from .pagination import CatalogPagination
+from .search import search_catalog
+from .catalog import adjust_facets, count_facets, facet_counts
+from .filters import PRICE_FILTERS, catalog_ordering, catalog_params_error, filter_by_parameters, filter_by_price, \
+    filter_catalog_entries, parameter_filters
+from .importers import IMPORT_MODES, check_not_modified, import_price_list, update_stock
+from .price_lists import PRICE_LIST_FORMATS, PriceListError, detect_format, file_digest, scan_price_list
+from .tasks import import_price_list_async
 from .services import send_order_confirmation_email, send_user_registration_email, send_order_status_email, \
     send_order_to_admin_email
 
+# Клиент принимает gzip (как в django.middleware.gzip)
+ACCEPTS_GZIP_RE = re.compile(r'\bgzip\b')
+
 
 # ==================== КОРНЕВОЙ API ENDPOINT ====================
 
@@ -46,7 +67,43 @@ def api_root(request):
                     "auth_required": False,
                     "parameters": {
                         "category_id": "Фильтр по категории",
-                        "shop_id": "Фильтр по магазину"
+                        "shop_id": "Фильтр по магазину",
+                        "pagination": "cursor - курсорная пагинация без подсчета count (для обхода всего каталога), учитывает ordering",
+                        "count": "Режим count: exact (по умолчанию), cached (из кэша), estimated (оценка планировщика), none (без count)",
+                        "q": "Полнотекстовый поиск по названию, модели и параметрам (выдача по релевантности)",
+                        "param[Название]": "Фильтр по значению параметра, например param[Цвет]=черный (можно несколько значений)",
+                        "price_min": "Минимальная цена",
+                        "price_max": "Максимальная цена",
+                        "ordering": "Сортировка: price, -price, price_rrc, -price_rrc (по умолчанию - по id)",
+                        "fields": "Поля ответа через запятую, например id,product,price,quantity",
+                        "expand": "Раскрываемые связи: product, product.category, shop, parameters (нераскрытые - id)",
+                        "source": "flat - плоский формат из денормализованного каталога (параметры как {название: значение})"
+                    }
+                },
+                "export": {
+                    "url": "/api/v1/products/export/",
+                    "method": "GET",
+                    "description": "Потоковая выгрузка товаров в наличии в NDJSON (gzip при Accept-Encoding: gzip)",
+                    "auth_required": False,
+                    "parameters": {
+                        "category_id": "Фильтр по категории",
+                        "shop_id": "Фильтр по магазину",
+                        "fields": "Поля строки, как в списке товаров",
+                        "expand": "Раскрываемые связи, как в списке товаров"
+                    }
+                },
+                "facets": {
+                    "url": "/api/v1/products/facets/",
+                    "method": "GET",
+                    "description": "Число предложений в наличии по значениям параметров",
+                    "auth_required": False,
+                    "parameters": {
+                        "category_id": "Фильтр по категории",
+                        "shop_id": "Фильтр по магазину",
+                        "q": "Полнотекстовый поиск",
+                        "param[Название]": "Фильтр по значению параметра",
+                        "price_min": "Минимальная цена",
+                        "price_max": "Максимальная цена"
                     }
                 }
             },
@@ -55,7 +112,12 @@ def api_root(request):
                     "url": "/api/v1/basket/",
                     "method": "GET",
                     "description": "Просмотр корзины",
-                    "auth_required": True
+                    "auth_required": True,
+                    "parameters": {
+                        "fields": "Поля позиции: id, product_info, quantity, total_price",
+                        "expand": "product_info, product_info.product, product_info.product.category, "
+                                  "product_info.shop, product_info.parameters"
+                    }
                 },
                 "add": {
                     "url": "/api/v1/basket/add/",
@@ -68,6 +130,15 @@ def api_root(request):
                     "method": "POST",
                     "description": "Удаление товара из корзины",
                     "auth_required": True
+                },
+                "batch": {
+                    "url": "/api/v1/basket/batch/",
+                    "method": "POST",
+                    "description": "Пакетное изменение корзины, в ответе - корзина целиком",
+                    "auth_required": True,
+                    "parameters": {
+                        "items": "[{product_info_id, quantity, op}], op: add (по умолчанию), set или remove"
+                    }
                 }
             },
             "contacts": {
@@ -89,7 +160,12 @@ def api_root(request):
                     "url": "/api/v1/orders/",
                     "method": "GET",
                     "description": "История заказов",
-                    "auth_required": True
+                    "auth_required": True,
+                    "parameters": {
+                        "fields": "Поля заказа: id, status, created_at, contact, items",
+                        "count": "Режим count: exact, cached, estimated, none",
+                        "expand": "contact, items, items.product_info и вложенные связи товара"
+                    }
                 },
                 "confirm": {
                     "url": "/api/v1/order/confirm/",
@@ -104,6 +180,26 @@ def api_root(request):
                     "method": "POST",
                     "description": "Импорт товаров (только для поставщиков)",
                     "auth_required": True,
+                    "user_type": "shop",
+                    "parameters": {
+                        "file": "Файл прайс-листа: YAML, CSV или NDJSON",
+                        "format": "yaml, csv или ndjson (по умолчанию по content type или расширению файла)",
+                        "mode": "full - полная замена прайса (по умолчанию), delta - запись только отличий",
+                        "async": "true - импорт в фоне через Celery, ответ 202 с JobId"
+                    }
+                },
+                "stock": {
+                    "url": "/api/v1/partner/stock/",
+                    "method": "POST",
+                    "description": "Быстрое обновление остатков и цен: [{external_id, quantity, price, price_rrc}]",
+                    "auth_required": True,
+                    "user_type": "shop"
+                },
+                "import_status": {
+                    "url": "/api/v1/partner/import/{job_id}/",
+                    "method": "GET",
+                    "description": "Состояние асинхронного импорта",
+                    "auth_required": True,
                     "user_type": "shop"
                 }
             }
@@ -168,12 +264,26 @@ def login_view(request):
 
 # ==================== ТОВАРЫ ====================
 
-class ProductListView(generics.ListAPIView):
+class ProductListView(ConditionalGetMixin, FieldsetViewMixin, generics.ListAPIView):
     """Список товаров с фильтрацией"""
     serializer_class = ProductInfoSerializer
     permission_classes = [AllowAny]
+    pagination_class = CatalogPagination
+
+    def get_etag_parts(self, request):
+        # Ключ страницы в кэше уже содержит параметры запроса и версии каталога
+        return [catalog_page_key(request)]
+
+    def use_flat_catalog(self):
+        return self.request.query_params.get('source') == 'flat'
+
+    def get_serializer_class(self):
+        return CatalogEntrySerializer if self.use_flat_catalog() else ProductInfoSerializer
 
     def get_queryset(self):
+        if self.use_flat_catalog():
+            return self.get_flat_queryset()
+
         queryset = ProductInfo.objects.filter(shop__is_active=True, quantity__gt=0)
 
         # Фильтрация по категории
@@ -186,22 +296,175 @@ class ProductListView(generics.ListAPIView):
         if shop_id:
             queryset = queryset.filter(shop_id=shop_id)
 
-        return queryset.select_related('product', 'shop').prefetch_related('parameters__parameter')
+        # Диапазон цены: price_min, price_max
+        queryset = filter_by_price(queryset, self.request.query_params)
+
+        # Фильтрация по параметрам: param[Цвет]=черный
+        queryset = filter_by_parameters(queryset, parameter_filters(self.request.query_params))
+
+        return self.search(queryset)
+
+    def get_ordering(self):
+        """Сортировка ordering=price|-price|price_rrc|-price_rrc, по умолчанию - по id"""
+        return catalog_ordering(self.request.query_params)
+
+    def search(self, queryset):
+        """Полнотекстовый поиск по q: без явной сортировки выдача упорядочена по релевантности"""
+        query = self.request.query_params.get('q', '').strip()
+        if not query:
+            return queryset.order_by(*self.get_ordering())
+        if self.request.query_params.get('ordering'):
+            return search_catalog(queryset, query).order_by(*self.get_ordering())
+        return search_catalog(queryset, query).order_by('-rank', 'id')
+
+    def get_flat_queryset(self):
+        """Плоский каталог: в нем только предложения в наличии, один запрос без соединений"""
+        queryset = filter_catalog_entries(CatalogEntry.objects.all(), self.request.query_params)
+        fields = self.get_fieldset().fields
+        if fields:
+            # Поля сортировки нужны курсорной пагинации
+            queryset = queryset.only(*fields, *(name.lstrip('-') for name in self.get_ordering()))
+        return self.search(queryset)
+
+    def list(self, request, *args, **kwargs):
+        error = catalog_params_error(request.query_params) or self.fieldset_error()
+        if error:
+            return Response({'Status': False, 'Error': error}, status=status.HTTP_400_BAD_REQUEST)
+
+        # Страница кэшируется до изменения данных ее магазина или категории
+        data = get_or_build(catalog_page_key(request), self.build_page)
+        return Response(data)
+
+    def build_page(self):
+        """
+        Данные страницы. Вложенный формат собирается из values() функцией
+        serialize_product_infos - тот же JSON, что у ProductInfoSerializer.
+        Связанные данные выбираются только для раскрытых связей (expand)
+        """
+        queryset = self.filter_queryset(self.get_queryset())
+        if self.use_flat_catalog():
+            page = self.paginate_queryset(queryset)
+            return self.get_paginated_response(self.get_serializer(page, many=True).data).data
+
+        fieldset = self.get_fieldset()
+        fields = product_info_values(fieldset)
+        if self.request.query_params.get('q', '').strip():
+            # Ранг поиска нужен в выборке для сортировки
+            fields += ('rank',)
+        page = self.paginate_queryset(queryset.values(*fields))
+        return self.get_paginated_response(serialize_product_infos(page, fieldset)).data
+
+
+class ProductExportView(FieldsetViewMixin, generics.GenericAPIView):
+    """
+    Потоковая выгрузка предложений в наличии в NDJSON: строка - товар в формате
+    /products/. Поддерживает shop_id, category_id, fields и expand; при
+    Accept-Encoding: gzip поток сжимается на лету
+    """
+    serializer_class = ProductInfoSerializer
+    permission_classes = [AllowAny]
+
+    def get_queryset(self):
+        queryset = ProductInfo.objects.filter(shop__is_active=True, quantity__gt=0)
+
+        category_id = self.request.query_params.get('category_id')
+        if category_id:
+            queryset = queryset.filter(product__category_id=category_id)
+
+        shop_id = self.request.query_params.get('shop_id')
+        if shop_id:
+            queryset = queryset.filter(shop_id=shop_id)
+
+        return queryset.order_by('id')
+
+    def perform_content_negotiation(self, request, force=False):
+        # Выгрузка всегда в NDJSON, Accept: application/x-ndjson не должен давать 406
+        return super().perform_content_negotiation(request, force=True)
+
+    def get(self, request):
+        error = self.fieldset_error()
+        if error:
+            return Response({'Status': False, 'Error': error}, status=status.HTTP_400_BAD_REQUEST)
+
+        lines = iter_product_infos_ndjson(self.get_queryset(), self.get_fieldset())
+        use_gzip = bool(ACCEPTS_GZIP_RE.search(request.META.get('HTTP_ACCEPT_ENCODING', '')))
+        response = StreamingHttpResponse(compress_sequence(lines) if use_gzip else lines,
+                                         content_type='application/x-ndjson; charset=utf-8')
+        if use_gzip:
+            response['Content-Encoding'] = 'gzip'
+        patch_vary_headers(response, ('Accept-Encoding',))
+        response['Content-Disposition'] = 'attachment; filename="catalog.ndjson"'
+        return response
+
+
+class ProductFacetsView(APIView):
+    """Фасеты каталога: число предложений по значениям параметров для текущих фильтров"""
+    permission_classes = [AllowAny]
+
+    def get(self, request):
+        error = catalog_params_error(request.query_params)
+        if error:
+            return Response({'Status': False, 'Error': error}, status=status.HTTP_400_BAD_REQUEST)
+
+        data = get_or_build(catalog_page_key(request), lambda: {'Facets': self.get_facets(request.query_params)})
+        return Response(data)
+
+    def get_facets(self, query_params):
+        query = query_params.get('q', '').strip()
+        if not query and not parameter_filters(query_params) and not any(
+                query_params.get(name) for name in PRICE_FILTERS):
+            # Фильтры только по магазину и категории - суммы по готовому агрегату
+            return facet_counts(shop_id=query_params.get('shop_id'), category_id=query_params.get('category_id'))
+
+        # Выборку по параметрам и поиску агрегат не покрывает - считаем по плоскому каталогу
+        entries = filter_catalog_entries(CatalogEntry.objects.all(), query_params)
+        if query:
+            entries = search_catalog(entries, query)
+        return count_facets(entries)
 
 
 # ==================== КОРЗИНА ====================
 
-class CartView(generics.ListAPIView):
-    """Просмотр корзины пользователя"""
-    serializer_class = OrderItemSerializer
+class CartView(ConditionalGetMixin, FieldsetViewMixin, generics.ListAPIView):
+    """
+    Просмотр корзины пользователя. Только чтение: заказ-корзина не создается.
+    Число запросов не зависит от числа позиций, стоимость позиций и итоги
+    (total_quantity, total_price) считаются в SQL
+    """
+    serializer_class = BasketItemSerializer
     permission_classes = [IsAuthenticated]
 
+    def get_etag_parts(self, request):
+        # Маркер изменения корзины и версии магазинов ее товаров (цены и остатки в ответе)
+        basket = get_basket(request.user)
+        return [request.user.id, basket.marker(), shop_versions(basket.shop_ids())]
+
     def get_queryset(self):
-        order, created = Order.objects.get_or_create(
-            user=self.request.user,
-            status='basket'
-        )
-        return order.items.all()
+        return basket_items(get_basket(self.request.user), self.get_fieldset())
+
+    def list(self, request, *args, **kwargs):
+        response = super().list(request, *args, **kwargs)
+        if response.status_code == status.HTTP_200_OK and isinstance(response.data, dict):
+            response.data.update(serialize_basket_totals(get_basket(request.user).totals()))
+        return response
+
+
+def basket_items(basket, fieldset):
+    """Позиции корзины со стоимостью line_total и связями, раскрытыми по fieldset"""
+    if isinstance(basket, RedisBasket):
+        # Позиции корзины из Redis - несохраненные OrderItem над предложениями из БД
+        return basket.order_items(select_expanded(ProductInfo.objects.all(), fieldset, select={
+            'product_info.product': 'product',
+            'product_info.product.category': 'product__category',
+            'product_info.shop': 'shop',
+        }, prefetch={'product_info.parameters': parameters_prefetch('parameters')}))
+
+    return select_expanded(basket.order_items(), fieldset, select={
+        'product_info': 'product_info',
+        'product_info.product': 'product_info__product',
+        'product_info.product.category': 'product_info__product__category',
+        'product_info.shop': 'product_info__shop',
+    }, prefetch={'product_info.parameters': parameters_prefetch('product_info__parameters')})
 
 
 class CartAddView(generics.CreateAPIView):
@@ -211,29 +474,16 @@ class CartAddView(generics.CreateAPIView):
 
     def create(self, request, *args, **kwargs):
         product_info_id = request.data.get('product_info_id')
-        quantity = request.data.get('quantity', 1)
+        quantity = parse_quantity(request.data.get('quantity', 1))
+        if quantity is None:
+            return Response({'Status': False, 'Error': 'Количество должно быть целым числом больше нуля'}, status=400)
 
         try:
             product_info = ProductInfo.objects.get(id=product_info_id)
-        except ProductInfo.DoesNotExist:
+        except (ProductInfo.DoesNotExist, ValueError):
             return Response({'Status': False, 'Error': 'Товар не найден'}, status=400)
 
-        # Получаем или создаем корзину
-        order, created = Order.objects.get_or_create(
-            user=request.user,
-            status='basket'
-        )
-
-        # Добавляем товар в корзину
-        order_item, created = OrderItem.objects.get_or_create(
-            order=order,
-            product_info=product_info,
-            defaults={'quantity': quantity}
-        )
-
-        if not created:
-            order_item.quantity += quantity
-            order_item.save()
+        get_basket(request.user).add(product_info, quantity)
 
         return Response({'Status': True, 'Message': 'Товар добавлен в корзину'})
 
@@ -243,15 +493,43 @@ class CartRemoveView(generics.DestroyAPIView):
     permission_classes = [IsAuthenticated]
 
     def delete(self, request, *args, **kwargs):
-        product_info_id = request.data.get('product_info_id')
+        product_info_id = parse_id(request.data.get('product_info_id'))
+        if product_info_id is None:
+            return Response({'Status': False, 'Error': 'Неверный product_info_id'}, status=400)
 
-        try:
-            order = Order.objects.get(user=request.user, status='basket')
-            order_item = OrderItem.objects.get(order=order, product_info_id=product_info_id)
-            order_item.delete()
+        if get_basket(request.user).remove(product_info_id):
             return Response({'Status': True, 'Message': 'Товар удален из корзины'})
-        except (Order.DoesNotExist, OrderItem.DoesNotExist):
-            return Response({'Status': False, 'Error': 'Товар не найден в корзине'}, status=400)
+        return Response({'Status': False, 'Error': 'Товар не найден в корзине'}, status=400)
+
+
+class CartBatchView(APIView):
+    """Пакетное изменение корзины: строки add, set и remove одним запросом"""
+    permission_classes = [IsAuthenticated]
+
+    def post(self, request, *args, **kwargs):
+        lines = request.data.get('items') if hasattr(request.data, 'get') else request.data
+        changes, error = parse_batch(lines)
+        if error:
+            return Response({'Status': False, 'Error': error}, status=400)
+
+        # Удаляемые предложения не проверяются: их могли убрать из каталога после добавления в корзину
+        product_info_ids = [product_info_id for product_info_id, (op, quantity) in changes.items() if op != 'remove']
+        missing = sorted(set(product_info_ids) -
+                         set(ProductInfo.objects.filter(id__in=product_info_ids).values_list('id', flat=True)))
+        if missing:
+            return Response({'Status': False, 'Error': f'Товары не найдены: {missing}'}, status=400)
+
+        basket = get_basket(request.user)
+        basket.apply(changes)
+        items = basket_items(basket, Fieldset())
+        totals = serialize_basket_totals(basket.totals())
+        return Response({
+            'Status': True,
+            'Message': 'Корзина обновлена',
+            'Items': BasketItemSerializer(items, many=True, context={'request': request}).data,
+            'TotalQuantity': totals['total_quantity'],
+            'TotalPrice': totals['total_price']
+        })
 
 
 # ==================== КОНТАКТЫ ====================
@@ -279,13 +557,29 @@ class ContactDetailView(generics.RetrieveUpdateDestroyAPIView):
 
 # ==================== ЗАКАЗЫ ====================
 
-class OrderListView(generics.ListAPIView):
+class OrderListView(ConditionalGetMixin, FieldsetViewMixin, generics.ListAPIView):
     """Список заказов пользователя"""
     serializer_class = OrderSerializer
     permission_classes = [IsAuthenticated]
 
+    def get_etag_parts(self, request):
+        # Число заказов и последнее изменение, версии магазинов их товаров
+        orders = Order.objects.filter(user=request.user).exclude(status='basket')
+        marker = orders.aggregate(updated=Max('updated_at'), total=Count('id'))
+        shop_ids = (OrderItem.objects.filter(order__in=orders)
+                    .values_list('product_info__shop_id', flat=True).distinct())
+        return [request.user.id, marker['updated'], marker['total'], shop_versions(shop_ids)]
+
     def get_queryset(self):
-        return Order.objects.filter(user=self.request.user).exclude(status='basket')
+        fieldset = self.get_fieldset()
+        items = select_expanded(OrderItem.objects.all(), fieldset, select={
+            'items.product_info': 'product_info',
+            'items.product_info.product': 'product_info__product',
+            'items.product_info.product.category': 'product_info__product__category',
+            'items.product_info.shop': 'product_info__shop',
+        }, prefetch={'items.product_info.parameters': parameters_prefetch('product_info__parameters')})
+        return select_expanded(Order.objects.filter(user=self.request.user).exclude(status='basket'), fieldset,
+                               select={'contact': 'contact'}, prefetch={'items': Prefetch('items', queryset=items)})
 
 
 class OrderConfirmView(generics.CreateAPIView):
@@ -300,13 +594,26 @@ class OrderConfirmView(generics.CreateAPIView):
         except Contact.DoesNotExist:
             return Response({'Status': False, 'Error': 'Контакт не найден'}, status=400)
 
+        basket = get_basket(request.user)
         try:
             with transaction.atomic():
-                # Получаем корзину
-                order = Order.objects.get(user=request.user, status='basket')
+                # Получаем корзину: из Redis она записывается в БД только сейчас
+                order = basket.materialize()
+                if order is None:
+                    raise Order.DoesNotExist
+
+                # Блокируем строки предложений по возрастанию id, чтобы параллельные подтверждения
+                # не прочитали один остаток и не разминулись взаимной блокировкой
+                items = list(order.items.all())
+                product_infos = {
+                    product_info.id: product_info for product_info in ProductInfo.objects.select_for_update()
+                    .filter(id__in=[item.product_info_id for item in items]).order_by('id')
+                }
+                for item in items:
+                    item.product_info = product_infos[item.product_info_id]
 
-                # Проверяем наличие товаров
-                for item in order.items.all():
+                # Проверяем наличие товаров по заблокированным остаткам
+                for item in items:
                     if item.quantity > item.product_info.quantity:
                         return Response({
                             'Status': False,
@@ -318,10 +625,19 @@ class OrderConfirmView(generics.CreateAPIView):
                 order.contact = contact
                 order.save()
 
-                # Резервируем товары
-                for item in order.items.all():
+                # Резервируем товары. Кэш магазинов и хеши их последнего импорта
+                # сбрасывает сохранение предложений (signals.product_info_saved)
+                sold_out = []
+                for item in items:
+                    in_stock = item.product_info.quantity > 0
                     item.product_info.quantity -= item.quantity
                     item.product_info.save()
+                    # Из фасетов уходит только предложение, которое закончилось в этой транзакции
+                    if in_stock and item.product_info.quantity <= 0:
+                        sold_out.append(item.product_info_id)
+                # Закончившиеся предложения уходят из счетчиков фасетов
+                adjust_facets(disappeared=sold_out)
+                basket.confirmed(order)
 
                 # Отправляем email с подтверждением заказа
                 send_order_confirmation_email(order)
@@ -343,7 +659,6 @@ class PartnerUpdate(APIView):
     """
     Класс для обновления прайса от поставщика
     """
-
     def post(self, request, *args, **kwargs):
         # Проверяем аутентификацию
         if not request.user.is_authenticated:
@@ -356,87 +671,149 @@ class PartnerUpdate(APIView):
                             status=status.HTTP_403_FORBIDDEN)
 
         # Получаем файл из запроса
-        yaml_file = request.FILES.get('file')
-        if not yaml_file:
-            return Response({'Status': False, 'Error': 'YAML файл не предоставлен'},
+        price_file = request.FILES.get('file')
+        if not price_file:
+            return Response({'Status': False, 'Error': 'Файл прайс-листа не предоставлен'},
+                            status=status.HTTP_400_BAD_REQUEST)
+
+        # Формат: yaml, csv или ndjson - по content type или расширению файла
+        price_list_format = request.data.get('format') or detect_format(price_file.name, price_file.content_type)
+        if price_list_format not in PRICE_LIST_FORMATS:
+            return Response({'Status': False, 'Error': f'Неверный формат. Допустимые: {list(PRICE_LIST_FORMATS)}'},
+                            status=status.HTTP_400_BAD_REQUEST)
+
+        # Режим импорта: full - полная замена прайса, delta - запись только отличий
+        mode = request.data.get('mode', 'full')
+        if mode not in IMPORT_MODES:
+            return Response({'Status': False, 'Error': f'Неверный режим импорта. Допустимые: {list(IMPORT_MODES)}'},
                             status=status.HTTP_400_BAD_REQUEST)
 
+        # Асинхронный режим: файл сохраняется, импорт выполняет Celery
+        if str(request.data.get('async', '')).lower() in ('1', 'true'):
+            job = ImportJob.objects.create(user=request.user, file=price_file, mode=mode, format=price_list_format)
+            try:
+                task = import_price_list_async.delay(job.id)
+            except Exception as e:
+                # Брокер недоступен: задание не выполнится, сохраненный файл не нужен
+                job.file.delete(save=False)
+                job.state = 'failed'
+                job.errors.append(f'Не удалось поставить импорт в очередь: {str(e)}')
+                job.finished_at = timezone.now()
+                job.save(update_fields=['file', 'state', 'errors', 'finished_at'])
+                return Response({'Status': False, 'Error': 'Очередь импорта недоступна, повторите загрузку позже',
+                                 'JobId': job.id}, status=status.HTTP_503_SERVICE_UNAVAILABLE)
+            job.task_id = task.id
+            job.save(update_fields=['task_id'])
+            return Response({
+                'Status': True,
+                'Message': 'Импорт поставлен в очередь',
+                'JobId': job.id
+            }, status=status.HTTP_202_ACCEPTED)
+
         try:
-            # Читаем и парсим YAML
-            data = yaml.safe_load(yaml_file.read().decode('utf-8'))
+            # Хеш файла: повторная загрузка того же прайса не трогает БД
+            digest = file_digest(price_file)
+            result = check_not_modified(request.user, digest)
+            if result:
+                return Response(result)
+
+            # Предварительный проход: справочники создаются до блокировки магазина
+            summary = scan_price_list(price_file, price_list_format)
+            price_file.seek(0)
+
+            # Читаем файл потоково: товары разбираются по одному по мере импорта
+            price_list = PRICE_LIST_FORMATS[price_list_format](price_file)
 
             # Импортируем данные
-            result = self.import_data(data, request.user)
+            result = self.import_data(price_list, request.user, mode, digest, summary)
             return Response(result)
 
         except yaml.YAMLError as e:
             return Response({'Status': False, 'Error': f'Ошибка парсинга YAML: {str(e)}'},
                             status=status.HTTP_400_BAD_REQUEST)
+        except PriceListError as e:
+            return Response({'Status': False, 'Error': f'Ошибка в прайс-листе: {str(e)}'},
+                            status=status.HTTP_400_BAD_REQUEST)
         except Exception as e:
             return Response({'Status': False, 'Error': f'Ошибка импорта: {str(e)}'},
                             status=status.HTTP_400_BAD_REQUEST)
 
-    def import_data(self, data, user):
-        """Импорт данных из YAML"""
+    def import_data(self, data, user, mode='full', digest=None, summary=None):
+        """Импорт данных из прайс-листа (словаря или PriceList)"""
+        return import_price_list(data, user, mode, digest=digest, summary=summary)
+
+
+class PartnerStockUpdate(APIView):
+    """
+    Быстрое обновление остатков и цен без загрузки полного прайса
+    """
+
+    def post(self, request, *args, **kwargs):
+        # Проверяем аутентификацию
+        if not request.user.is_authenticated:
+            return Response({'Status': False, 'Error': 'Требуется авторизация'},
+                            status=status.HTTP_403_FORBIDDEN)
+
+        # Проверяем что пользователь - поставщик
+        if request.user.type != 'shop':
+            return Response({'Status': False, 'Error': 'Только для поставщиков'},
+                            status=status.HTTP_403_FORBIDDEN)
+
+        shop = Shop.objects.filter(user=request.user).first()
+        if not shop:
+            return Response({'Status': False, 'Error': 'Магазин не найден, сначала загрузите прайс'},
+                            status=status.HTTP_400_BAD_REQUEST)
+
+        # Принимаем как список, так и {"items": [...]}
+        items = request.data if isinstance(request.data, list) else request.data.get('items')
+        serializer = StockItemSerializer(data=items, many=True)
+        if not serializer.is_valid():
+            return Response({'Status': False, 'Errors': serializer.errors}, status=status.HTTP_400_BAD_REQUEST)
+
+        updated = update_stock(shop, serializer.validated_data)
+        return Response({
+            'Status': True,
+            'Message': f'Остатки обновлены. Магазин: {shop.name}',
+            'Received': len(serializer.validated_data),
+            'Updated': updated
+        })
+
+
+class PartnerImportStatus(APIView):
+    """
+    Состояние асинхронного импорта прайса
+    """
+    permission_classes = [IsAuthenticated]
+
+    def get(self, request, job_id, *args, **kwargs):
         try:
-            with transaction.atomic():
-                # Получаем или создаем магазин
-                shop, created = Shop.objects.get_or_create(
-                    name=data['shop'],
-                    defaults={'user': user, 'is_active': True}
-                )
-
-                # Если магазин уже существует, проверяем владельца
-                if not created and shop.user != user:
-                    return {'Status': False, 'Error': 'У вас нет прав на обновление этого магазина'}
-
-                # Обрабатываем категории
-                for category_data in data.get('categories', []):
-                    category, _ = Category.objects.get_or_create(
-                        id=category_data['id'],
-                        defaults={'name': category_data['name']}
-                    )
-                    category.shops.add(shop)
-                    category.save()
-
-                # Удаляем старые товары магазина
-                ProductInfo.objects.filter(shop=shop).delete()
-
-                # Обрабатываем товары
-                for product_data in data.get('goods', []):
-                    # Создаем или получаем базовый продукт
-                    product, _ = Product.objects.get_or_create(
-                        name=product_data['name'],
-                        category_id=product_data['category']
-                    )
-
-                    # Создаем информацию о товаре в магазине
-                    product_info = ProductInfo.objects.create(
-                        product=product,
-                        shop=shop,
-                        external_id=product_data['id'],
-                        model=product_data.get('model', ''),
-                        price=product_data['price'],
-                        price_rrc=product_data['price_rrc'],
-                        quantity=product_data['quantity']
-                    )
-
-                    # Обрабатываем параметры товара
-                    for param_name, param_value in product_data.get('parameters', {}).items():
-                        parameter, _ = Parameter.objects.get_or_create(name=param_name)
-                        ProductParameter.objects.create(
-                            product_info=product_info,
-                            parameter=parameter,
-                            value=str(param_value)
-                        )
-
-                return {
-                    'Status': True,
-                    'Message': f'Импорт завершен. Магазин: {shop.name}, Товаров: {len(data.get("goods", []))}'
-                }
+            job = ImportJob.objects.get(id=job_id, user=request.user)
+        except ImportJob.DoesNotExist:
+            return Response({'Status': False, 'Error': 'Задание импорта не найдено'}, status=404)
+
+        # Пока импорт идет, прогресс хранится в состоянии задачи Celery
+        if job.state == 'running' and job.task_id:
+            try:
+                task = AsyncResult(job.task_id)
+                if task.state == 'PROGRESS':
+                    job.processed = task.info.get('processed', job.processed)
+            except Exception:
+                pass
 
-        except Exception as e:
-            return {'Status': False, 'Error': f'Ошибка транзакции: {str(e)}'}
+        return Response({
+            'Status': True,
+            'JobId': job.id,
+            'State': job.state,
+            'Mode': job.mode,
+            'Processed': job.processed,
+            'Total': job.total,
+            'Throughput': job.throughput,
+            'Errors': job.errors,
+            'Result': job.result,
+            'CreatedAt': job.created_at,
+            'StartedAt': job.started_at,
+            'FinishedAt': job.finished_at
+        })
 
 
 # ==================== УПРАВЛЕНИЕ СТАТУСОМ ЗАКАЗА ====================